@@ -0,0 +1,64 @@
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from descarga import sha256_archivo
+from limpieza import parsear_csv, limpiar, deduplicar
+from snapshot import tipar
+
+
+# Backfill con varios archivos del MAG (releases mensuales/anuales u otros archivos regionales
+# con el mismo formato). Cada archivo se parsea y limpia en un proceso aparte y luego se
+# combinan en un solo frame para la carga.
+#
+# Regla de precedencia para claves (anio, mes, producto) repetidas entre archivos:
+# gana el archivo que aparece DESPUES en la lista de fuentes (el release mas reciente
+# corrige a los anteriores). Los directorios se expanden en orden alfabetico, que para los
+# archivos del portal (mag_preciosproductor_2025mayo.csv, ...) no siempre es cronologico,
+# asi que conviene pasar los archivos en el orden deseado.
+
+
+def expandir_fuentes(rutas):
+    """Lista ordenada de archivos CSV: las rutas se respetan y los directorios se expanden."""
+    archivos = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            archivos.extend(sorted(glob.glob(os.path.join(ruta, "*.csv"))))
+        else:
+            archivos.append(ruta)
+    if not archivos:
+        raise ValueError(f"No se encontraron archivos CSV en {rutas}")
+    return archivos
+
+
+def huella_fuentes(archivos):
+    """sha256 combinado de todos los archivos, en orden (cambia si cambia cualquiera o el orden)."""
+    sha = hashlib.sha256()
+    for ruta in archivos:
+        sha.update(sha256_archivo(ruta).encode("ascii"))
+    return sha.hexdigest()
+
+
+def procesar_archivo(ruta):
+    df = deduplicar(limpiar(parsear_csv(ruta)))
+    # tipos compactos para que el frame viaje mas liviano entre procesos
+    return tipar(df)
+
+
+def combinar_fuentes(archivos, procesos=None):
+    """Procesa los archivos en paralelo y resuelve las claves repetidas segun la precedencia."""
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        partes = list(pool.map(procesar_archivo, archivos))
+
+    for ruta, parte in zip(archivos, partes):
+        print(f"   {os.path.basename(ruta)}: {len(parte)} filas")
+
+    # cada parte ya no tiene claves repetidas, asi que keep='last' deja la del archivo mas tardio
+    df = pd.concat(partes, ignore_index=True)
+    filas = len(df)
+    df = df.drop_duplicates(subset=['anio', 'mes', 'producto'], keep='last')
+    print(f"[+] Backfill: {len(archivos)} archivos, {filas} filas, {filas - len(df)} claves resueltas por precedencia")
+    return tipar(df)
@@ -0,0 +1,229 @@
+import argparse
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+from carga_copy import conectar
+
+
+# Benchmark de contencion de las funciones de escritura: el mismo escenario que la pagina
+# de concurrencia (Aguacate Fuerte, 2013, Enero, precio 0 +- 0.5) con N escritores a la vez
+# sobre la misma clave. Compara insertar_precio_productor (SELECT ... FOR UPDATE y luego
+# INSERT o UPDATE) con upsert_precio_productor (un solo INSERT ... ON CONFLICT), con la
+# auditoria inmediata o diferida (app.auditoria_diferida = 'on', ver log_auditoria_pendiente).
+#   python backend/benchmark_concurrencia.py --dsn postgresql://postgres@localhost:5432/bench
+# Escribe en la base (y en log_auditoria): usar una base de pruebas.
+
+PROCEDIMIENTOS = {
+    "insertar_precio_productor": "SELECT insertar_precio_productor(%s, %s, %s, %s, %s, %s)",
+    "upsert_precio_productor": "SELECT upsert_precio_productor(%s, %s, %s, %s, %s, %s)",
+}
+
+PRODUCTO = "Aguacate Fuerte"
+ANIO = 2013
+MES = "Enero"
+# escenario clave_nueva: cada grupo de N operaciones usa una clave que todavia no existe,
+# todos los escritores la misma, asi compiten por insertarla. Las claves salen de los 12
+# meses de PRODUCTOS_NUEVAS productos de prueba en un solo año, cuya particion se crea al
+# preparar: asi se mide la carrera por la clave y no el CREATE/ATTACH de una particion
+ANIO_NUEVAS = 3000
+PRODUCTOS_NUEVAS = 1000
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto",
+         "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+
+def nombre_producto_nuevas(i):
+    return f"Benchmark clave nueva {i:04d}"
+
+
+def clave_nueva(k):
+    """(mes, producto) de la k-esima clave nueva, o None si ya se usaron todas."""
+    if k >= PRODUCTOS_NUEVAS * len(MESES):
+        return None
+    return MESES[k % len(MESES)], nombre_producto_nuevas(k // len(MESES))
+
+
+def preparar(dsn):
+    """
+    Crea el producto, los productos de prueba y la particion de ANIO_NUEVAS si no existen,
+    y guarda la fila original de la clave caliente.
+    """
+    conn = conectar(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO producto(nombre, unidad) VALUES (%s, 'Caja') ON CONFLICT (nombre) DO NOTHING",
+                    (PRODUCTO,))
+        cur.execute("INSERT INTO producto(nombre, unidad) "
+                    "SELECT format('Benchmark clave nueva %%s', lpad(i::TEXT, 4, '0')), 'Caja' "
+                    "FROM generate_series(0, %s - 1) i ON CONFLICT (nombre) DO NOTHING",
+                    (PRODUCTOS_NUEVAS,))
+        cur.execute("SELECT crear_particion_precio_productor(%s)", (ANIO_NUEVAS,))
+        cur.execute("SELECT id FROM producto WHERE nombre = %s", (PRODUCTO,))
+        producto_id = cur.fetchone()[0]
+        cur.execute("SELECT ponderado_usd, ponderado_usd_kg FROM precio_productor "
+                    "WHERE anio = %s AND mes = %s AND producto_id = %s", (ANIO, MES, producto_id))
+        original = cur.fetchone()
+    conn.close()
+    return producto_id, original
+
+
+def restaurar(dsn, producto_id, original):
+    conn = conectar(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM precio_productor WHERE anio >= %s", (ANIO_NUEVAS,))
+        cur.execute("DELETE FROM precio_productor WHERE anio = %s AND mes = %s AND producto_id = %s",
+                    (ANIO, MES, producto_id))
+        if original is not None:
+            cur.execute("INSERT INTO precio_productor(anio, mes, producto_id, ponderado_usd, ponderado_usd_kg) "
+                        "VALUES (%s, %s, %s, %s, %s)", (ANIO, MES, producto_id, *original))
+    conn.close()
+
+
+def limpiar(dsn):
+    """
+    Al terminar: borra los productos de prueba y las particiones de ANIO_NUEVAS en adelante
+    (tambien las que dejaban versiones anteriores, que usaban un año nuevo por clave).
+    Se llama despues de restaurar, con esas particiones ya vacias.
+    """
+    conn = conectar(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM producto WHERE nombre LIKE 'Benchmark clave nueva %%'")
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'precio_productor'::regclass "
+            "AND c.relname ~ '^precio_productor_p[0-9]{4}$' AND substr(c.relname, 19)::INT >= %s",
+            (ANIO_NUEVAS,))
+        particiones = [fila[0] for fila in cur.fetchall()]
+        for nombre in particiones:
+            cur.execute(f'DROP TABLE "{nombre}"')
+    conn.close()
+    print(f"[🧹] {len(particiones)} particiones de prueba borradas")
+
+
+def volcar_auditoria(dsn):
+    conn = conectar(dsn)
+    with conn, conn.cursor() as cur:
+        t0 = time.perf_counter()
+        cur.execute("SELECT volcar_auditoria_pendiente()")
+        eventos = cur.fetchone()[0]
+    conn.close()
+    return {"eventos_volcados": eventos, "volcado_ms": round((time.perf_counter() - t0) * 1000, 3)}
+
+
+def escritor(indice, dsn, sql, escenario, auditoria, escritores, barrera, fin, contador, latencias, errores):
+    conn = conectar(dsn)
+    conn.autocommit = True  # cada llamada es su propia transaccion, como un RPC
+    cur = conn.cursor()
+    if auditoria == "diferida":
+        cur.execute("SET app.auditoria_diferida = 'on'")
+    barrera.wait()
+    while time.perf_counter() < fin[0]:
+        if escenario == "clave_nueva":
+            with contador[1]:
+                clave = clave_nueva(contador[0] // escritores)
+                contador[0] += 1
+            if clave is None:
+                break  # se usaron todas las claves nuevas (queda en claves_agotadas)
+            anio, (mes, producto) = ANIO_NUEVAS, clave
+        else:
+            anio, mes, producto = ANIO, MES, PRODUCTO
+        params = (anio, mes, producto, round(random.uniform(-0.5, 0.5), 2),
+                  round(random.uniform(-0.3, 0.3), 2), f"usuario{indice + 1}")
+        t0 = time.perf_counter()
+        try:
+            cur.execute(sql, params)
+            cur.fetchall()
+            latencias.append((time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            errores[type(e).__name__] = errores.get(type(e).__name__, 0) + 1
+    conn.close()
+
+
+def correr(dsn, sql, escenario, auditoria, escritores, segundos):
+    latencias_por_hilo = [[] for _ in range(escritores)]
+    errores_por_hilo = [{} for _ in range(escritores)]
+    barrera = threading.Barrier(escritores + 1)
+    fin = [float("inf")]
+    # en clave_nueva los escritores avanzan juntos: cada grupo de N operaciones usa la misma clave
+    contador = [0, threading.Lock()]
+
+    hilos = [
+        threading.Thread(target=escritor, args=(i, dsn, sql, escenario, auditoria, escritores, barrera, fin, contador,
+                                                latencias_por_hilo[i], errores_por_hilo[i]))
+        for i in range(escritores)
+    ]
+    for h in hilos:
+        h.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    fin[0] = inicio + segundos
+    for h in hilos:
+        h.join()
+    transcurrido = time.perf_counter() - inicio
+
+    latencias = np.array([ms for hilo in latencias_por_hilo for ms in hilo])
+    errores = {}
+    for e in errores_por_hilo:
+        for nombre, n in e.items():
+            errores[nombre] = errores.get(nombre, 0) + n
+    return {
+        "escritores": escritores,
+        "operaciones": int(latencias.size),
+        "errores": errores,
+        "ops_por_segundo": round(latencias.size / transcurrido, 1),
+        "ms_p50": round(float(np.percentile(latencias, 50)), 3) if latencias.size else None,
+        "ms_p99": round(float(np.percentile(latencias, 99)), 3) if latencias.size else None,
+        # en clave_nueva: la corrida termino antes de tiempo por falta de claves
+        "claves_agotadas": escenario == "clave_nueva" and clave_nueva(contador[0] // escritores) is None,
+    }
+
+
+def imprimir_resumen(resultados):
+    print(f"\n{'escenario':>16} {'procedimiento':>26} {'auditoria':>10} {'N':>4} {'ops/s':>9} "
+          f"{'p50 ms':>9} {'p99 ms':>9} errores")
+    for r in resultados:
+        print(f"{r['escenario']:>16} {r['procedimiento']:>26} {r['auditoria']:>10} {r['escritores']:>4} "
+              f"{r['ops_por_segundo']:>9} {r['ms_p50'] or 0:>9.2f} {r['ms_p99'] or 0:>9.2f} {sum(r['errores'].values())}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de contencion de insertar/upsert_precio_productor")
+    parser.add_argument("--dsn", required=True, help="base de pruebas con el schema del proyecto")
+    parser.add_argument("--escritores", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--segundos", type=float, default=5, help="duracion de cada corrida")
+    parser.add_argument("--escenarios", nargs="+", default=["clave_existente", "clave_nueva"],
+                        choices=["clave_existente", "clave_nueva"])
+    parser.add_argument("--procedimientos", nargs="+", default=list(PROCEDIMIENTOS), choices=list(PROCEDIMIENTOS))
+    parser.add_argument("--auditorias", nargs="+", default=["inmediata", "diferida"], choices=["inmediata", "diferida"])
+    parser.add_argument("--salida", default="benchmark_concurrencia.json")
+    args = parser.parse_args(argv)
+
+    producto_id, original = preparar(args.dsn)
+    resultados = []
+    try:
+        for escenario in args.escenarios:
+            for nombre in args.procedimientos:
+                for auditoria in args.auditorias:
+                    for n in args.escritores:
+                        restaurar(args.dsn, producto_id, original)
+                        print(f"[⏱] {escenario} | {nombre} | auditoria {auditoria} | {n} escritores...")
+                        r = correr(args.dsn, PROCEDIMIENTOS[nombre], escenario, auditoria, n, args.segundos)
+                        if auditoria == "diferida":
+                            # el volcado no cuenta en la latencia de escritura, se mide aparte
+                            r.update(volcar_auditoria(args.dsn))
+                        resultados.append({"escenario": escenario, "procedimiento": nombre,
+                                           "auditoria": auditoria, **r})
+    finally:
+        restaurar(args.dsn, producto_id, original)
+        limpiar(args.dsn)
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    imprimir_resumen(resultados)
+    print(f"\n📄 Resultados guardados en '{args.salida}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from carga_copy import conectar
+from generar_datos_sinteticos import generar, perfil_real
+
+
+# Benchmark de la ingesta y de las funciones de analisis contra un Postgres local,
+# con datos sinteticos de distintos tamaños. La base indicada se VACIA en cada escala,
+# asi que debe ser una base de pruebas con el schema de database/schema_and_procedures.sql.
+#   python backend/benchmark_ingesta.py --dsn postgresql://postgres@localhost:5432/bench --escalas 10 100 1000
+
+SCRIPT_INGESTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insertardatafinal.py")
+
+CONSULTAS = {
+    "obtener_promedio_usd_por_anio": "SELECT * FROM obtener_promedio_usd_por_anio()",
+    "obtener_variacion_maxima_usd": "SELECT * FROM obtener_variacion_maxima_usd()",
+    # se pide el historico de un producto distinto en cada repeticion
+    "obtener_precios_historicos_completos": "SELECT * FROM obtener_precios_historicos_completos(%s)",
+}
+
+
+def reiniciar_base(conn):
+    with conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE precio_productor, producto, log_auditoria RESTART IDENTITY CASCADE")
+
+
+def medir_ingesta(ruta_csv, dsn, directorio):
+    """Corre la ingesta en modo COPY en un proceso aparte y devuelve su reporte por etapa."""
+    reporte = os.path.join(directorio, "reporte_ingesta.json")
+    env = {**os.environ, "DATABASE_URL": dsn}
+    # cwd aparte para que el snapshot y la cache no pisen los del repositorio
+    subprocess.run(
+        [sys.executable, SCRIPT_INGESTA, "--url", ruta_csv, "--modo", "copy", "--reporte", reporte],
+        cwd=directorio, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    with open(reporte, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def medir_consultas(conn, repeticiones):
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE producto; ANALYZE precio_productor;")
+        cur.execute("SELECT id FROM producto")
+        ids = [fila[0] for fila in cur.fetchall()]
+
+        resultados = {}
+        for nombre, sql in CONSULTAS.items():
+            tiempos = []
+            filas = 0
+            for _ in range(repeticiones):
+                params = (random.choice(ids),) if "%s" in sql else None
+                t0 = time.perf_counter()
+                cur.execute(sql, params)
+                filas = len(cur.fetchall())
+                tiempos.append((time.perf_counter() - t0) * 1000)
+            tiempos = np.array(tiempos)
+            resultados[nombre] = {
+                "filas": filas,
+                "ms_media": round(float(tiempos.mean()), 3),
+                "ms_p50": round(float(np.percentile(tiempos, 50)), 3),
+                "ms_p95": round(float(np.percentile(tiempos, 95)), 3),
+                "ms_max": round(float(tiempos.max()), 3),
+            }
+    conn.rollback()
+    return resultados
+
+
+def correr_escala(escala, perfil, dsn, repeticiones, semilla):
+    with tempfile.TemporaryDirectory(prefix=f"bench_x{escala:g}_") as directorio:
+        ruta_csv = os.path.join(directorio, "mag_sintetico.csv")
+        df = generar(escala, perfil, semilla)
+        df.to_csv(ruta_csv, sep=";", index=False, encoding="utf-8")
+        filas = len(df)
+        del df
+
+        conn = conectar(dsn)
+        try:
+            reiniciar_base(conn)
+            reporte = medir_ingesta(ruta_csv, dsn, directorio)
+            consultas = medir_consultas(conn, repeticiones)
+        finally:
+            conn.close()
+
+    etapas = {e["etapa"]: e for e in reporte["etapas"] if not e.get("omitida")}
+    return {
+        "escala": escala,
+        "filas_csv": filas,
+        "ingesta_segundos": reporte["segundos_total"],
+        "ingesta_filas_por_segundo": round(filas / max(reporte["segundos_total"], 1e-9)),
+        "rss_pico_mb": max(e["rss_pico_mb"] for e in etapas.values()),
+        "etapas": {nombre: e["segundos"] for nombre, e in etapas.items()},
+        "consultas": consultas,
+    }
+
+
+def imprimir_resumen(resultados):
+    print(f"\n{'escala':>8} {'filas':>10} {'ingesta s':>10} {'filas/s':>10} {'RSS MB':>8}"
+          + "".join(f" {nombre[:26]:>28}" for nombre in CONSULTAS))
+    for r in resultados:
+        print(f"{r['escala']:>8g} {r['filas_csv']:>10} {r['ingesta_segundos']:>10.2f} "
+              f"{r['ingesta_filas_por_segundo']:>10} {r['rss_pico_mb']:>8.0f}"
+              + "".join(f" {r['consultas'][n]['ms_p50']:>18.2f} ms (p50)" for n in CONSULTAS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta y consultas con datos sinteticos")
+    parser.add_argument("--dsn", required=True, help="base de pruebas (se vacia en cada escala)")
+    parser.add_argument("--escalas", type=float, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--base", default="datos.csv", help="archivo real que se usa como modelo")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default="benchmark_resultados.json")
+    args = parser.parse_args(argv)
+
+    perfil = perfil_real(args.base)
+    resultados = []
+    for escala in args.escalas:
+        print(f"[⏱] Escala x{escala:g}...")
+        resultados.append(correr_escala(escala, perfil, args.dsn, args.repeticiones, args.semilla))
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    imprimir_resumen(resultados)
+    print(f"\n📄 Resultados guardados en '{args.salida}'")
+
+
+if __name__ == "__main__":
+    main()
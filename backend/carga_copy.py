@@ -0,0 +1,108 @@
+import io
+import os
+
+import psycopg2
+
+
+# Carga masiva con conexion directa a Postgres (COPY FROM STDIN) en lugar de la API REST.
+# Para probar contra un Postgres local:
+#   DATABASE_URL=postgresql://postgres@localhost:5432/precios MODO_CARGA=copy python backend/insertardatafinal.py
+
+FILAS_POR_COPY = 100_000  # el frame se manda por partes para no armar todo el CSV en memoria
+
+SQL_STAGING = """
+    CREATE TEMP TABLE staging_precio (
+        anio INT,
+        mes TEXT,
+        producto TEXT,
+        unidad TEXT,
+        usd NUMERIC,
+        usd_kg NUMERIC
+    ) ON COMMIT DROP
+"""
+
+SQL_COPY = "COPY staging_precio (anio, mes, producto, unidad, usd, usd_kg) FROM STDIN WITH (FORMAT csv)"
+
+# Un solo statement: crea los productos que falten y hace upsert de todos los precios.
+# Los productos recien insertados no son visibles para el resto del statement,
+# por eso se unen con los existentes a traves de RETURNING.
+SQL_MERGE = """
+    WITH nuevos AS (
+        INSERT INTO producto (nombre, unidad)
+        SELECT DISTINCT ON (s.producto) s.producto, s.unidad
+        FROM staging_precio s
+        WHERE s.producto IS NOT NULL
+        ORDER BY s.producto
+        ON CONFLICT (nombre) DO NOTHING
+        RETURNING id, nombre
+    ),
+    ids AS (
+        SELECT id, nombre FROM producto
+        UNION ALL
+        SELECT id, nombre FROM nuevos
+    ),
+    upsert AS (
+        INSERT INTO precio_productor (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT DISTINCT ON (s.anio, s.mes, i.id)
+            s.anio, s.mes, i.id, s.usd, COALESCE(s.usd_kg, 0)
+        FROM staging_precio s
+        JOIN ids i ON i.nombre = s.producto
+        WHERE s.usd IS NOT NULL
+        ORDER BY s.anio, s.mes, i.id
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        -- las filas que no cambiaron no se reescriben (recarga incremental)
+        WHERE (precio_productor.ponderado_usd, precio_productor.ponderado_usd_kg)
+              IS DISTINCT FROM (EXCLUDED.ponderado_usd, EXCLUDED.ponderado_usd_kg)
+        RETURNING 1
+    )
+    SELECT
+        (SELECT count(*) FROM nuevos) AS productos_nuevos,
+        (SELECT count(*) FROM upsert) AS precios_cargados,
+        (SELECT count(*) FROM staging_precio WHERE usd IS NULL) AS omitidos_usd_nulo
+"""
+
+# particiones de los años del archivo, antes del merge para que nada caiga en precio_productor_default
+SQL_PARTICIONES = "SELECT * FROM crear_particiones_anios(%s)"
+
+COLUMNAS_STAGING = ["anio", "mes", "producto", "unidad", "usd", "usd_kg"]
+
+
+def conectar(dsn=None):
+    conn = psycopg2.connect(dsn or os.getenv("DATABASE_URL"))
+    conn.set_client_encoding("UTF8")  # los nombres de productos llevan tildes
+    return conn
+
+
+def copiar_a_staging(cur, df):
+    """Manda el frame limpio a la tabla temporal con COPY, en bloques de FILAS_POR_COPY."""
+    datos = df[COLUMNAS_STAGING]
+    for inicio in range(0, len(datos), FILAS_POR_COPY):
+        buffer = io.StringIO()
+        datos.iloc[inicio:inicio + FILAS_POR_COPY].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cur.copy_expert(SQL_COPY, buffer)
+
+
+def cargar_con_copy(conn, df):
+    """Carga producto y precio_productor en una sola transaccion. Devuelve los conteos del merge."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_STAGING)
+            copiar_a_staging(cur, df)
+            cur.execute(SQL_PARTICIONES, (sorted(int(a) for a in df["anio"].unique()),))
+            particiones = [fila[0] for fila in cur.fetchall()]
+            cur.execute(SQL_MERGE)
+            productos_nuevos, precios_cargados, omitidos = cur.fetchone()
+
+    print(f"[✔] COPY: {productos_nuevos} productos nuevos, {precios_cargados} precios nuevos o actualizados")
+    if omitidos:
+        print(f"[!] {omitidos} filas sin usd no se cargaron")
+    if particiones:
+        print(f"[✔] Particiones nuevas: {', '.join(particiones)}")
+    return {
+        "productos_nuevos": productos_nuevos,
+        "precios_cargados": precios_cargados,
+        "omitidos_usd_nulo": omitidos,
+    }
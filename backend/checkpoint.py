@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+
+# Journal de la carga por lotes: guarda que rangos de filas ya se confirmaron en la base,
+# junto con el hash del archivo de entrada y de las filas a subir. Si la corrida se cae,
+# la siguiente retoma solo los rangos que faltan (siempre que la entrada sea la misma).
+
+JOURNAL_LOCAL = "carga.journal"
+
+
+def huella_frame(df):
+    """sha256 del contenido del frame; cambia si cambian las filas o su orden."""
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+
+class JournalCarga:
+
+    def __init__(self, ruta, sha_archivo, sha_datos, total):
+        self.ruta = ruta
+        self.total = total
+        self.confirmados = []
+        self._lock = threading.Lock()
+        cabecera = {"tipo": "inicio", "archivo": sha_archivo, "datos": sha_datos, "total": total}
+
+        previo, largo_valido = self._leer()
+        if previo and previo[0] == cabecera:
+            self.confirmados = [(e["inicio"], e["fin"]) for e in previo[1:] if e.get("tipo") == "lote"]
+            hechas = sum(fin - inicio for inicio, fin in self.confirmados)
+            print(f"[↺] Retomando carga: {hechas} / {total} filas ya confirmadas")
+            # se corta la linea a medio escribir, si no la proxima entrada quedaria pegada a ella
+            os.truncate(ruta, largo_valido)
+            self._archivo = open(ruta, "a", encoding="utf-8")
+        else:
+            if previo:
+                print("[!] El journal anterior es de otra entrada, se empieza de cero")
+            self._archivo = open(ruta, "w", encoding="utf-8")
+            self._escribir(cabecera)
+
+    def _leer(self):
+        """Entradas del journal y largo en bytes hasta el final de la ultima linea completa."""
+        if not os.path.exists(self.ruta):
+            return [], 0
+        entradas = []
+        largo_valido = 0
+        with open(self.ruta, "rb") as f:
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break  # ultima linea a medio escribir si el proceso murio
+                largo_valido += len(linea)
+                try:
+                    entradas.append(json.loads(linea))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    # una linea rota (de un journal escrito antes de cortar la linea a medio
+                    # escribir) no invalida los lotes confirmados despues
+                    continue
+        return entradas, largo_valido
+
+    def _escribir(self, entrada):
+        self._archivo.write(json.dumps(entrada) + "\n")
+        self._archivo.flush()
+        os.fsync(self._archivo.fileno())
+
+    def registrar(self, inicio, fin):
+        with self._lock:
+            self.confirmados.append((inicio, fin))
+            self._escribir({"tipo": "lote", "inicio": inicio, "fin": fin})
+
+    def rangos_pendientes(self):
+        """Rangos (inicio, fin) de [0, total) que todavia no estan confirmados."""
+        pendientes = []
+        cursor = 0
+        for inicio, fin in sorted(self.confirmados):
+            if inicio > cursor:
+                pendientes.append((cursor, inicio))
+            cursor = max(cursor, fin)
+        if cursor < self.total:
+            pendientes.append((cursor, self.total))
+        return pendientes
+
+    def finalizar(self):
+        # la carga termino completa, el journal ya no hace falta
+        self._archivo.close()
+        os.remove(self.ruta)
@@ -0,0 +1,141 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+
+# Cache de descargas del portal de datos abiertos.
+# Se guarda el archivo crudo junto con su ETag/Last-Modified y sha256, y las siguientes
+# corridas hacen un GET condicional: si el servidor responde 304 no se baja nada.
+# Se puede probar con un servidor local, por ejemplo: python -m http.server 8000
+
+CACHE_DIR = os.getenv("CACHE_DESCARGAS", ".cache_descargas")
+TIMEOUT = 60
+BLOQUE = 1024 * 1024
+
+
+def _rutas(url, directorio):
+    clave = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(directorio, clave)
+    return base + ".dat", base + ".json", base + ".lock"
+
+
+@contextmanager
+def _bloqueo(ruta_lock):
+    # varias corridas a la vez comparten la misma copia: la segunda espera a que termine la primera
+    with open(ruta_lock, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _leer_meta(ruta_meta):
+    if not os.path.exists(ruta_meta):
+        return {}
+    with open(ruta_meta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _escribir_json(ruta, datos):
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2)
+    os.replace(tmp, ruta)
+
+
+def descargar_con_cache(url, directorio=CACHE_DIR):
+    """
+    Devuelve (ruta_local, sha256, cambio) del archivo en url.
+
+    cambio es False cuando el servidor respondio 304 o el contenido bajado es identico al guardado.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta_datos, ruta_meta, ruta_lock = _rutas(url, directorio)
+
+    with _bloqueo(ruta_lock):
+        meta = _leer_meta(ruta_meta)
+        hay_cache = bool(meta) and os.path.exists(ruta_datos)
+
+        headers = {}
+        if hay_cache:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            resp = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            if not hay_cache:
+                raise
+            print(f"[!] No se pudo consultar {url} ({e}), se usa la copia en cache")
+            return ruta_datos, meta["sha256"], False
+
+        with resp:
+            if resp.status_code == 304 and hay_cache:
+                print("✅ El CSV no cambio en el servidor (304), se usa la copia en cache")
+                return ruta_datos, meta["sha256"], False
+            resp.raise_for_status()
+
+            # se baja a un temporal en el mismo directorio y luego se reemplaza de forma atomica
+            sha = hashlib.sha256()
+            fd, tmp = tempfile.mkstemp(dir=directorio, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for bloque in resp.iter_content(BLOQUE):
+                        f.write(bloque)
+                        sha.update(bloque)
+                digest = sha.hexdigest()
+                cambio = not hay_cache or digest != meta.get("sha256")
+                if cambio:
+                    os.replace(tmp, ruta_datos)
+                else:
+                    os.remove(tmp)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+            _escribir_json(ruta_meta, {
+                "url": url,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "sha256": digest,
+                "tamano": os.path.getsize(ruta_datos),
+                "descargado_en": datetime.now().isoformat(timespec="seconds"),
+            })
+
+    if cambio:
+        print(f"🔄 CSV descargado ({digest[:12]})")
+    else:
+        print("✅ El CSV descargado es identico al que estaba en cache")
+    return ruta_datos, digest, cambio
+
+
+def sha256_archivo(ruta):
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(BLOQUE), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def requiere_procesar(sha256, ruta_procesada):
+    """True si ruta_procesada no existe o se genero a partir de otro archivo crudo."""
+    origen = ruta_procesada + ".origen"
+    if not os.path.exists(ruta_procesada) or not os.path.exists(origen):
+        return True
+    with open(origen, encoding="utf-8") as f:
+        return f.read().strip() != sha256
+
+
+def marcar_procesado(sha256, ruta_procesada):
+    with open(ruta_procesada + ".origen", "w", encoding="utf-8") as f:
+        f.write(sha256)
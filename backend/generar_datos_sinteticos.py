@@ -0,0 +1,107 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+# Genera un CSV con el mismo formato que el del MAG (separado por ';', columnas pp_*)
+# pero N veces mas grande: mas productos y mas meses, con la misma proporcion de claves
+# duplicadas, NaN y huecos que el archivo real (datos.csv).
+#   python backend/generar_datos_sinteticos.py --escala 100 --salida mag_sintetico_x100.csv
+
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+         'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+MES_NUM = {m: i for i, m in enumerate(MESES)}
+
+
+def perfil_real(ruta="datos.csv"):
+    """Tasas y precios base del archivo real, que se usan como modelo para los datos sinteticos."""
+    df = pd.read_csv(ruta)
+    df['producto'] = df['producto'].str.strip()
+    claves = df.drop_duplicates(subset=['anio', 'mes', 'producto'])
+    periodos = claves['anio'] * 12 + claves['mes'].map(MES_NUM)
+    n_meses = periodos.max() - periodos.min() + 1
+
+    base = claves.groupby('producto').agg(unidad=('unidad', 'first'), usd=('usd', 'median'))
+    # cuantos kg tiene cada unidad (Saca aprox. 200 lb, Caja aprox. 43 lb, ...)
+    base['kg_por_unidad'] = (claves['usd'] / claves['usd_kg']).groupby(claves['producto']).median()
+    base['kg_por_unidad'] = base['kg_por_unidad'].replace([np.inf, -np.inf], np.nan).fillna(1.0)
+
+    return {
+        "productos": base.reset_index(),
+        "n_meses": int(n_meses),
+        "ultimo_periodo": int(periodos.max()),
+        "densidad": len(claves) / (len(base) * n_meses),  # no todos los productos tienen todos los meses
+        "tasa_duplicados": 1 - len(claves) / len(df),
+        "tasa_usd_nulo": float(df['usd'].isna().mean()),
+        "tasa_usd_kg_nulo": float(df['usd_kg'].isna().mean()),
+    }
+
+
+def generar(escala, perfil, semilla=42):
+    rng = np.random.default_rng(semilla)
+    base = perfil["productos"]
+
+    # el crecimiento se reparte entre productos (escala^2/3) y meses (escala^1/3)
+    n_productos = max(1, round(len(base) * escala ** (2 / 3)))
+    n_meses = max(1, round(perfil["n_meses"] * escala ** (1 / 3)))
+
+    idx_base = np.arange(n_productos) % len(base)
+    copia = np.arange(n_productos) // len(base)
+    nombres = base['producto'].to_numpy(dtype=object)[idx_base]
+    nombres = np.where(copia == 0, nombres, nombres + " " + copia.astype(str).astype(object))
+    unidades = base['unidad'].to_numpy(dtype=object)[idx_base]
+
+    # precios: caminata aleatoria en escala log alrededor de la mediana real de cada producto
+    usd_inicial = base['usd'].to_numpy()[idx_base] * rng.lognormal(0, 0.2, n_productos)
+    pasos = rng.normal(0, 0.04, (n_productos, n_meses))
+    usd = usd_inicial[:, None] * np.exp(np.cumsum(pasos, axis=1))
+    usd_kg = usd / base['kg_por_unidad'].to_numpy()[idx_base][:, None]
+
+    # los periodos terminan en el ultimo mes real y van hacia atras
+    periodos = perfil["ultimo_periodo"] - n_meses + 1 + np.arange(n_meses)
+    prod_idx = np.repeat(np.arange(n_productos), n_meses)
+    per = np.tile(periodos, n_productos)
+
+    presente = rng.random(prod_idx.size) < perfil["densidad"]
+    prod_idx, per = prod_idx[presente], per[presente]
+    usd, usd_kg = usd.ravel()[presente].round(2), usd_kg.ravel()[presente].round(2)
+
+    usd[rng.random(usd.size) < perfil["tasa_usd_nulo"]] = np.nan
+    usd_kg[rng.random(usd_kg.size) < perfil["tasa_usd_kg_nulo"]] = np.nan
+
+    df = pd.DataFrame({
+        "pp_anio": (per // 12).astype(np.int32),
+        "pp_mes": pd.Categorical.from_codes(per % 12, MESES),
+        "pp_producto": pd.Categorical(nombres[prod_idx]),
+        "pp_unidad": pd.Categorical(unidades[prod_idx]),
+        "pp_ponderado_usd": usd,
+        "pp_ponderado_usd_kg": usd_kg,
+    })
+
+    # claves repetidas con otro precio, como pasa en el archivo real
+    n_dup = int(round(len(df) * perfil["tasa_duplicados"]))
+    if n_dup:
+        dup = df.iloc[rng.choice(len(df), n_dup, replace=False)].copy()
+        dup["pp_ponderado_usd"] = (dup["pp_ponderado_usd"] * rng.uniform(0.9, 1.1, n_dup)).round(2)
+        df = pd.concat([df, dup], ignore_index=True)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera datos sinteticos con el formato del CSV del MAG")
+    parser.add_argument("--escala", type=float, default=10, help="tamaño relativo al archivo real (10 = 10x)")
+    parser.add_argument("--salida", default=None)
+    parser.add_argument("--base", default="datos.csv", help="archivo real que se usa como modelo")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    salida = args.salida or f"mag_sintetico_x{args.escala:g}.csv"
+    df = generar(args.escala, perfil_real(args.base), args.semilla)
+    df.to_csv(salida, sep=";", index=False, encoding="utf-8")
+    print(f"💾 {len(df)} filas ({df['pp_producto'].nunique()} productos) guardadas en '{salida}'")
+    return salida
+
+
+if __name__ == "__main__":
+    main()
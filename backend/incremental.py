@@ -0,0 +1,79 @@
+import hashlib
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+
+from preparacion import COLUMNAS_PRECIO
+
+
+# Carga incremental: la base devuelve una huella por (producto, año) de lo que ya esta en
+# precio_productor (obtener_huellas_precios) y solo se suben los grupos cuya huella no
+# coincide con la del CSV. Los precios se comparan redondeados al centavo, asi que una
+# correccion chica (0.01) cuenta como cambio.
+
+COLUMNAS_GRUPO = ["producto_id", "anio"]
+CENTAVO = Decimal("0.01")
+
+# mismos nombres que acepta mes_a_numero() en la base
+NUMERO_MES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+
+def obtener_existentes(supabase, anios=None):
+    """Huella de cada (producto_id, anio) ya cargado, solo de los años anios (None = todos)."""
+    params = {"p_anios": [int(a) for a in anios]} if anios is not None else {}
+    res = supabase.rpc("obtener_huellas_precios", params).execute()
+    filas = [clave.split(":") + [huella] for clave, huella in (res.data or {}).items()]
+    existentes = pd.DataFrame(filas, columns=COLUMNAS_GRUPO + ["huella"])
+    return existentes.astype({"producto_id": np.int64, "anio": np.int64})
+
+
+def _centavos(valores):
+    # mismo texto que round(x, 2)::TEXT en la base. NUMERIC redondea los empates (x.xx5)
+    # alejandose de cero, np.round los lleva al par; y se parte del texto del float, que es
+    # lo que se manda a la base, no de su valor binario (1.005 es 1.00499... en binario)
+    textos = []
+    for v in valores.to_numpy(dtype=np.float64):
+        if v != v:
+            textos.append("")
+            continue
+        centavos = Decimal(repr(float(v))).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+        textos.append(str(abs(centavos) if centavos == 0 else centavos))  # sin '-0.00'
+    return pd.Series(textos, index=valores.index)
+
+
+def calcular_huellas(datos_finales):
+    """Huella de cada (producto_id, anio) del CSV, armada igual que obtener_huellas_precios()."""
+    mes = datos_finales["mes"].str.strip().str.lower().map(NUMERO_MES).astype("Int64")
+    lineas = (mes.astype(str).replace("<NA>", "") + "|" + _centavos(datos_finales["ponderado_usd"])
+              + "|" + _centavos(datos_finales["ponderado_usd_kg"]))
+    huellas = (
+        lineas.groupby([datos_finales["producto_id"], datos_finales["anio"]])
+        .agg(lambda grupo: hashlib.md5(";".join(sorted(grupo)).encode()).hexdigest())
+        .rename("huella")
+        .reset_index()
+    )
+    return huellas
+
+
+def filtrar_cambios(datos_finales, existentes):
+    """Deja solo las filas de los (producto, año) que no existen o cuya huella cambio."""
+    if existentes.empty:
+        print(f"[+] Incremental: base vacia, se suben las {len(datos_finales)} filas")
+        return datos_finales
+
+    comparado = calcular_huellas(datos_finales).merge(
+        existentes, on=COLUMNAS_GRUPO, how="left", suffixes=("", "_db"), indicator=True
+    )
+    nuevos = comparado["_merge"] == "left_only"
+    cambiados = ~nuevos & (comparado["huella"] != comparado["huella_db"])
+    subir = comparado.loc[nuevos | cambiados, COLUMNAS_GRUPO]
+
+    delta = datos_finales.merge(subir, on=COLUMNAS_GRUPO)[COLUMNAS_PRECIO]
+    delta.attrs = datos_finales.attrs
+    print(f"[+] Incremental: {nuevos.sum()} grupos (producto, año) nuevos, {cambiados.sum()} con "
+          f"precios distintos, {len(comparado) - len(subir)} sin cambios -> {len(delta)} filas a subir")
+    return delta
@@ -1,12 +1,23 @@
-import pandas as pd
+import argparse
+import os
+
 from supabase import create_client
 from dotenv import load_dotenv
-import os
+from backfill import expandir_fuentes, huella_fuentes, combinar_fuentes
+from carga_copy import conectar, cargar_con_copy
+from checkpoint import JOURNAL_LOCAL, JournalCarga, huella_frame
+from descarga import descargar_con_cache, sha256_archivo, requiere_procesar, marcar_procesado
+from incremental import obtener_existentes, filtrar_cambios
+from limpieza import parsear_csv, limpiar, deduplicar
+from perfil import PerfilEtapas
+from preparacion import productos_faltantes, preparar_registros, reportar_omitidos
+from snapshot import SNAPSHOT_LOCAL, guardar_snapshot, cargar_snapshot
+from subida_paralela import SubidorAdaptativo
 
 
 CSV_URL = "https://datosabiertos.gob.ec/dataset/6bc34498-caaa-4eb9-b75e-322347cb0e85/resource/3d30ad84-965a-45fc-a2b0-1d940ec4f748/download/mag_preciosproductor_2025mayo.csv"
 CSV_LOCAL = "datos.csv" #el nombre para descargar el dataset limopio
-
+REPORTE_LOCAL = "reporte_ingesta.json"
 
 #SELECT setval('public.producto_id_seq', 1,true);
 #select setval('precio_productor_id_seq',1,true);
@@ -16,144 +27,168 @@ CSV_LOCAL = "datos.csv" #el nombre para descargar el dataset limopio
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# -----Leer CSV------
-
-
-DESCARGAR_API = True #esto es para que ya no vuelva a descargar desde api si esta localmente, al principio es true
-
-
-if DESCARGAR_API:
-
-    print("🔄 Descargando CSV...")
-    df = pd.read_csv(CSV_URL, delimiter=";")
-    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
-    print("✅ Datos cargados:", df.shape)
-    print("Columnas del DataFrame:", df.columns.tolist())
-# renombramos 
-    df = df.rename(columns={
-        'pp_anio': 'anio',
-        'pp_mes': 'mes',
-        'pp_producto': 'producto',
-        'pp_unidad': 'unidad',
-        'pp_ponderado_usd': 'usd',
-        'pp_ponderado_usd_kg': 'usd_kg'
-    })
-
-    # Convertir a numérico y reemplazar errores por NaN
-    df['usd'] = pd.to_numeric(df['usd'], errors='coerce')
-    df['usd_kg'] = pd.to_numeric(df['usd_kg'], errors='coerce')
-
-    df = df.dropna(subset=['producto', 'anio'])  # eliminar filas con datos clave nulos
-
-# aqui le estoy guardando localmente, pero medio xd porque luego le vuelvo a cargar, esto solo es para que pueda visualizar, solo sirve la primera vez, luego mejor desactivar el descargaer desde api
-    df.to_csv(CSV_LOCAL, index=False, encoding='utf-8')
-    print(f"💾 CSV procesado guardado como '{CSV_LOCAL}'")
-
-
-df = pd.read_csv("datos.csv")
-df['producto'] = df['producto'].str.strip()
-
-
-print(f"[+] Registros listos para insertar: {df.shape}")
-df = df.drop_duplicates(subset=['anio', 'mes', 'producto'], keep='first')
-print(f"[+] Registros listos para insertar: {df.shape}")
-
-
-#En esta seccion inserto los productos
-
-df2 = df.copy()
-df2 = df2.drop('anio', axis=1)
-df2 = df2.drop('mes', axis=1)
-df2 = df2.drop('usd', axis=1)
-df2 = df2.drop('usd_kg', axis=1)
-
-df2 = df2.drop_duplicates(subset=['producto'])
-df2 = df2.rename(columns={'producto':'nombre'})
-
-print("forma es" , df2.shape)
-
-batchproductos = df2.to_dict(orient='records')
-
-supabase.table('producto').insert(batchproductos).execute()
-
-# Obtener productos existentes
-producto_resp = supabase.table("producto").select("id,nombre").execute()
-producto_data = producto_resp.data
-producto_map = {p['nombre']: p['id'] for p in producto_data}
-
-
-
-
-
-
-# Preparar registros
-registros = []
-nuevos_productos = {}
-for i, row in df.iterrows():
-    nombre_producto = row['producto']
-    
-    # Si no existe, agregarlo
-    if nombre_producto not in producto_map:
-        nuevos_productos[nombre_producto] = row['unidad']
-
-    # Guardamos los datos igual, asignando el producto_id más adelante
-
-    
-
-
-    registros.append({
-        "anio": int(row['anio']),
-        "mes": row['mes'],
-        "producto_nombre": nombre_producto,  # temporal
-        "unidad": row['unidad'],            # para crear si no existe
-        "ponderado_usd": float(row['usd']),
-        "ponderado_usd_kg": float(row['usd_kg'])
-    })
-
-# Insertar nuevos productos en batch
-if nuevos_productos:
-    print(f"[+] Insertando {len(nuevos_productos)} productos nuevos...")
-    nuevos = [{"nombre": nombre, "unidad": unidad} for nombre, unidad in nuevos_productos.items()]
-    inserted = supabase.table("producto").insert(nuevos).execute().data
-    for p in inserted:
-        producto_map[p['nombre']] = p['id']
-    print("[✔] Nuevos productos insertados")
-
-# Asignar IDs y limpiar registros para inserción
-datos_finales = []
-for r in registros:
-    nombre = r["producto_nombre"]
-    producto_id = producto_map.get(nombre)
-    if producto_id is None:
-        print(f"[!] No se pudo asignar ID para: {nombre}")
-        continue
-
-
-    if pd.isna(r["ponderado_usd"]):
-        print(f"SE ACABO TODO SEÑORES {r}")
-        continue
-    
-    if pd.isna(r["ponderado_usd_kg"]):
-        r["ponderado_usd_kg"] = 0
-        print(f"[!] Saltando fila con NaN: {r}")
-        
 
-    datos_finales.append({
-        "anio": r["anio"],
-        "mes": r["mes"],
-        "producto_id": producto_id,
-        "ponderado_usd": float(r["ponderado_usd"]),
-        "ponderado_usd_kg": float(r["ponderado_usd_kg"])
-    })
 
-print(f"[+] Registros listos para insertar: {len(datos_finales)}")
-input("... presiona enter para continuar")
-# Insertar en batches
-batch_size = 100
-total = len(datos_finales)
-for i in range(0, total, batch_size):
-    batch = datos_finales[i:i+batch_size]
-    supabase.table("precio_productor").insert(batch).execute()
-    print(f"[✔] Insertados {i + len(batch)} / {total}")
+# -----Etapas------
+
+def obtener_productos_rest(supabase, pagina=1000):
+    # PostgREST devuelve como maximo 1000 filas por pedido
+    producto_map = {}
+    inicio = 0
+    while True:
+        data = supabase.table("producto").select("id,nombre").order("id").range(inicio, inicio + pagina - 1).execute().data
+        producto_map.update({p['nombre']: p['id'] for p in data})
+        if len(data) < pagina:
+            return producto_map
+        inicio += pagina
+
+
+def cargar_productos_rest(supabase, df):
+    """Inserta los productos que falten y devuelve el mapa nombre -> id."""
+    producto_map = obtener_productos_rest(supabase)
+
+    nuevos = productos_faltantes(df, producto_map)
+    if nuevos:
+        print(f"[+] Insertando {len(nuevos)} productos nuevos...")
+        # si el producto ya existe no se vuelve a insertar (nombre es UNIQUE)
+        supabase.table("producto").upsert(nuevos, on_conflict="nombre", ignore_duplicates=True).execute()
+        producto_map = obtener_productos_rest(supabase)
+        print("[✔] Nuevos productos insertados")
+    return producto_map
+
+
+def cargar_precios_rest(supabase, datos_finales, sha_crudo, trabajadores):
+    # Insertar en batches, varios en paralelo y con tamaño adaptativo
+    # upsert en vez de insert para que reintentar un lote que si alcanzo a guardarse no falle por el UNIQUE
+    def enviar_lote(batch):
+        supabase.table("precio_productor").upsert(batch, on_conflict="anio,mes,producto_id").execute()
+
+    # particiones de los años del archivo antes de subir, para que nada caiga en precio_productor_default
+    anios = sorted(int(a) for a in datos_finales["anio"].unique())
+    particiones = supabase.rpc("crear_particiones_anios", {"p_anios": anios}).execute().data or []
+    if particiones:
+        print(f"[✔] {len(particiones)} particiones nuevas de precio_productor")
+
+    # el journal anota cada rango confirmado; si la corrida se cae, la siguiente sigue desde ahi
+    journal = JournalCarga(JOURNAL_LOCAL, sha_crudo, huella_frame(datos_finales), len(datos_finales))
+    subidor = SubidorAdaptativo(enviar_lote, trabajadores=trabajadores)
+    subidas = subidor.subir(datos_finales, rangos=journal.rangos_pendientes(), al_confirmar=journal.registrar)
+    journal.finalizar()
+    return subidas
+
+
+def leer_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Ingesta de precios al productor (MAG) en la base")
+    parser.add_argument("--url", default=CSV_URL, help="URL o ruta local del CSV del MAG")
+    # backfill: varios archivos (o directorios con CSV); si una clave se repite gana el archivo que va despues
+    parser.add_argument("--fuentes", nargs="+", help="archivos o directorios para backfill (en lugar de --url)")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos para el backfill (por defecto, uno por nucleo)")
+    # "rest": inserta por la API de supabase | "copy": conexion directa (DATABASE_URL) con COPY FROM STDIN
+    parser.add_argument("--modo", choices=["rest", "copy"], default=os.getenv("MODO_CARGA", "rest"))
+    # solo modo rest: compara contra lo que ya esta cargado y solo sube filas nuevas o con precio
+    # distinto. En modo copy no aplica: el merge en la base ya deja sin tocar las filas que no
+    # cambiaron (IS DISTINCT FROM), asi que siempre es incremental del lado de la base
+    parser.add_argument("--incremental", action="store_true", default=os.getenv("INCREMENTAL", "0") == "1")
+    # ademas del snapshot arrow, exportar el dataset limpio a CSV
+    parser.add_argument("--exportar-csv", action="store_true", default=os.getenv("EXPORTAR_CSV", "0") == "1")
+    parser.add_argument("--trabajadores", type=int, default=int(os.getenv("SUBIDA_TRABAJADORES", "4")))
+    parser.add_argument("--reporte", default=REPORTE_LOCAL, help="archivo JSON con el tiempo y memoria por etapa")
+    parser.add_argument("--confirmar", action="store_true", help="pedir enter antes de subir los precios")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = leer_argumentos(argv)
+    perfil = PerfilEtapas()
+
+    # GET condicional contra el portal: solo se vuelve a bajar y a procesar si el archivo cambio
+    with perfil.etapa("descarga") as e:
+        if args.fuentes:
+            archivos = expandir_fuentes(args.fuentes)
+            ruta_cruda, sha_crudo = None, huella_fuentes(archivos)
+            e["archivos"] = len(archivos)
+        elif os.path.exists(args.url):
+            ruta_cruda, sha_crudo = args.url, sha256_archivo(args.url)
+        else:
+            ruta_cruda, sha_crudo, _ = descargar_con_cache(args.url)
+        e["archivo_sha256"] = sha_crudo
+
+    if not requiere_procesar(sha_crudo, SNAPSHOT_LOCAL):
+        for nombre in ("parseo", "limpieza", "dedupe"):
+            perfil.omitir(nombre, "la entrada no cambio, se usa el snapshot")
+    else:
+        if args.fuentes:
+            print(f"🔄 Procesando {len(archivos)} archivos en paralelo...")
+            # parseo, limpieza y dedupe de cada archivo en un pool de procesos, luego la reconciliacion
+            with perfil.etapa("backfill") as e:
+                df = combinar_fuentes(archivos, args.procesos)
+                e["filas_salida"] = len(df)
+        else:
+            print("🔄 Procesando CSV...")
+            with perfil.etapa("parseo") as e:
+                df = parsear_csv(ruta_cruda)
+                print("Columnas del DataFrame:", df.columns.tolist())
+                e["filas_salida"] = len(df)
+            with perfil.etapa("limpieza", len(df)) as e:
+                df = limpiar(df)
+                e["filas_salida"] = len(df)
+            with perfil.etapa("dedupe", len(df)) as e:
+                df = deduplicar(df)
+                e["filas_salida"] = len(df)
+
+        # se guarda el snapshot tipado (arrow) y se anota de que entrada salio para no reprocesarla
+        with perfil.etapa("guardar_snapshot", len(df)) as e:
+            guardar_snapshot(df, SNAPSHOT_LOCAL)
+            marcar_procesado(sha_crudo, SNAPSHOT_LOCAL)
+            e["filas_salida"] = len(df)
+        print(f"💾 Snapshot guardado como '{SNAPSHOT_LOCAL}'")
+
+        if args.exportar_csv:
+            df.to_csv(CSV_LOCAL, index=False, encoding='utf-8')
+            print(f"💾 CSV procesado guardado como '{CSV_LOCAL}'")
+
+    # se abre con memory map, ya viene limpio y con tipos, no hay que volver a inferir nada
+    with perfil.etapa("snapshot") as e:
+        df = cargar_snapshot(SNAPSHOT_LOCAL)
+        e["filas_salida"] = len(df)
+    print(f"[+] Registros listos para insertar: {df.shape}")
+
+    if args.modo == "copy":
+        if args.incremental:
+            print("[!] --incremental no aplica en modo copy: el merge ya omite las filas sin cambios")
+        # todo el frame va a una tabla temporal y se hace el merge de producto/precio_productor en la base
+        with perfil.etapa("productos_y_precios_copy", len(df)) as e:
+            resultado = cargar_con_copy(conectar(), df)
+            e.update(resultado)
+            e["filas_salida"] = resultado["precios_cargados"]
+        perfil.guardar(args.reporte, modo=args.modo)
+        return
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+    with perfil.etapa("productos", len(df)) as e:
+        producto_map = cargar_productos_rest(supabase, df)
+        e["filas_salida"] = len(producto_map)
+
+    # Asignar IDs con un merge y descartar/llenar los NaN por columna
+    with perfil.etapa("preparacion", len(df)) as e:
+        datos_finales, omitidos = preparar_registros(df, producto_map)
+        reportar_omitidos(datos_finales, omitidos)
+        if args.incremental:
+            existentes = obtener_existentes(supabase, datos_finales["anio"].unique())
+            datos_finales = filtrar_cambios(datos_finales, existentes)
+        e["filas_omitidas"] = len(omitidos)
+        e["filas_salida"] = len(datos_finales)
+
+    print(f"[+] Registros listos para insertar: {len(datos_finales)}")
+    if args.confirmar:
+        input("... presiona enter para continuar")
+
+    with perfil.etapa("precios", len(datos_finales)) as e:
+        e["filas_salida"] = cargar_precios_rest(supabase, datos_finales, sha_crudo, args.trabajadores)
+
+    perfil.guardar(args.reporte, modo=args.modo, incremental=args.incremental)
+
+
+if __name__ == "__main__":
+    main()
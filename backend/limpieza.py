@@ -0,0 +1,34 @@
+import pandas as pd
+
+
+# columnas del CSV del MAG -> nombres que usamos
+COLUMNAS_MAG = {
+    'pp_anio': 'anio',
+    'pp_mes': 'mes',
+    'pp_producto': 'producto',
+    'pp_unidad': 'unidad',
+    'pp_ponderado_usd': 'usd',
+    'pp_ponderado_usd_kg': 'usd_kg'
+}
+
+
+def parsear_csv(ruta_cruda):
+    df = pd.read_csv(ruta_cruda, delimiter=";")
+    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
+    # renombramos
+    return df.rename(columns=COLUMNAS_MAG)
+
+
+def limpiar(df):
+    # Convertir a numérico y reemplazar errores por NaN
+    df['usd'] = pd.to_numeric(df['usd'], errors='coerce')
+    df['usd_kg'] = pd.to_numeric(df['usd_kg'], errors='coerce')
+
+    df = df.dropna(subset=['producto', 'anio'])  # eliminar filas con datos clave nulos
+    df['producto'] = df['producto'].str.strip()
+    return df
+
+
+def deduplicar(df):
+    # dentro de un mismo archivo se queda la primera aparicion de cada (anio, mes, producto)
+    return df.drop_duplicates(subset=['anio', 'mes', 'producto'], keep='first')
@@ -0,0 +1,70 @@
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Medicion por etapa de la ingesta: tiempo, filas de entrada/salida y pico de memoria (RSS).
+# En Linux el pico se reinicia al comenzar cada etapa (/proc/self/clear_refs), asi cada etapa
+# reporta su propio pico; si no se puede, se reporta el pico acumulado del proceso.
+
+def _reiniciar_pico_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _pico_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if os.uname().sysname == "Darwin" else maxrss / 1024
+
+
+class PerfilEtapas:
+
+    def __init__(self):
+        self.etapas = []
+        self.inicio = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nombre, filas_entrada=None):
+        """Mide el bloque; quien lo usa completa registro["filas_salida"] (y lo que quiera agregar)."""
+        registro = {"etapa": nombre, "filas_entrada": filas_entrada, "filas_salida": None}
+        pico_por_etapa = _reiniciar_pico_rss()
+        t0 = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro["segundos"] = round(time.perf_counter() - t0, 4)
+            registro["rss_pico_mb"] = round(_pico_rss_mb(), 1)
+            registro["rss_pico_por_etapa"] = pico_por_etapa
+            self.etapas.append(registro)
+            print(f"[⏱] {nombre}: {registro['segundos']:.2f}s | filas {filas_entrada} -> "
+                  f"{registro['filas_salida']} | RSS pico {registro['rss_pico_mb']:.0f} MB")
+
+    def omitir(self, nombre, motivo):
+        self.etapas.append({"etapa": nombre, "omitida": True, "motivo": motivo})
+
+    def guardar(self, ruta, **extra):
+        reporte = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "segundos_total": round(time.perf_counter() - self.inicio, 4),
+            **extra,
+            "etapas": self.etapas,
+        }
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"📄 Reporte de la ingesta guardado en '{ruta}'")
+        return reporte
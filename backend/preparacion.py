@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+# Columnas que espera la tabla precio_productor, en el orden de insercion
+COLUMNAS_PRECIO = ["anio", "mes", "producto_id", "ponderado_usd", "ponderado_usd_kg"]
+ARCHIVO_OMITIDOS = "omitidos_muestra.csv"
+
+
+def productos_faltantes(df, producto_map):
+    """Productos del CSV que todavia no tienen id en la base (nombre + unidad)."""
+    faltantes = df.loc[~df["producto"].isin(producto_map.keys()), ["producto", "unidad"]]
+    faltantes = faltantes.drop_duplicates(subset=["producto"], keep="first")
+    faltantes = faltantes.rename(columns={"producto": "nombre"})
+    return faltantes.to_dict(orient="records")
+
+
+def preparar_registros(df, producto_map):
+    """
+    Prepara los registros de precio_productor con operaciones por columna.
+
+    Devuelve (datos_finales, omitidos): el primero con las columnas de
+    COLUMNAS_PRECIO ya tipadas y el segundo con las filas descartadas y el motivo.
+    """
+    mapa = pd.DataFrame({
+        "producto": pd.Series(list(producto_map.keys()), dtype=object),
+        "producto_id": pd.Series(list(producto_map.values()), dtype="Int64"),
+    })
+    datos = df.merge(mapa, on="producto", how="left", validate="many_to_one")
+
+    # filas que no se pueden insertar: sin id de producto o sin precio en usd
+    sin_id = datos["producto_id"].isna().to_numpy()
+    sin_usd = datos["usd"].isna().to_numpy()
+    descartar = sin_id | sin_usd
+
+    omitidos = datos.loc[descartar].copy()
+    omitidos["motivo"] = np.where(sin_id[descartar], "producto_sin_id", "usd_nulo")
+
+    validos = datos.loc[~descartar]
+    datos_finales = pd.DataFrame({
+        "anio": validos["anio"].to_numpy(dtype=np.int64),
+        "mes": validos["mes"].to_numpy(dtype=object),
+        "producto_id": validos["producto_id"].to_numpy(dtype=np.int64),
+        "ponderado_usd": validos["usd"].to_numpy(dtype=np.float64),
+        # si falta el precio por kg se guarda en 0, igual que antes
+        "ponderado_usd_kg": validos["usd_kg"].fillna(0).to_numpy(dtype=np.float64),
+    })
+    datos_finales.attrs["usd_kg_rellenados"] = int(validos["usd_kg"].isna().sum())
+    return datos_finales, omitidos
+
+
+def columnas_precio(datos_finales):
+    """Arreglos numpy de cada columna de COLUMNAS_PRECIO, para cortar lotes por rango."""
+    return [datos_finales[c].to_numpy() for c in COLUMNAS_PRECIO]
+
+
+def filas_a_dicts(columnas, inicio, fin):
+    # tolist() convierte a tipos nativos de python, que si se pueden serializar a json
+    filas = zip(*(col[inicio:fin].tolist() for col in columnas))
+    return [dict(zip(COLUMNAS_PRECIO, fila)) for fila in filas]
+
+
+def iterar_lotes(datos_finales, batch_size):
+    """Genera lotes (lista de dicts) directamente desde las columnas numpy."""
+    columnas = columnas_precio(datos_finales)
+    total = len(datos_finales)
+    for inicio in range(0, total, batch_size):
+        yield filas_a_dicts(columnas, inicio, min(inicio + batch_size, total))
+
+
+def reportar_omitidos(datos_finales, omitidos, ruta=ARCHIVO_OMITIDOS, muestra=50):
+    """Resume las filas descartadas y guarda una muestra en CSV en vez de imprimir una por una."""
+    rellenados = datos_finales.attrs.get("usd_kg_rellenados", 0)
+    if rellenados:
+        print(f"[!] {rellenados} filas sin usd_kg, se guardan con 0")
+
+    if omitidos.empty:
+        print("[✔] No se omitio ninguna fila")
+        return
+
+    conteo = omitidos["motivo"].value_counts()
+    detalle = ", ".join(f"{motivo}: {n}" for motivo, n in conteo.items())
+    omitidos.head(muestra).to_csv(ruta, index=False, encoding="utf-8")
+    print(f"[!] Filas omitidas: {len(omitidos)} ({detalle}) - muestra en '{ruta}'")
@@ -0,0 +1,31 @@
+import pyarrow.feather as feather
+
+
+# Snapshot tipado del dataset limpio en formato Arrow IPC (feather v2 sin compresion),
+# para que las siguientes etapas y otras herramientas lo abran con memory map
+# en vez de volver a parsear e inferir tipos de un CSV.
+
+SNAPSHOT_LOCAL = "datos.arrow"
+
+TIPOS = {
+    "anio": "int16",
+    "mes": "category",
+    "producto": "category",
+    "unidad": "category",
+    "usd": "float64",
+    "usd_kg": "float64",
+}
+
+
+def tipar(df):
+    """Deja el frame limpio con los tipos compactos del snapshot."""
+    return df[list(TIPOS)].astype(TIPOS).reset_index(drop=True)
+
+
+def guardar_snapshot(df, ruta=SNAPSHOT_LOCAL):
+    # sin compresion para que se pueda mapear en memoria directamente
+    feather.write_feather(tipar(df), ruta, compression="uncompressed")
+
+
+def cargar_snapshot(ruta=SNAPSHOT_LOCAL, columnas=None):
+    return feather.read_feather(ruta, columns=columnas, memory_map=True)
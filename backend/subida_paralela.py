@@ -0,0 +1,125 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from preparacion import columnas_precio, filas_a_dicts
+
+
+# Subida por la API REST (PostgREST) con varios lotes en vuelo a la vez.
+# El tamaño del lote se ajusta solo: crece mientras la latencia se mantiene baja
+# y se reduce cuando el servidor responde con timeout o payload demasiado grande.
+
+MARCAS_ERROR_TAMANO = ("timeout", "timed out", "413", "payload too large", "entity too large")
+
+
+def es_error_de_tamano(exc):
+    """True si el error sugiere que el lote es muy grande (timeout o 413)."""
+    texto = f"{type(exc).__name__} {exc}".lower()
+    return any(marca in texto for marca in MARCAS_ERROR_TAMANO)
+
+
+class SubidorAdaptativo:
+
+    def __init__(self, enviar, trabajadores=4, lote_inicial=500, lote_min=50, lote_max=10_000,
+                 latencia_objetivo=1.0, max_reintentos=5, espera_base=0.5):
+        self.enviar = enviar  # funcion que recibe una lista de dicts y la manda a la base
+        self.trabajadores = trabajadores
+        self.lote = lote_inicial
+        self.lote_min = lote_min
+        self.lote_max = lote_max
+        self.latencia_objetivo = latencia_objetivo
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+
+    def _ajustar_lote(self, latencia=None, error=None):
+        if error is not None:
+            if es_error_de_tamano(error):
+                self.lote = max(self.lote_min, self.lote // 2)
+        elif latencia < self.latencia_objetivo / 2:
+            self.lote = min(self.lote_max, int(self.lote * 1.5))
+        elif latencia > self.latencia_objetivo * 2:
+            self.lote = max(self.lote_min, int(self.lote * 0.7))
+
+    def _enviar_rango(self, columnas, inicio, fin):
+        t0 = time.perf_counter()
+        self.enviar(filas_a_dicts(columnas, inicio, fin))
+        return time.perf_counter() - t0
+
+    def subir(self, datos_finales, rangos=None, al_confirmar=None):
+        """
+        Sube las filas y devuelve cuantas se insertaron.
+
+        rangos: lista opcional de (inicio, fin) a subir; por defecto todo el frame.
+        al_confirmar: callback (inicio, fin) que se llama cuando un rango quedo guardado.
+        """
+        columnas = columnas_precio(datos_finales)
+        pendientes = deque(rangos if rangos is not None else [(0, len(datos_finales))])
+        total_a_subir = sum(fin - inicio for inicio, fin in pendientes)
+        reintentos = []  # (listo_en, inicio, fin, intento)
+        en_vuelo = {}
+        subidas = 0
+        t_inicio = ultimo_reporte = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.trabajadores) as pool:
+            while pendientes or reintentos or en_vuelo:
+                ahora = time.perf_counter()
+
+                # primero los reintentos cuya espera ya paso, luego filas nuevas
+                while len(en_vuelo) < self.trabajadores:
+                    listos = [r for r in reintentos if r[0] <= ahora]
+                    if listos:
+                        r = min(listos)
+                        reintentos.remove(r)
+                        _, inicio, fin, intento = r
+                    elif pendientes:
+                        inicio, fin_rango = pendientes.popleft()
+                        fin = min(fin_rango, inicio + self.lote)
+                        if fin < fin_rango:
+                            pendientes.appendleft((fin, fin_rango))
+                        intento = 0
+                    else:
+                        break
+                    futuro = pool.submit(self._enviar_rango, columnas, inicio, fin)
+                    en_vuelo[futuro] = (inicio, fin, intento)
+
+                if not en_vuelo:
+                    # solo quedan reintentos esperando su turno
+                    time.sleep(max(0.0, min(r[0] for r in reintentos) - ahora))
+                    continue
+
+                hechos, _ = wait(en_vuelo, timeout=1.0, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    inicio, fin, intento = en_vuelo.pop(futuro)
+                    error = futuro.exception()
+                    if error is None:
+                        self._ajustar_lote(latencia=futuro.result())
+                        subidas += fin - inicio
+                        if al_confirmar is not None:
+                            al_confirmar(inicio, fin)
+                        continue
+
+                    self._ajustar_lote(error=error)
+                    if intento + 1 > self.max_reintentos:
+                        raise RuntimeError(f"Lote {inicio}-{fin} fallo {intento + 1} veces") from error
+                    espera = self.espera_base * 2 ** intento + random.uniform(0, self.espera_base)
+                    listo_en = time.perf_counter() + espera
+                    print(f"[!] Lote {inicio}-{fin} fallo ({type(error).__name__}), reintento en {espera:.1f}s")
+                    # si el lote era muy grande se reintenta partido a la mitad
+                    if es_error_de_tamano(error) and fin - inicio > self.lote_min:
+                        medio = (inicio + fin) // 2
+                        reintentos.append((listo_en, inicio, medio, intento + 1))
+                        reintentos.append((listo_en, medio, fin, intento + 1))
+                    else:
+                        reintentos.append((listo_en, inicio, fin, intento + 1))
+
+                ahora = time.perf_counter()
+                if ahora - ultimo_reporte >= 1.0:
+                    ultimo_reporte = ahora
+                    velocidad = subidas / (ahora - t_inicio)
+                    print(f"[↑] {subidas} / {total_a_subir} filas | {velocidad:,.0f} filas/s "
+                          f"| lote {self.lote} | en vuelo {len(en_vuelo)}")
+
+        duracion = time.perf_counter() - t_inicio
+        print(f"[✔] Subidas {subidas} filas en {duracion:.1f}s ({subidas / max(duracion, 1e-9):,.0f} filas/s)")
+        return subidas
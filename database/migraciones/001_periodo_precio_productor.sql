@@ -0,0 +1,57 @@
+-- =============================================
+-- MIGRACION 001: columna periodo (DATE) en precio_productor
+-- Para bases creadas antes de este cambio. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION mes_a_numero(p_mes TEXT)
+RETURNS INT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE lower(trim(p_mes))
+        WHEN 'enero' THEN 1
+        WHEN 'febrero' THEN 2
+        WHEN 'marzo' THEN 3
+        WHEN 'abril' THEN 4
+        WHEN 'mayo' THEN 5
+        WHEN 'junio' THEN 6
+        WHEN 'julio' THEN 7
+        WHEN 'agosto' THEN 8
+        WHEN 'septiembre' THEN 9
+        WHEN 'setiembre' THEN 9
+        WHEN 'octubre' THEN 10
+        WHEN 'noviembre' THEN 11
+        WHEN 'diciembre' THEN 12
+    END;
+$$;
+
+-- columna generada: al agregarla se calcula para todas las filas existentes
+ALTER TABLE precio_productor
+    ADD COLUMN IF NOT EXISTS periodo DATE GENERATED ALWAYS AS (make_date(anio, mes_a_numero(mes), 1)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_precio_producto_periodo ON precio_productor(producto_id, periodo)
+    INCLUDE (ponderado_usd, ponderado_usd_kg);
+
+-- cambia el tipo de retorno, hay que borrarla antes de crearla de nuevo
+DROP FUNCTION IF EXISTS obtener_precios_historicos_completos(INT);
+
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_completos(prod_id INT)
+RETURNS TABLE(anio INT, mes TEXT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = prod_id
+    ORDER BY pp.periodo;
+END;
+$$;
+
+ANALYZE precio_productor;
+
+-- filas con un nombre de mes que no se reconoce (quedan con periodo NULL)
+SELECT anio, mes, count(*) AS filas
+FROM precio_productor
+WHERE periodo IS NULL
+GROUP BY anio, mes;
@@ -0,0 +1,253 @@
+-- =============================================
+-- MIGRACION 002: tablas de resumen para obtener_promedio_usd_por_anio
+-- y obtener_variacion_maxima_usd, mantenidas por triggers.
+-- Todo en una transaccion: se bloquean las escrituras en precio_productor mientras
+-- se crean los triggers y se llenan las tablas, para no perder cambios en el medio.
+-- =============================================
+
+BEGIN;
+
+LOCK TABLE precio_productor IN SHARE ROW EXCLUSIVE MODE;
+
+-- ---------------------------------------------
+-- Tablas de resumen (agregados) de precio_productor
+-- Las mantienen los triggers trg_resumen_precio_* (ver abajo), asi que estan al dia
+-- con insertar_precio_productor, el cargador y cualquier otro INSERT/UPDATE/DELETE.
+-- ---------------------------------------------
+CREATE TABLE IF NOT EXISTS resumen_precio_anual (
+    producto_id INT NOT NULL REFERENCES producto(id) ON DELETE CASCADE,
+    anio INT NOT NULL,
+    suma_usd NUMERIC NOT NULL DEFAULT 0,
+    filas_usd BIGINT NOT NULL DEFAULT 0,   -- filas con ponderado_usd no nulo
+    filas BIGINT NOT NULL DEFAULT 0,       -- todas las filas del producto en el año
+    promedio_usd NUMERIC GENERATED ALWAYS AS (suma_usd / NULLIF(filas_usd, 0)) STORED,
+    PRIMARY KEY (producto_id, anio)
+);
+
+CREATE TABLE IF NOT EXISTS resumen_precio_producto (
+    producto_id INT PRIMARY KEY REFERENCES producto(id) ON DELETE CASCADE,
+    min_usd NUMERIC,
+    max_usd NUMERIC
+);
+
+-- =============================================
+-- FUNCION: recalcular min/max de algunos productos desde precio_productor
+-- (se usa cuando se borra o cambia el valor que era el minimo o el maximo)
+-- =============================================
+CREATE OR REPLACE FUNCTION recalcular_resumen_producto(p_producto_ids INT[])
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM resumen_precio_producto WHERE producto_id = ANY(p_producto_ids);
+
+    INSERT INTO resumen_precio_producto(producto_id, min_usd, max_usd)
+    SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+    FROM precio_productor
+    WHERE producto_id = ANY(p_producto_ids)
+    GROUP BY producto_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- TRIGGER FUNCTION: mantener las tablas de resumen
+-- Es por sentencia y usa las tablas de transicion (viejas/nuevas), asi una carga
+-- masiva actualiza cada (producto, año) una sola vez y no fila por fila.
+-- Todos los escritores de un mismo producto quedan serializados en su fila de resumen
+-- hasta el COMMIT. El orden fijo de bloqueo (sin deadlocks entre lotes) es de la
+-- migracion 021.
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_resumen_precio()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_recalcular INT[];
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- restar las filas viejas
+        UPDATE resumen_precio_anual r
+        SET suma_usd = r.suma_usd - d.suma_usd,
+            filas_usd = r.filas_usd - d.filas_usd,
+            filas = r.filas - d.filas
+        FROM (
+            SELECT producto_id, anio,
+                   COALESCE(SUM(ponderado_usd), 0) AS suma_usd,
+                   COUNT(ponderado_usd) AS filas_usd,
+                   COUNT(*) AS filas
+            FROM viejas
+            WHERE producto_id IS NOT NULL
+            GROUP BY producto_id, anio
+        ) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio;
+
+        DELETE FROM resumen_precio_anual r
+        USING (SELECT DISTINCT producto_id, anio FROM viejas) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio AND r.filas <= 0;
+
+        -- si salio el valor que era el minimo o el maximo, ese producto se recalcula
+        SELECT array_agg(DISTINCT v.producto_id) INTO v_recalcular
+        FROM viejas v
+        JOIN resumen_precio_producto r ON r.producto_id = v.producto_id
+        WHERE v.ponderado_usd <= r.min_usd OR v.ponderado_usd >= r.max_usd;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- sumar las filas nuevas
+        INSERT INTO resumen_precio_anual AS r (producto_id, anio, suma_usd, filas_usd, filas)
+        SELECT producto_id, anio, COALESCE(SUM(ponderado_usd), 0), COUNT(ponderado_usd), COUNT(*)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id, anio
+        ON CONFLICT (producto_id, anio) DO UPDATE
+        SET suma_usd = r.suma_usd + EXCLUDED.suma_usd,
+            filas_usd = r.filas_usd + EXCLUDED.filas_usd,
+            filas = r.filas + EXCLUDED.filas;
+
+        INSERT INTO resumen_precio_producto AS r (producto_id, min_usd, max_usd)
+        SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id
+        ON CONFLICT (producto_id) DO UPDATE
+        SET min_usd = LEAST(r.min_usd, EXCLUDED.min_usd),
+            max_usd = GREATEST(r.max_usd, EXCLUDED.max_usd);
+    END IF;
+
+    IF v_recalcular IS NOT NULL THEN
+        PERFORM recalcular_resumen_producto(v_recalcular);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trigger_resumen_precio_truncate()
+RETURNS TRIGGER AS $$
+BEGIN
+    TRUNCATE resumen_precio_anual, resumen_precio_producto;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- ASIGNAR TRIGGERS de resumen a precio_productor
+-- (las tablas de transicion solo se permiten con un evento por trigger)
+-- =============================================
+DROP TRIGGER IF EXISTS trg_resumen_precio_insert ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_insert
+AFTER INSERT ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_update ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_update
+AFTER UPDATE ON precio_productor
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_delete ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_delete
+AFTER DELETE ON precio_productor
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_truncate ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_truncate
+AFTER TRUNCATE ON precio_productor
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio_truncate();
+
+-- llenar las tablas de resumen con lo que ya hay
+TRUNCATE resumen_precio_anual, resumen_precio_producto;
+
+INSERT INTO resumen_precio_anual(producto_id, anio, suma_usd, filas_usd, filas)
+SELECT producto_id, anio, COALESCE(SUM(ponderado_usd), 0), COUNT(ponderado_usd), COUNT(*)
+FROM precio_productor
+WHERE producto_id IS NOT NULL
+GROUP BY producto_id, anio;
+
+INSERT INTO resumen_precio_producto(producto_id, min_usd, max_usd)
+SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+FROM precio_productor
+WHERE producto_id IS NOT NULL
+GROUP BY producto_id;
+
+-- las funciones de analisis pasan a leer de las tablas de resumen
+CREATE OR REPLACE FUNCTION obtener_promedio_usd_por_anio()
+RETURNS TABLE(nombre TEXT, anio INT, promedio_usd NUMERIC)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- se lee de la tabla de resumen: O(productos x años) en vez de recorrer precio_productor
+    RETURN QUERY
+    SELECT
+        p.nombre,
+        r.anio,
+        ROUND(r.promedio_usd, 2) AS promedio_usd
+    FROM
+        resumen_precio_anual r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY p.nombre, r.anio;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION obtener_variacion_maxima_usd()
+RETURNS TABLE(nombre TEXT, variacion NUMERIC)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        p.nombre,
+        r.max_usd - r.min_usd AS variacion
+    FROM
+        resumen_precio_producto r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY variacion DESC;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION explain_promedio()
+RETURNS TABLE(plan text)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    EXECUTE '
+        EXPLAIN (FORMAT TEXT)
+        SELECT
+            p.nombre,
+            r.anio,
+            ROUND(r.promedio_usd, 2) AS promedio_usd
+        FROM
+            resumen_precio_anual r
+        JOIN producto p ON r.producto_id = p.id
+        ORDER BY p.nombre, r.anio
+    ';
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION explain_variacion()
+RETURNS TABLE(plan text)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    EXECUTE '
+        EXPLAIN (FORMAT TEXT)
+        SELECT
+            p.nombre,
+            r.max_usd - r.min_usd AS variacion
+        FROM
+            resumen_precio_producto r
+        JOIN producto p ON r.producto_id = p.id
+        ORDER BY variacion DESC
+    ';
+END;
+$$;
+
+COMMIT;
+
+ANALYZE resumen_precio_anual;
+ANALYZE resumen_precio_producto;
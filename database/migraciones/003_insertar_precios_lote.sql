@@ -0,0 +1,134 @@
+-- =============================================
+-- MIGRACION 003: insertar_precios_productor_lote (upsert de precios en lote)
+-- Solo agrega la funcion; se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- FUNCION: insertar/actualizar precios en lote
+-- p_precios es un arreglo JSON de objetos
+--   {"anio": 2024, "mes": "Enero", "nombre_producto": "Aguacate Fuerte",
+--    "ponderado_usd": 10.5, "ponderado_usd_kg": 0.2, "usuario_simulado": "opcional"}
+-- Todo en una transaccion: una sola busqueda de productos, un solo upsert y un solo
+-- INSERT multi-fila en log_auditoria. Devuelve el resultado de cada elemento
+-- ('insertado', 'actualizado' o 'error' con el motivo) en el orden de entrada.
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN producto p ON p.nombre = e->>'nombre_producto'
+    JOIN precio_productor pp
+      ON pp.producto_id = p.id
+     AND pp.mes = e->>'mes'
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    validados AS (
+        SELECT
+            en.*,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN mes_a_numero(en.mes) IS NULL THEN format('mes invalido: %s', en.mes)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto', en.nombre_producto)
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica la ultima
+                WHEN en.indice < MAX(en.indice) OVER (PARTITION BY en.anio, en.mes, p.id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM entrada en
+        LEFT JOIN producto p ON p.nombre = en.nombre_producto
+    ),
+    validos AS (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.anio, pp.mes, pp.producto_id, (pp.xmax = 0) AS insertado
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN upsert u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        v.mes,
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN upsert u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
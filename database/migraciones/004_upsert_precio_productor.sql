@@ -0,0 +1,71 @@
+-- =============================================
+-- MIGRACION 004: upsert_precio_productor (insertar o actualizar en una sola sentencia)
+-- Solo agrega la funcion; se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+BEGIN
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = p_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos
+        FROM producto p
+        WHERE p.nombre = p_nombre_producto
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT p_anio, p_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.producto_id, (pp.xmax = 0) AS insertado
+    )
+    INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+    SELECT
+        'precio_productor',
+        CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+        p_usuario_simulado,
+        -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+        a.datos,
+        jsonb_build_object(
+            'anio', p_anio,
+            'mes', p_mes,
+            'producto_id', u.producto_id,
+            'ponderado_usd', p_ponderado_usd,
+            'ponderado_usd_kg', p_ponderado_usd_kg
+        )
+    FROM upsert u
+    JOIN antes a USING (producto_id);
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
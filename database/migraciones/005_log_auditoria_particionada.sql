@@ -0,0 +1,207 @@
+-- =============================================
+-- MIGRACION 005: log_auditoria particionada por mes, indices BRIN / btree y retencion
+-- La tabla existente se renombra, se crea la particionada con la misma secuencia de id
+-- y se copian las filas. Se puede ejecutar mas de una vez.
+-- =============================================
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('log_auditoria')) = 'r' THEN
+        LOCK TABLE log_auditoria IN ACCESS EXCLUSIVE MODE;
+        ALTER TABLE log_auditoria RENAME TO log_auditoria_anterior;
+        ALTER TABLE log_auditoria_anterior RENAME CONSTRAINT log_auditoria_pkey TO log_auditoria_anterior_pkey;
+        -- la secuencia se queda para la tabla nueva (si no, se borraria con la vieja)
+        ALTER SEQUENCE log_auditoria_id_seq OWNED BY NONE;
+        ALTER SEQUENCE log_auditoria_id_seq AS BIGINT;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS log_auditoria (
+    id BIGINT NOT NULL DEFAULT nextval('log_auditoria_id_seq'),
+    tabla_afectada TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    usuario_simulado TEXT,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    datos_antes JSONB,
+    datos_despues JSONB,
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
+
+ALTER SEQUENCE log_auditoria_id_seq OWNED BY log_auditoria.id;
+
+CREATE TABLE IF NOT EXISTS log_auditoria_default PARTITION OF log_auditoria DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_log_auditoria_fecha ON log_auditoria USING BRIN (fecha)
+    WITH (pages_per_range = 32, autosummarize = on);
+CREATE INDEX IF NOT EXISTS idx_log_auditoria_tabla_fecha ON log_auditoria(tabla_afectada, fecha);
+
+CREATE SCHEMA IF NOT EXISTS auditoria_archivo;
+
+-- =============================================
+-- FUNCION: crear la particion mensual de log_auditoria que contiene p_mes
+-- Si log_auditoria_default ya tiene filas de ese mes, se pasan a la particion nueva.
+-- Devuelve el nombre de la particion, o NULL si ya existia.
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particion_log_auditoria(p_mes DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_desde DATE := date_trunc('month', p_mes)::DATE;
+    v_hasta DATE := (date_trunc('month', p_mes) + INTERVAL '1 month')::DATE;
+    v_nombre TEXT := 'log_auditoria_p' || to_char(p_mes, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE log_auditoria INCLUDING DEFAULTS)', v_nombre);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM log_auditoria_default WHERE fecha >= %L AND fecha < %L RETURNING *)
+         INSERT INTO %I SELECT * FROM movidas',
+        v_desde, v_hasta, v_nombre
+    );
+    EXECUTE format(
+        'ALTER TABLE log_auditoria ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_nombre, v_desde, v_hasta
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones del mes actual y de los proximos p_meses_adelante,
+-- y las de los meses que hayan quedado en log_auditoria_default
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_log_auditoria(p_meses_adelante INT DEFAULT 3)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_mes DATE;
+    v_nombre TEXT;
+BEGIN
+    FOR v_mes IN
+        SELECT DISTINCT date_trunc('month', fecha)::DATE FROM log_auditoria_default
+        UNION
+        SELECT (date_trunc('month', now()) + make_interval(months => i))::DATE
+        FROM generate_series(0, p_meses_adelante) AS i
+        ORDER BY 1
+    LOOP
+        v_nombre := crear_particion_log_auditoria(v_mes);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =============================================
+-- FUNCION: mantenimiento de log_auditoria (retencion)
+-- Crea las particiones que faltan y separa las de meses anteriores a p_meses_retencion:
+-- con p_archivar se mueven al schema auditoria_archivo (se pueden exportar y borrar
+-- despues), si no se borran. Pensada para correr una vez por dia o por mes, por ejemplo
+-- con pg_cron:
+--   SELECT cron.schedule('mantener-log-auditoria', '0 3 * * *', 'SELECT * FROM mantener_log_auditoria()');
+-- =============================================
+CREATE OR REPLACE FUNCTION mantener_log_auditoria(
+    p_meses_retencion INT DEFAULT 12,
+    p_archivar BOOLEAN DEFAULT TRUE
+)
+RETURNS TABLE(particion TEXT, accion TEXT) AS $$
+DECLARE
+    v_limite TEXT := to_char(date_trunc('month', now()) - make_interval(months => p_meses_retencion), 'YYYYMM');
+    v_nombre TEXT;
+BEGIN
+    FOR v_nombre IN SELECT * FROM crear_particiones_log_auditoria() LOOP
+        RETURN QUERY SELECT v_nombre, 'creada'::TEXT;
+    END LOOP;
+
+    FOR v_nombre IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'log_auditoria'::regclass
+          AND c.relname ~ '^log_auditoria_p[0-9]{6}$'
+          AND substr(c.relname, 16) < v_limite
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE log_auditoria DETACH PARTITION %I', v_nombre);
+        IF p_archivar THEN
+            EXECUTE format('ALTER TABLE %I SET SCHEMA auditoria_archivo', v_nombre);
+            RETURN QUERY SELECT v_nombre, 'archivada'::TEXT;
+        ELSE
+            EXECUTE format('DROP TABLE %I', v_nombre);
+            RETURN QUERY SELECT v_nombre, 'borrada'::TEXT;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: ultimos p_n_registros del log (la usa logs.py)
+-- Busca en una ventana de tiempo que se agranda hasta tener suficientes filas, asi el
+-- indice BRIN de fecha solo lee los bloques recientes en vez de ordenar toda la tabla.
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_logs_auditoria(p_n_registros INT)
+RETURNS TABLE(
+    id BIGINT,
+    fecha TIMESTAMP,
+    usuario_simulado TEXT,
+    tabla_afectada TEXT,
+    operacion TEXT,
+    datos_antes JSONB,
+    datos_despues JSONB
+) AS $$
+DECLARE
+    v_ventana INTERVAL := INTERVAL '1 hour';
+    v_desde TIMESTAMP;
+    v_filas BIGINT;
+BEGIN
+    LOOP
+        v_desde := now() - v_ventana;
+        SELECT count(*) INTO v_filas
+        FROM (SELECT 1 FROM log_auditoria l WHERE l.fecha >= v_desde LIMIT p_n_registros) x;
+        EXIT WHEN v_filas >= p_n_registros;
+        IF v_ventana > INTERVAL '50 years' THEN
+            v_desde := '-infinity';  -- no hay tantas filas: se devuelve todo
+            EXIT;
+        END IF;
+        v_ventana := v_ventana * 8;
+    END LOOP;
+
+    RETURN QUERY
+    SELECT l.id, l.fecha, l.usuario_simulado, l.tabla_afectada, l.operacion, l.datos_antes, l.datos_despues
+    FROM log_auditoria l
+    WHERE l.fecha >= v_desde
+    ORDER BY l.fecha DESC, l.id DESC
+    LIMIT p_n_registros;
+END;
+$$ LANGUAGE plpgsql;
+
+-- copiar el log viejo: primero las particiones de sus meses, asi cada fila va directo a la suya
+DO $$
+BEGIN
+    IF to_regclass('log_auditoria_anterior') IS NOT NULL THEN
+        PERFORM crear_particion_log_auditoria(m::DATE)
+        FROM (SELECT DISTINCT date_trunc('month', fecha) AS m
+              FROM log_auditoria_anterior WHERE fecha IS NOT NULL) meses;
+
+        INSERT INTO log_auditoria(id, tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues)
+        SELECT id, tabla_afectada, operacion, usuario_simulado, COALESCE(fecha, now()), datos_antes, datos_despues
+        FROM log_auditoria_anterior;
+
+        DROP TABLE log_auditoria_anterior;
+    END IF;
+END $$;
+
+SELECT crear_particiones_log_auditoria();
+
+COMMIT;
+
+ANALYZE log_auditoria;
+
+-- comprobacion: particiones y filas en cada una
+SELECT tableoid::regclass AS particion, count(*) AS filas
+FROM log_auditoria
+GROUP BY 1
+ORDER BY 1;
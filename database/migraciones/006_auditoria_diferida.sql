@@ -0,0 +1,195 @@
+-- =============================================
+-- MIGRACION 006: auditoria diferida (log_auditoria_pendiente + volcado en bloque)
+-- Requiere la migracion 005 (log_auditoria particionada). Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- ---------------------------------------------
+-- Tabla: log_auditoria_pendiente
+-- Eventos de auditoria en modo diferido (app.auditoria_diferida = 'on'), antes de
+-- pasar a log_auditoria con volcar_auditoria_pendiente(). UNLOGGED y sin indices para
+-- que escribir aqui sea barato; a cambio, si el servidor se cae se pierde lo que
+-- todavia no se volco.
+-- ---------------------------------------------
+CREATE UNLOGGED TABLE IF NOT EXISTS log_auditoria_pendiente (
+    id BIGSERIAL,   -- orden de llegada de los eventos
+    tabla_afectada TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    usuario_simulado TEXT,
+    fecha TIMESTAMP NOT NULL,
+    datos_antes JSONB,
+    datos_despues JSONB
+);
+
+-- =============================================
+-- AUDITORIA DIFERIDA (opcional)
+-- Con app.auditoria_diferida = 'on' cada INSERT en log_auditoria (registrar_auditoria,
+-- el trigger de DELETE, upsert_precio_productor, insertar_precios_productor_lote) se
+-- guarda en log_auditoria_pendiente y se vuelca despues en bloque. Se activa por sesion
+-- (SET app.auditoria_diferida = 'on') o para todos, por ejemplo:
+--   ALTER DATABASE postgres SET app.auditoria_diferida = 'on';
+-- y el volcado se programa con pg_cron:
+--   SELECT cron.schedule('volcar-auditoria', '* * * * *', 'SELECT volcar_auditoria_pendiente()');
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_auditoria_diferida()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.auditoria_diferida', true) = 'on' THEN
+        INSERT INTO log_auditoria_pendiente(tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues)
+        VALUES (NEW.tabla_afectada, NEW.operacion, NEW.usuario_simulado, NEW.fecha, NEW.datos_antes, NEW.datos_despues);
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS auditoria_diferida ON log_auditoria;
+CREATE TRIGGER auditoria_diferida
+BEFORE INSERT ON log_auditoria
+FOR EACH ROW
+EXECUTE FUNCTION trigger_auditoria_diferida();
+
+-- =============================================
+-- FUNCION: pasar los eventos pendientes a log_auditoria en un solo INSERT
+-- Respeta el orden de llegada (id), la fecha original y el usuario de cada evento.
+-- Devuelve cuantos eventos se volcaron.
+-- =============================================
+CREATE OR REPLACE FUNCTION volcar_auditoria_pendiente()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+    v_modo TEXT := current_setting('app.auditoria_diferida', true);
+BEGIN
+    -- un volcado a la vez, para que los id de log_auditoria sigan el orden de los eventos
+    PERFORM pg_advisory_xact_lock(hashtext('volcar_auditoria_pendiente'));
+    -- el INSERT de abajo no debe volver a la tabla pendiente
+    PERFORM set_config('app.auditoria_diferida', 'off', true);
+
+    WITH lote AS (
+        DELETE FROM log_auditoria_pendiente
+        RETURNING *
+    )
+    INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues)
+    SELECT tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues
+    FROM lote
+    ORDER BY id;
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    PERFORM set_config('app.auditoria_diferida', COALESCE(v_modo, ''), true);
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: ultimos p_n_registros del log (la usa logs.py)
+-- Busca en una ventana de tiempo que se agranda hasta tener suficientes filas, asi el
+-- indice BRIN de fecha solo lee los bloques recientes en vez de ordenar toda la tabla.
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_logs_auditoria(p_n_registros INT)
+RETURNS TABLE(
+    id BIGINT,
+    fecha TIMESTAMP,
+    usuario_simulado TEXT,
+    tabla_afectada TEXT,
+    operacion TEXT,
+    datos_antes JSONB,
+    datos_despues JSONB
+) AS $$
+DECLARE
+    v_ventana INTERVAL := INTERVAL '1 hour';
+    v_desde TIMESTAMP;
+    v_filas BIGINT;
+BEGIN
+    -- en modo diferido, que se vea tambien lo que todavia no se volco
+    PERFORM volcar_auditoria_pendiente();
+
+    LOOP
+        v_desde := now() - v_ventana;
+        SELECT count(*) INTO v_filas
+        FROM (SELECT 1 FROM log_auditoria l WHERE l.fecha >= v_desde LIMIT p_n_registros) x;
+        EXIT WHEN v_filas >= p_n_registros;
+        IF v_ventana > INTERVAL '50 years' THEN
+            v_desde := '-infinity';  -- no hay tantas filas: se devuelve todo
+            EXIT;
+        END IF;
+        v_ventana := v_ventana * 8;
+    END LOOP;
+
+    RETURN QUERY
+    SELECT l.id, l.fecha, l.usuario_simulado, l.tabla_afectada, l.operacion, l.datos_antes, l.datos_despues
+    FROM log_auditoria l
+    WHERE l.fecha >= v_desde
+    ORDER BY l.fecha DESC, l.id DESC
+    LIMIT p_n_registros;
+END;
+$$ LANGUAGE plpgsql;
+
+-- upsert_precio_productor ya no usa el ROW_COUNT del INSERT de auditoria (en modo diferido es 0)
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+BEGIN
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = p_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos
+        FROM producto p
+        WHERE p.nombre = p_nombre_producto
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT p_anio, p_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.producto_id, (pp.xmax = 0) AS insertado
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
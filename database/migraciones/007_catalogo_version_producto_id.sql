@@ -0,0 +1,353 @@
+-- =============================================
+-- MIGRACION 007: version del catalogo de productos y producto_id en las funciones de escritura
+-- Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- ---------------------------------------------
+-- Tabla: catalogo_version
+-- Una sola fila con un contador que sube cada vez que cambia producto (ver
+-- trigger_catalogo_version). Los clientes guardan el catalogo en cache y solo
+-- lo vuelven a pedir cuando cambia este numero.
+-- ---------------------------------------------
+CREATE TABLE IF NOT EXISTS catalogo_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalogo_version(id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- =============================================
+-- FUNCION: version actual del catalogo de productos (consulta barata para los clientes)
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_version_catalogo()
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT version FROM catalogo_version WHERE id = 1;
+$$;
+
+-- =============================================
+-- TRIGGER FUNCTION: subir la version del catalogo cuando cambia producto
+-- (insertar_producto, el cargador o cualquier otro cambio). Es por sentencia; en un
+-- INSERT ... ON CONFLICT DO NOTHING que no agrego nada la version no cambia.
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_catalogo_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NOT EXISTS (SELECT 1 FROM nuevos) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_catalogo_version_insert ON producto;
+CREATE TRIGGER trg_catalogo_version_insert
+AFTER INSERT ON producto
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_catalogo_version();
+
+DROP TRIGGER IF EXISTS trg_catalogo_version_cambio ON producto;
+CREATE TRIGGER trg_catalogo_version_cambio
+AFTER UPDATE OR DELETE OR TRUNCATE ON producto
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_catalogo_version();
+
+-- insertar_precio_productor y upsert_precio_productor reciben p_producto_id (opcional):
+-- se borra la version de 6 parametros para que la llamada con 6 no sea ambigua
+DROP FUNCTION IF EXISTS insertar_precio_productor(INT, TEXT, TEXT, NUMERIC, NUMERIC, TEXT);
+DROP FUNCTION IF EXISTS upsert_precio_productor(INT, TEXT, TEXT, NUMERIC, NUMERIC, TEXT);
+
+-- =============================================
+-- FUNCION: insertar precio productor
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_producto_id INT := p_producto_id;
+    precio_existente RECORD;
+BEGIN
+    -- Obtener ID del producto
+    IF v_producto_id IS NULL THEN
+        SELECT id INTO v_producto_id
+        FROM producto
+        WHERE nombre = p_nombre_producto;
+    END IF;
+
+    IF v_producto_id IS NULL THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
+    END IF;
+
+    -- Buscar si ya existe registro del precio, bloqueando la fila si existe
+    SELECT * INTO precio_existente
+    FROM precio_productor
+    WHERE anio = p_anio
+      AND mes = p_mes
+      AND producto_id = v_producto_id
+    FOR UPDATE;  -- ⛔️ Bloquea la fila si existe
+
+    IF NOT FOUND THEN
+        -- Si no existe, insertar
+        INSERT INTO precio_productor(anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        VALUES (p_anio, p_mes, v_producto_id, p_ponderado_usd, p_ponderado_usd_kg);
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'INSERT',
+            p_usuario_simulado,
+            NULL,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    ELSE
+        -- Si ya existe, actualizar (con la fila bloqueada previamente)
+        UPDATE precio_productor
+        SET
+            ponderado_usd = p_ponderado_usd,
+            ponderado_usd_kg = p_ponderado_usd_kg
+        WHERE id = precio_existente.id;
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'UPDATE',
+            p_usuario_simulado,
+            to_jsonb(precio_existente),
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+BEGIN
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = p_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos
+        FROM producto p
+        WHERE p.id = COALESCE(p_producto_id, (SELECT id FROM producto WHERE nombre = p_nombre_producto))
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT p_anio, p_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.producto_id, (pp.xmax = 0) AS insertado
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', COALESCE(p_nombre_producto, p_producto_id::TEXT);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar/actualizar precios en lote
+-- p_precios es un arreglo JSON de objetos
+--   {"anio": 2024, "mes": "Enero", "nombre_producto": "Aguacate Fuerte",
+--    "ponderado_usd": 10.5, "ponderado_usd_kg": 0.2, "usuario_simulado": "opcional"}
+-- En lugar de nombre_producto se puede mandar "producto_id" (no se busca por nombre).
+-- Todo en una transaccion: una sola busqueda de productos, un solo upsert y un solo
+-- INSERT multi-fila en log_auditoria. Devuelve el resultado de cada elemento
+-- ('insertado', 'actualizado' o 'error' con el motivo) en el orden de entrada.
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN precio_productor pp
+      ON pp.producto_id = COALESCE(
+             CASE WHEN jsonb_typeof(e->'producto_id') = 'number' THEN (e->>'producto_id')::NUMERIC::INT END,
+             (SELECT p.id FROM producto p WHERE p.nombre = e->>'nombre_producto'))
+     AND pp.mes = e->>'mes'
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            CASE WHEN jsonb_typeof(e.valor->'producto_id') = 'number'
+                 THEN (e.valor->>'producto_id')::NUMERIC::INT END AS producto_id_pedido,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    validados AS (
+        SELECT
+            en.indice, en.anio, en.mes, en.precios_ok, en.usuario, en.valor,
+            COALESCE(en.nombre_producto, p.nombre) AS nombre_producto,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN mes_a_numero(en.mes) IS NULL THEN format('mes invalido: %s', en.mes)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto',
+                                              COALESCE(en.nombre_producto, en.producto_id_pedido::TEXT))
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica la ultima
+                WHEN en.indice < MAX(en.indice) OVER (PARTITION BY en.anio, en.mes, p.id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM entrada en
+        -- por id si vino, si no por nombre
+        LEFT JOIN producto pn ON en.producto_id_pedido IS NULL AND pn.nombre = en.nombre_producto
+        LEFT JOIN producto p ON p.id = COALESCE(en.producto_id_pedido, pn.id)
+    ),
+    validos AS (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.anio, pp.mes, pp.producto_id, (pp.xmax = 0) AS insertado
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN upsert u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        v.mes,
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN upsert u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
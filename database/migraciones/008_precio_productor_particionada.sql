@@ -0,0 +1,451 @@
+-- =============================================
+-- MIGRACION 008: precio_productor particionada por año
+-- La tabla existente se renombra, se crea la particionada con la misma secuencia de id,
+-- se crean las particiones de los años que ya hay y se copian las filas (antes de crear
+-- los triggers, asi la copia no toca el resumen ni el log). Luego se borra la vieja.
+-- Requiere las migraciones 001 a 007. Se puede ejecutar mas de una vez.
+-- =============================================
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('precio_productor')) = 'r' THEN
+        LOCK TABLE precio_productor IN ACCESS EXCLUSIVE MODE;
+        ALTER TABLE precio_productor RENAME TO precio_productor_anterior;
+        ALTER TABLE precio_productor_anterior RENAME CONSTRAINT precio_productor_pkey TO precio_productor_anterior_pkey;
+        ALTER TABLE precio_productor_anterior
+            RENAME CONSTRAINT precio_productor_anio_mes_producto_id_key TO precio_productor_anterior_anio_mes_producto_id_key;
+        ALTER TABLE precio_productor_anterior
+            RENAME CONSTRAINT precio_productor_producto_id_fkey TO precio_productor_anterior_producto_id_fkey;
+        -- la secuencia se queda para la tabla nueva (si no, se borraria con la vieja)
+        ALTER SEQUENCE precio_productor_id_seq OWNED BY NONE;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS precio_productor (
+    id INT NOT NULL DEFAULT nextval('precio_productor_id_seq'),
+    anio INT NOT NULL,
+    mes TEXT NOT NULL,
+    producto_id INT REFERENCES producto(id),
+    ponderado_usd NUMERIC,
+    ponderado_usd_kg NUMERIC,
+    periodo DATE GENERATED ALWAYS AS (make_date(anio, mes_a_numero(mes), 1)) STORED,
+    PRIMARY KEY (id, anio),
+    UNIQUE(anio, mes, producto_id)
+) PARTITION BY RANGE (anio);
+
+ALTER SEQUENCE precio_productor_id_seq OWNED BY precio_productor.id;
+
+CREATE TABLE IF NOT EXISTS precio_productor_default PARTITION OF precio_productor DEFAULT;
+
+-- =============================================
+-- FUNCION: crear la particion de precio_productor del año p_anio
+-- Si precio_productor_default ya tiene filas de ese año, se pasan a la particion nueva
+-- (sin auditoria: las filas no cambian, solo de lugar). Devuelve el nombre de la
+-- particion, o NULL si ya existia.
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particion_precio_productor(p_anio INT)
+RETURNS TEXT AS $$
+DECLARE
+    v_nombre TEXT := 'precio_productor_p' || p_anio;
+BEGIN
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE precio_productor INCLUDING DEFAULTS INCLUDING GENERATED)', v_nombre);
+    PERFORM set_config('app.moviendo_particion', 'on', true);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM precio_productor_default WHERE anio = %s RETURNING *)
+         INSERT INTO %I (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+         SELECT id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg FROM movidas',
+        p_anio, v_nombre
+    );
+    PERFORM set_config('app.moviendo_particion', 'off', true);
+    EXECUTE format(
+        'ALTER TABLE precio_productor ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+        v_nombre, p_anio, p_anio + 1
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones del año actual y de los proximos p_anios_adelante,
+-- y las de los años que hayan quedado en precio_productor_default
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_precio_productor(p_anios_adelante INT DEFAULT 1)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_anio INT;
+    v_nombre TEXT;
+BEGIN
+    FOR v_anio IN
+        SELECT DISTINCT anio FROM precio_productor_default
+        UNION
+        SELECT extract(year FROM now())::INT + i FROM generate_series(0, p_anios_adelante) AS i
+        ORDER BY 1
+    LOOP
+        v_nombre := crear_particion_precio_productor(v_anio);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: mantenimiento de precio_productor
+-- Crea las particiones que faltan y, si se indica p_tablespace (un tablespace en disco
+-- mas barato), mueve ahi las particiones de años anteriores a los ultimos
+-- p_anios_recientes, con sus indices. Los datos siguen en la tabla: solo cambia donde
+-- se guardan. Pensada para correr una vez por mes, por ejemplo con pg_cron:
+--   SELECT cron.schedule('mantener-precio-productor', '0 4 1 * *', 'SELECT * FROM mantener_precio_productor()');
+-- =============================================
+CREATE OR REPLACE FUNCTION mantener_precio_productor(
+    p_anios_recientes INT DEFAULT 3,
+    p_tablespace TEXT DEFAULT NULL
+)
+RETURNS TABLE(particion TEXT, accion TEXT) AS $$
+DECLARE
+    v_limite INT := extract(year FROM now())::INT - p_anios_recientes + 1;
+    v_nombre TEXT;
+    v_indice TEXT;
+BEGIN
+    FOR v_nombre IN SELECT * FROM crear_particiones_precio_productor() LOOP
+        RETURN QUERY SELECT v_nombre, 'creada'::TEXT;
+    END LOOP;
+
+    IF p_tablespace IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR v_nombre IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace
+        WHERE i.inhparent = 'precio_productor'::regclass
+          AND c.relname ~ '^precio_productor_p[0-9]{4}$'
+          AND substr(c.relname, 19)::INT < v_limite
+          AND t.spcname IS DISTINCT FROM p_tablespace
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE %I SET TABLESPACE %I', v_nombre, p_tablespace);
+        FOR v_indice IN
+            SELECT indexrelid::regclass::TEXT FROM pg_index WHERE indrelid = v_nombre::regclass
+        LOOP
+            EXECUTE format('ALTER INDEX %s SET TABLESPACE %I', v_indice, p_tablespace);
+        END LOOP;
+        RETURN QUERY SELECT v_nombre, ('movida a ' || p_tablespace)::TEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('precio_productor_anterior') IS NOT NULL THEN
+        PERFORM crear_particion_precio_productor(a.anio)
+        FROM (SELECT DISTINCT anio FROM precio_productor_anterior) a;
+
+        INSERT INTO precio_productor (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg
+        FROM precio_productor_anterior;
+
+        DROP TABLE precio_productor_anterior;
+    END IF;
+END $$;
+
+-- los indices de la tabla vieja se fueron con ella; aqui se crean en todas las particiones
+CREATE INDEX IF NOT EXISTS idx_precio_productor_producto_id ON precio_productor(producto_id);
+CREATE INDEX IF NOT EXISTS idx_precio_anio_mes_producto ON precio_productor(anio, mes, producto_id);
+CREATE INDEX IF NOT EXISTS idx_precio_producto_periodo ON precio_productor(producto_id, periodo)
+    INCLUDE (ponderado_usd, ponderado_usd_kg);
+
+SELECT crear_particiones_precio_productor();
+
+-- =============================================
+-- TRIGGER FUNCTION: auditoría en DELETE
+-- El nombre de la tabla se pasa como argumento: en una tabla particionada
+-- TG_TABLE_NAME seria el de la particion. No audita las filas que
+-- crear_particion_precio_productor solo cambia de particion.
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_auditoria_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.moviendo_particion', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
+    PERFORM registrar_auditoria(
+        COALESCE(TG_ARGV[0], TG_TABLE_NAME),
+        'DELETE',
+        current_setting('app.usuario_simulado', true),
+        to_jsonb(OLD),
+        NULL
+    );
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- ASIGNAR TRIGGER a precio_productor
+-- =============================================
+DROP TRIGGER IF EXISTS auditoria_delete_precio ON precio_productor;
+CREATE TRIGGER auditoria_delete_precio
+AFTER DELETE ON precio_productor
+FOR EACH ROW
+EXECUTE FUNCTION trigger_auditoria_delete('precio_productor');
+
+-- =============================================
+-- ASIGNAR TRIGGERS de resumen a precio_productor
+-- (las tablas de transicion solo se permiten con un evento por trigger)
+-- =============================================
+DROP TRIGGER IF EXISTS trg_resumen_precio_insert ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_insert
+AFTER INSERT ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_update ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_update
+AFTER UPDATE ON precio_productor
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_delete ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_delete
+AFTER DELETE ON precio_productor
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+DROP TRIGGER IF EXISTS trg_resumen_precio_truncate ON precio_productor;
+CREATE TRIGGER trg_resumen_precio_truncate
+AFTER TRUNCATE ON precio_productor
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio_truncate();
+
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+BEGIN
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = p_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM producto p
+        WHERE p.id = COALESCE(p_producto_id, (SELECT id FROM producto WHERE nombre = p_nombre_producto))
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT a.id_nuevo, p_anio, p_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.producto_id
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.id = a.id_nuevo THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', COALESCE(p_nombre_producto, p_producto_id::TEXT);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar/actualizar precios en lote
+-- p_precios es un arreglo JSON de objetos
+--   {"anio": 2024, "mes": "Enero", "nombre_producto": "Aguacate Fuerte",
+--    "ponderado_usd": 10.5, "ponderado_usd_kg": 0.2, "usuario_simulado": "opcional"}
+-- En lugar de nombre_producto se puede mandar "producto_id" (no se busca por nombre).
+-- Todo en una transaccion: una sola busqueda de productos, un solo upsert y un solo
+-- INSERT multi-fila en log_auditoria. Devuelve el resultado de cada elemento
+-- ('insertado', 'actualizado' o 'error' con el motivo) en el orden de entrada.
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN precio_productor pp
+      ON pp.producto_id = COALESCE(
+             CASE WHEN jsonb_typeof(e->'producto_id') = 'number' THEN (e->>'producto_id')::NUMERIC::INT END,
+             (SELECT p.id FROM producto p WHERE p.nombre = e->>'nombre_producto'))
+     AND pp.mes = e->>'mes'
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            CASE WHEN jsonb_typeof(e.valor->'producto_id') = 'number'
+                 THEN (e.valor->>'producto_id')::NUMERIC::INT END AS producto_id_pedido,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    validados AS (
+        SELECT
+            en.indice, en.anio, en.mes, en.precios_ok, en.usuario, en.valor,
+            COALESCE(en.nombre_producto, p.nombre) AS nombre_producto,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN mes_a_numero(en.mes) IS NULL THEN format('mes invalido: %s', en.mes)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto',
+                                              COALESCE(en.nombre_producto, en.producto_id_pedido::TEXT))
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica la ultima
+                WHEN en.indice < MAX(en.indice) OVER (PARTITION BY en.anio, en.mes, p.id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM entrada en
+        -- por id si vino, si no por nombre
+        LEFT JOIN producto pn ON en.producto_id_pedido IS NULL AND pn.nombre = en.nombre_producto
+        LEFT JOIN producto p ON p.id = COALESCE(en.producto_id_pedido, pn.id)
+    ),
+    validos AS MATERIALIZED (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.id_nuevo, v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.anio, pp.mes, pp.producto_id
+    ),
+    escritas AS (
+        SELECT u.anio, u.mes, u.producto_id, (u.id = v.id_nuevo) AS insertado
+        FROM upsert u
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN escritas u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        v.mes,
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN escritas u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
+
+COMMIT;
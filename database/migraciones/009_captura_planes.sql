@@ -0,0 +1,249 @@
+-- =============================================
+-- MIGRACION 009: captura de planes (EXPLAIN ANALYZE) de las consultas obtener_* y
+-- deteccion de regresiones. Requiere la migracion 008. Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- CAPTURA DE PLANES Y REGRESIONES
+-- consulta_monitoreada tiene la consulta que ejecuta por dentro cada RPC obtener_*
+-- (un EXPLAIN del RPC solo mostraria "Function Scan"); si se cambia una de esas
+-- funciones hay que actualizar aqui su consulta. capturar_planes() corre
+-- EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) de cada una, guarda el plan en captura_plan
+-- y lo compara con la captura anterior. Pensada para correr todos los dias, por
+-- ejemplo con pg_cron:
+--   SELECT cron.schedule('capturar-planes', '30 3 * * *', 'SELECT * FROM capturar_planes()');
+-- =============================================
+CREATE TABLE IF NOT EXISTS consulta_monitoreada (
+    nombre TEXT PRIMARY KEY,
+    sql TEXT NOT NULL,       -- con %s donde va el parametro, si lo tiene
+    parametro_sql TEXT       -- consulta que devuelve el valor para %s
+);
+
+CREATE TABLE IF NOT EXISTS captura_plan (
+    id BIGSERIAL PRIMARY KEY,
+    consulta TEXT NOT NULL REFERENCES consulta_monitoreada(nombre) ON DELETE CASCADE,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    plan JSONB NOT NULL,
+    ejecucion_ms NUMERIC NOT NULL,
+    planificacion_ms NUMERIC NOT NULL,
+    filas_resultado BIGINT,
+    filas_tablas JSONB,      -- filas estimadas (reltuples) de cada tabla del plan al capturar
+    accesos JSONB,           -- nodos que leen cada tabla, por tipo: {"producto": {"Seq Scan": 1}}
+    regresiones TEXT[] NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_captura_plan_consulta_fecha ON captura_plan(consulta, fecha DESC);
+
+INSERT INTO consulta_monitoreada(nombre, sql, parametro_sql) VALUES
+    ('obtener_productos',
+     'SELECT p.id, p.nombre FROM producto p ORDER BY p.nombre',
+     NULL),
+    ('obtener_version_catalogo',
+     'SELECT version FROM catalogo_version WHERE id = 1',
+     NULL),
+    ('obtener_precios_historicos_completos',
+     'SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+      FROM precio_productor pp
+      WHERE pp.producto_id = %s
+      ORDER BY pp.periodo',
+     -- el producto con mas filas
+     'SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 1'),
+    ('obtener_promedio_usd_por_anio',
+     'SELECT p.nombre, r.anio, ROUND(r.promedio_usd, 2) AS promedio_usd
+      FROM resumen_precio_anual r
+      JOIN producto p ON r.producto_id = p.id
+      ORDER BY p.nombre, r.anio',
+     NULL),
+    ('obtener_variacion_maxima_usd',
+     'SELECT p.nombre, r.max_usd - r.min_usd AS variacion
+      FROM resumen_precio_producto r
+      JOIN producto p ON r.producto_id = p.id
+      ORDER BY variacion DESC',
+     NULL),
+    ('obtener_logs_auditoria',
+     -- la ultima consulta de la funcion, con la ventana de un dia y los 500 de logs.py
+     'SELECT l.id, l.fecha, l.usuario_simulado, l.tabla_afectada, l.operacion, l.datos_antes, l.datos_despues
+      FROM log_auditoria l
+      WHERE l.fecha >= now() - INTERVAL ''1 day''
+      ORDER BY l.fecha DESC, l.id DESC
+      LIMIT %s',
+     'SELECT 500')
+ON CONFLICT (nombre) DO UPDATE
+SET sql = EXCLUDED.sql,
+    parametro_sql = EXCLUDED.parametro_sql;
+
+-- =============================================
+-- FUNCION: capturar el plan de una consulta registrada
+-- Se ejecuta p_repeticiones veces y se guarda la mas rapida (la primera suele pagar la
+-- cache fria). Marca como regresion, respecto de la captura anterior:
+--   * una tabla con mas lecturas Seq Scan y menos lecturas por indice que antes
+--     (en una tabla particionada se cuenta una lectura por particion)
+--   * una ejecucion p_factor_lento veces mas lenta (si pasa de p_ms_minimo, para no
+--     marcar ruido en consultas de fracciones de milisegundo)
+-- Devuelve el id de la captura.
+-- =============================================
+CREATE OR REPLACE FUNCTION capturar_plan(
+    p_consulta TEXT,
+    p_repeticiones INT DEFAULT 3,
+    p_factor_lento NUMERIC DEFAULT 2,
+    p_ms_minimo NUMERIC DEFAULT 1
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_registro consulta_monitoreada%ROWTYPE;
+    v_sql TEXT;
+    v_parametro TEXT;
+    v_explain JSONB;
+    v_plan JSONB;
+    v_accesos JSONB;
+    v_filas_tablas JSONB;
+    v_anterior captura_plan%ROWTYPE;
+    v_regresiones TEXT[] := '{}';
+    v_relacion TEXT;
+    v_seq INT;
+    v_indice INT;
+    v_seq_antes INT;
+    v_indice_antes INT;
+    v_id BIGINT;
+BEGIN
+    SELECT * INTO v_registro FROM consulta_monitoreada WHERE nombre = p_consulta;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'La consulta % no esta en consulta_monitoreada', p_consulta;
+    END IF;
+
+    v_sql := v_registro.sql;
+    IF v_registro.parametro_sql IS NOT NULL THEN
+        EXECUTE v_registro.parametro_sql INTO v_parametro;
+        v_sql := format(v_sql, quote_nullable(v_parametro));
+    END IF;
+
+    FOR i IN 1..GREATEST(p_repeticiones, 1) LOOP
+        EXECUTE 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' || v_sql INTO v_explain;
+        IF v_plan IS NULL OR (v_explain->0->>'Execution Time')::NUMERIC < (v_plan->>'Execution Time')::NUMERIC THEN
+            v_plan := v_explain->0;
+        END IF;
+    END LOOP;
+
+    -- cada tabla del plan (cualquier nivel) con cuantos nodos de cada tipo la leen y sus filas;
+    -- las particiones se juntan bajo su tabla (precio_productor, log_auditoria)
+    WITH nodos AS (
+        SELECT COALESCE(pg_partition_root(c.oid), c.oid)::regclass::TEXT AS relacion,
+               c.oid, GREATEST(c.reltuples, 0) AS filas, n->>'Node Type' AS nodo
+        FROM jsonb_path_query(v_plan, 'strict $.**') AS n
+        JOIN pg_class c ON c.oid = to_regclass(n->>'Relation Name')
+        WHERE jsonb_typeof(n) = 'object' AND n ? 'Relation Name'
+    )
+    SELECT jsonb_object_agg(a.relacion, a.nodos), jsonb_object_agg(a.relacion, f.filas)
+    INTO v_accesos, v_filas_tablas
+    FROM (
+        SELECT relacion, jsonb_object_agg(nodo, n) AS nodos
+        FROM (SELECT relacion, nodo, count(*) AS n FROM nodos GROUP BY relacion, nodo) c
+        GROUP BY relacion
+    ) a
+    JOIN (
+        SELECT relacion, sum(filas)::BIGINT AS filas
+        FROM (SELECT DISTINCT relacion, oid, filas FROM nodos) d
+        GROUP BY relacion
+    ) f USING (relacion);
+
+    SELECT * INTO v_anterior
+    FROM captura_plan
+    WHERE consulta = p_consulta
+    ORDER BY fecha DESC, id DESC
+    LIMIT 1;
+
+    IF FOUND THEN
+        FOR v_relacion IN SELECT jsonb_object_keys(COALESCE(v_accesos, '{}')) LOOP
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq, v_indice
+            FROM jsonb_each_text(v_accesos->v_relacion) AS e(nodo, n);
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq_antes, v_indice_antes
+            FROM jsonb_each_text(COALESCE(v_anterior.accesos->v_relacion, '{}')) AS e(nodo, n);
+
+            IF v_seq > v_seq_antes AND v_indice < v_indice_antes THEN
+                v_regresiones := v_regresiones || format('Seq Scan en %s en lugar de indice (%s -> %s lecturas con indice)',
+                    v_relacion, v_indice_antes, v_indice);
+            END IF;
+        END LOOP;
+
+        IF (v_plan->>'Execution Time')::NUMERIC >= p_ms_minimo
+           AND (v_plan->>'Execution Time')::NUMERIC >= p_factor_lento * v_anterior.ejecucion_ms THEN
+            v_regresiones := v_regresiones || format('%sx mas lenta (%s ms, antes %s ms)',
+                round((v_plan->>'Execution Time')::NUMERIC / NULLIF(v_anterior.ejecucion_ms, 0), 1),
+                round((v_plan->>'Execution Time')::NUMERIC, 3), round(v_anterior.ejecucion_ms, 3));
+        END IF;
+    END IF;
+
+    INSERT INTO captura_plan(consulta, plan, ejecucion_ms, planificacion_ms, filas_resultado,
+                             filas_tablas, accesos, regresiones)
+    VALUES (
+        p_consulta,
+        v_plan,
+        (v_plan->>'Execution Time')::NUMERIC,
+        (v_plan->>'Planning Time')::NUMERIC,
+        (v_plan->'Plan'->>'Actual Rows')::BIGINT,
+        v_filas_tablas,
+        v_accesos,
+        v_regresiones
+    )
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: capturar los planes de todas las consultas registradas
+-- =============================================
+CREATE OR REPLACE FUNCTION capturar_planes(
+    p_repeticiones INT DEFAULT 3,
+    p_factor_lento NUMERIC DEFAULT 2,
+    p_ms_minimo NUMERIC DEFAULT 1
+)
+RETURNS TABLE(consulta TEXT, ejecucion_ms NUMERIC, regresiones TEXT[]) AS $$
+#variable_conflict use_column
+DECLARE
+    v_nombre TEXT;
+    v_id BIGINT;
+BEGIN
+    FOR v_nombre IN SELECT nombre FROM consulta_monitoreada ORDER BY nombre LOOP
+        v_id := capturar_plan(v_nombre, p_repeticiones, p_factor_lento, p_ms_minimo);
+        RETURN QUERY
+        SELECT c.consulta, c.ejecucion_ms, c.regresiones FROM captura_plan c WHERE c.id = v_id;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: ultima captura de cada consulta, con el tiempo de la anterior
+-- (la usa analisis.py)
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_capturas_plan()
+RETURNS TABLE(
+    consulta TEXT,
+    fecha TIMESTAMP,
+    ejecucion_ms NUMERIC,
+    ejecucion_ms_anterior NUMERIC,
+    filas_resultado BIGINT,
+    filas_tablas JSONB,
+    accesos JSONB,
+    regresiones TEXT[],
+    plan JSONB
+) AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    SELECT c.consulta, c.fecha, c.ejecucion_ms, c.anterior_ms, c.filas_resultado,
+           c.filas_tablas, c.accesos, c.regresiones, c.plan
+    FROM (
+        SELECT cp.*,
+               lag(cp.ejecucion_ms) OVER (PARTITION BY cp.consulta ORDER BY cp.fecha, cp.id) AS anterior_ms,
+               row_number() OVER (PARTITION BY cp.consulta ORDER BY cp.fecha DESC, cp.id DESC) AS n
+        FROM captura_plan cp
+    ) c
+    WHERE c.n = 1
+    ORDER BY cardinality(c.regresiones) DESC, c.consulta;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,233 @@
+-- =============================================
+-- MIGRACION 010: asesor de indices (analizar_indices)
+-- Requiere la migracion 009 (captura_plan). Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- ASESOR DE INDICES
+-- analizar_indices() revisa los indices del schema public con el catalogo y las
+-- estadisticas acumuladas desde el ultimo reset (pg_stat_user_indexes,
+-- pg_stat_user_tables, los planes de captura_plan y, si esta instalada,
+-- pg_stat_statements), o sea con la carga que de verdad produjeron los RPC y las
+-- simulaciones. Un hallazgo por fila:
+--   redundante: sus columnas son el inicio de otro indice btree de la misma tabla
+--   sin_uso:    ninguna lectura desde el reset (no se cuentan los de PK/UNIQUE)
+--   faltante:   una FK sin indice, o una consulta de captura_plan que lee la tabla con
+--               Seq Scan y descarta muchas filas con el filtro
+-- escrituras_indice: entradas que escribe el indice (filas insertadas + actualizaciones
+--   no HOT de la tabla): lo que se ahorra al borrarlo o lo que cuesta crearlo.
+-- beneficio_lectura: lecturas que hicieron con el indice (idx_scan) en los existentes;
+--   filas que no habria que leer en los faltantes.
+-- En las tablas particionadas se suman las estadisticas de todas las particiones.
+-- =============================================
+CREATE OR REPLACE FUNCTION analizar_indices(p_filas_minimas BIGINT DEFAULT 1000)
+RETURNS TABLE(
+    hallazgo TEXT,
+    tabla TEXT,
+    indice TEXT,
+    columnas TEXT,
+    detalle TEXT,
+    tamano_bytes BIGINT,
+    escrituras_indice BIGINT,
+    beneficio_lectura BIGINT,
+    sugerencia TEXT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_hay_pss BOOLEAN := to_regclass('pg_stat_statements') IS NOT NULL;
+    v_candidato RECORD;
+    v_llamadas BIGINT;
+BEGIN
+    -- redundantes y sin uso
+    RETURN QUERY
+    WITH tablas AS (
+        SELECT c.oid, c.relname
+        FROM pg_class c
+        WHERE c.relnamespace = 'public'::regnamespace
+          AND c.relkind IN ('r', 'p')
+          AND NOT c.relispartition
+    ),
+    -- las estadisticas de cada particion se suman en su tabla (pg_partition_root)
+    escrituras AS (
+        SELECT COALESCE(pg_partition_root(s.relid), s.relid) AS oid,
+               sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd)::BIGINT AS filas
+        FROM pg_stat_user_tables s
+        GROUP BY 1
+    ),
+    indices AS (
+        SELECT
+            i.indexrelid AS oid,
+            i.indrelid AS tabla_oid,
+            ic.relname AS nombre,
+            am.amname,
+            i.indisunique,
+            EXISTS (SELECT 1 FROM pg_constraint k
+                    WHERE k.conindid = i.indexrelid AND k.conrelid = i.indrelid
+                      AND k.contype IN ('p', 'u', 'x')) AS de_restriccion,
+            i.indpred IS NOT NULL OR i.indexprs IS NOT NULL AS especial,
+            string_to_array(i.indkey::TEXT, ' ')::INT[] AS todas,
+            (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:i.indnkeyatts] AS claves
+        FROM pg_index i
+        JOIN tablas t ON t.oid = i.indrelid
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = ic.relam
+    ),
+    uso AS (
+        SELECT COALESCE(pg_partition_root(s.indexrelid), s.indexrelid) AS oid,
+               sum(s.idx_scan)::BIGINT AS lecturas,
+               sum(pg_relation_size(s.indexrelid))::BIGINT AS tamano
+        FROM pg_stat_user_indexes s
+        GROUP BY 1
+    ),
+    redundantes AS (
+        SELECT DISTINCT ON (a.oid) a.oid, b.nombre AS cubierto_por
+        FROM indices a
+        JOIN indices b ON b.tabla_oid = a.tabla_oid AND b.oid <> a.oid
+        WHERE a.amname = 'btree' AND b.amname = 'btree'
+          AND NOT a.especial AND NOT b.especial
+          AND NOT a.de_restriccion
+          AND b.claves[1:cardinality(a.claves)] = a.claves
+          AND a.todas <@ b.todas
+          AND (NOT a.indisunique OR (b.indisunique AND b.claves = a.claves))
+          -- de dos indices iguales se marca uno solo (se queda el de la restriccion o el mas viejo)
+          AND NOT (b.claves = a.claves AND b.todas <@ a.todas AND a.indisunique = b.indisunique
+                   AND NOT b.de_restriccion AND b.oid > a.oid)
+        ORDER BY a.oid, b.de_restriccion DESC, cardinality(b.claves)
+    ),
+    hallazgos AS (
+        SELECT ix.*, r.cubierto_por,
+               CASE WHEN r.oid IS NOT NULL THEN 'redundante' ELSE 'sin_uso' END AS tipo
+        FROM indices ix
+        LEFT JOIN redundantes r ON r.oid = ix.oid
+        JOIN uso u ON u.oid = ix.oid
+        WHERE r.oid IS NOT NULL
+           OR (u.lecturas = 0 AND NOT ix.indisunique AND NOT ix.de_restriccion)
+    )
+    SELECT
+        h.tipo,
+        t.relname::TEXT,
+        h.nombre::TEXT,
+        (SELECT string_agg(a.attname, ', ' ORDER BY k.n)
+         FROM unnest(h.claves) WITH ORDINALITY AS k(attnum, n)
+         JOIN pg_attribute a ON a.attrelid = h.tabla_oid AND a.attnum = k.attnum),
+        CASE h.tipo
+            WHEN 'redundante' THEN format('sus columnas son el inicio de %s, que puede atender sus %s lecturas',
+                                          h.cubierto_por, u.lecturas)
+            ELSE 'ninguna lectura lo uso desde el ultimo reset de estadisticas'
+        END,
+        u.tamano,
+        e.filas,
+        u.lecturas,
+        format('DROP INDEX %I;', h.nombre)
+    FROM hallazgos h
+    JOIN tablas t ON t.oid = h.tabla_oid
+    JOIN uso u ON u.oid = h.oid
+    JOIN escrituras e ON e.oid = h.tabla_oid
+    ORDER BY h.tipo, e.filas DESC;
+
+    -- FK sin indice: cada DELETE/UPDATE de la tabla referenciada recorre esta tabla
+    RETURN QUERY
+    SELECT
+        'faltante'::TEXT,
+        c.relname::TEXT,
+        NULL::TEXT,
+        (SELECT string_agg(a.attname, ', ' ORDER BY k.n)
+         FROM unnest(f.conkey) WITH ORDINALITY AS k(attnum, n)
+         JOIN pg_attribute a ON a.attrelid = f.conrelid AND a.attnum = k.attnum),
+        format('FK %s hacia %s sin indice', f.conname, f.confrelid::regclass),
+        NULL::BIGINT,
+        (SELECT COALESCE(sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd), 0)::BIGINT
+         FROM pg_stat_user_tables s
+         WHERE COALESCE(pg_partition_root(s.relid), s.relid) = f.conrelid),
+        ((SELECT COALESCE(sum(s.n_tup_del + s.n_tup_upd), 0)
+          FROM pg_stat_user_tables s WHERE s.relid = f.confrelid)
+         * GREATEST(c.reltuples, 0))::BIGINT,
+        format('CREATE INDEX ON %I (%s);', c.relname,
+               (SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY k.n)
+                FROM unnest(f.conkey) WITH ORDINALITY AS k(attnum, n)
+                JOIN pg_attribute a ON a.attrelid = f.conrelid AND a.attnum = k.attnum))
+    FROM pg_constraint f
+    JOIN pg_class c ON c.oid = f.conrelid
+    WHERE f.contype = 'f'
+      AND c.relnamespace = 'public'::regnamespace
+      AND NOT c.relispartition
+      AND NOT EXISTS (
+          SELECT 1 FROM pg_index i
+          WHERE i.indrelid = f.conrelid
+            AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:cardinality(f.conkey)] @> f.conkey::INT[]
+            AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:cardinality(f.conkey)] <@ f.conkey::INT[]
+      );
+
+    -- Seq Scan con filtro en la ultima captura de cada consulta (ver capturar_planes)
+    FOR v_candidato IN
+        WITH ultimas AS (
+            SELECT DISTINCT ON (cp.consulta) cp.consulta, cp.plan
+            FROM captura_plan cp
+            ORDER BY cp.consulta, cp.fecha DESC, cp.id DESC
+        ),
+        nodos AS (
+            SELECT u.consulta,
+                   COALESCE(pg_partition_root(c.oid), c.oid) AS tabla_oid,
+                   n->>'Filter' AS filtro,
+                   COALESCE((n->>'Rows Removed by Filter')::NUMERIC, 0) * COALESCE((n->>'Actual Loops')::NUMERIC, 1) AS descartadas,
+                   COALESCE((n->>'Actual Rows')::NUMERIC, 0) * COALESCE((n->>'Actual Loops')::NUMERIC, 1) AS devueltas
+            FROM ultimas u
+            CROSS JOIN LATERAL jsonb_path_query(u.plan, 'strict $.**') AS n
+            JOIN pg_class c ON c.oid = to_regclass(n->>'Relation Name')
+            WHERE jsonb_typeof(n) = 'object'
+              AND n->>'Node Type' = 'Seq Scan'
+              AND n ? 'Filter'
+        ),
+        por_tabla AS (
+            SELECT consulta, tabla_oid, min(filtro) AS filtro,
+                   sum(descartadas)::BIGINT AS descartadas, sum(devueltas)::BIGINT AS devueltas
+            FROM nodos
+            GROUP BY consulta, tabla_oid
+        )
+        SELECT p.*, t.relname, col.attnums, col.nombres
+        FROM por_tabla p
+        JOIN pg_class t ON t.oid = p.tabla_oid
+        CROSS JOIN LATERAL (
+            -- columnas de la tabla que aparecen en el filtro
+            SELECT array_agg(a.attnum ORDER BY a.attnum) AS attnums,
+                   string_agg(quote_ident(a.attname), ', ' ORDER BY a.attnum) AS nombres
+            FROM pg_attribute a
+            WHERE a.attrelid = p.tabla_oid AND a.attnum > 0 AND NOT a.attisdropped
+              AND p.filtro ~ ('\m' || a.attname || '\M')
+        ) col
+        WHERE p.descartadas >= p_filas_minimas
+          AND p.descartadas > 10 * p.devueltas
+          AND col.attnums IS NOT NULL
+          -- si ya hay un indice que empieza por alguna de esas columnas, no es falta de indice
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_index i
+              WHERE i.indrelid = p.tabla_oid
+                AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1] = ANY(col.attnums)
+          )
+    LOOP
+        v_llamadas := NULL;
+        IF v_hay_pss THEN
+            EXECUTE 'SELECT sum(calls)::BIGINT FROM pg_stat_statements WHERE query ILIKE $1'
+            INTO v_llamadas
+            USING '%' || v_candidato.consulta || '(%';
+        END IF;
+
+        RETURN QUERY
+        SELECT
+            'faltante'::TEXT,
+            v_candidato.relname::TEXT,
+            NULL::TEXT,
+            v_candidato.nombres,
+            format('%s: Seq Scan descarta %s filas por ejecucion (filtro %s); %s',
+                   v_candidato.consulta, v_candidato.descartadas, v_candidato.filtro,
+                   CASE WHEN v_llamadas IS NULL THEN 'beneficio por ejecucion (sin pg_stat_statements)'
+                        ELSE format('%s llamadas en pg_stat_statements', v_llamadas) END),
+            NULL::BIGINT,
+            (SELECT COALESCE(sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd), 0)::BIGINT
+             FROM pg_stat_user_tables s
+             WHERE COALESCE(pg_partition_root(s.relid), s.relid) = v_candidato.tabla_oid),
+            v_candidato.descartadas * COALESCE(NULLIF(v_llamadas, 0), 1),
+            format('CREATE INDEX ON %I (%s);', v_candidato.relname, v_candidato.nombres);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
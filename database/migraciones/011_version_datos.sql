@@ -0,0 +1,72 @@
+-- =============================================
+-- MIGRACION 011: version de los datos de precio_productor para la cache de analisis.py
+-- Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- VERSION DE LOS DATOS (cache de los clientes)
+-- version_precios_seq sube con cada sentencia que cambia filas de precio_productor.
+-- Es una secuencia y no una fila para no bloquear a los escritores concurrentes
+-- (nextval no espera a nadie). Como nextval no es transaccional, la version puede
+-- subir un momento antes de que el cambio se vea; los clientes ademas usan un TTL.
+-- =============================================
+CREATE SEQUENCE IF NOT EXISTS version_precios_seq;
+
+CREATE OR REPLACE FUNCTION trigger_version_precios()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- un INSERT ... ON CONFLICT o un UPDATE que no toco filas no cambia la version
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NOT EXISTS (SELECT 1 FROM nuevas) THEN
+            RETURN NULL;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM viejas) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    PERFORM nextval('version_precios_seq');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_version_precios_insert ON precio_productor;
+CREATE TRIGGER trg_version_precios_insert
+AFTER INSERT ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+DROP TRIGGER IF EXISTS trg_version_precios_update ON precio_productor;
+CREATE TRIGGER trg_version_precios_update
+AFTER UPDATE ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+DROP TRIGGER IF EXISTS trg_version_precios_delete ON precio_productor;
+CREATE TRIGGER trg_version_precios_delete
+AFTER DELETE ON precio_productor
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+DROP TRIGGER IF EXISTS trg_version_precios_truncate ON precio_productor;
+CREATE TRIGGER trg_version_precios_truncate
+AFTER TRUNCATE ON precio_productor
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+-- =============================================
+-- FUNCION: version de los datos que lee analisis.py (precios + catalogo de productos)
+-- Las dos partes solo suben, asi que la suma tambien: si cambia, algo cambio.
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_version_datos()
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM version_precios_seq)
+         + (SELECT version FROM catalogo_version WHERE id = 1);
+$$;
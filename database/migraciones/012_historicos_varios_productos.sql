@@ -0,0 +1,32 @@
+-- =============================================
+-- MIGRACION 012: historico de varios productos en una sola llamada
+-- Requiere la migracion 009 (consulta_monitoreada). Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- historico de varios productos en una sola llamada (el comparador de analisis.py).
+-- Sin el nombre ni el mes en texto: el cliente ya tiene el catalogo y el mes sale de periodo.
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_productos(prod_ids INT[])
+RETURNS TABLE(producto_id INT, anio INT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = ANY(prod_ids)
+    ORDER BY pp.producto_id, pp.periodo;
+END;
+$$;
+
+INSERT INTO consulta_monitoreada(nombre, sql, parametro_sql) VALUES
+    ('obtener_precios_historicos_productos',
+     'SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+      FROM precio_productor pp
+      WHERE pp.producto_id = ANY(%s::int[])
+      ORDER BY pp.producto_id, pp.periodo',
+     -- los 20 productos con mas filas
+     'SELECT array_agg(producto_id) FROM (
+          SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t')
+ON CONFLICT (nombre) DO UPDATE
+SET sql = EXCLUDED.sql,
+    parametro_sql = EXCLUDED.parametro_sql;
@@ -0,0 +1,76 @@
+-- =============================================
+-- MIGRACION 013: rango de periodos en los historicos (filtro en la base)
+-- Requiere la migracion 012. Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- las versiones sin rango se borran: con los parametros nuevos con DEFAULT,
+-- una llamada con un solo argumento seria ambigua entre las dos
+DROP FUNCTION IF EXISTS obtener_precios_historicos_completos(INT);
+DROP FUNCTION IF EXISTS obtener_precios_historicos_productos(INT[]);
+
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_completos(
+    prod_id INT,
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(anio INT, mes TEXT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_desde DATE := COALESCE(date_trunc('month', p_desde)::DATE, '-infinity');
+    v_hasta DATE := COALESCE(date_trunc('month', p_hasta)::DATE, 'infinity');
+BEGIN
+    RETURN QUERY
+    SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = prod_id
+      AND pp.periodo BETWEEN v_desde AND v_hasta
+      -- el mismo rango en anio, para que solo se lean las particiones de esos años
+      AND pp.anio BETWEEN COALESCE(extract(year FROM p_desde)::INT, 0)
+                      AND COALESCE(extract(year FROM p_hasta)::INT, 9999)
+    ORDER BY pp.periodo;
+END;
+$$;
+
+
+-- historico de varios productos en una sola llamada (el comparador de analisis.py).
+-- Sin el nombre ni el mes en texto: el cliente ya tiene el catalogo y el mes sale de periodo.
+-- p_desde / p_hasta: meses del rango (inclusive); NULL = sin limite. Un año es
+-- p_desde = 'AAAA-01-01', p_hasta = 'AAAA-12-01'.
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_productos(
+    prod_ids INT[],
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(producto_id INT, anio INT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_desde DATE := COALESCE(date_trunc('month', p_desde)::DATE, '-infinity');
+    v_hasta DATE := COALESCE(date_trunc('month', p_hasta)::DATE, 'infinity');
+BEGIN
+    RETURN QUERY
+    SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = ANY(prod_ids)
+      AND pp.periodo BETWEEN v_desde AND v_hasta
+      AND pp.anio BETWEEN COALESCE(extract(year FROM p_desde)::INT, 0)
+                      AND COALESCE(extract(year FROM p_hasta)::INT, 9999)
+    ORDER BY pp.producto_id, pp.periodo;
+END;
+$$;
+
+
+-- años con datos de los productos (para el filtro por año sin bajar el historico)
+CREATE OR REPLACE FUNCTION obtener_anios_productos(prod_ids INT[])
+RETURNS TABLE(anio INT, filas BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT r.anio, sum(r.filas)::BIGINT
+    FROM resumen_precio_anual r
+    WHERE r.producto_id = ANY(prod_ids)
+      AND r.filas > 0
+    GROUP BY r.anio
+    ORDER BY r.anio;
+$$;
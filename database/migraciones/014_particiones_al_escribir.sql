@@ -0,0 +1,387 @@
+-- =============================================
+-- MIGRACION 014: particiones de precio_productor creadas al escribir
+-- insertar_precio_productor, upsert_precio_productor e insertar_precios_productor_lote
+-- crean la particion del año antes de escribir, y los cargadores llaman a
+-- crear_particiones_anios() con los años del archivo: las filas ya no quedan en
+-- precio_productor_default hasta la corrida de mantenimiento.
+-- Al final se mueven a su particion las filas que hoy estan en la default.
+-- Requiere la migracion 008. Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- =============================================
+-- FUNCION: crear la particion de precio_productor del año p_anio
+-- Si precio_productor_default ya tiene filas de ese año, se pasan a la particion nueva
+-- (sin auditoria: las filas no cambian, solo de lugar). Devuelve el nombre de la
+-- particion, o NULL si ya existia.
+-- La llaman las funciones de escritura en cada llamada: si la particion existe solo
+-- cuesta un to_regclass. SECURITY DEFINER porque ATTACH PARTITION requiere ser dueño
+-- de precio_productor y las RPC corren con el rol de la API.
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particion_precio_productor(p_anio INT)
+RETURNS TEXT
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_nombre TEXT := 'precio_productor_p' || p_anio;
+BEGIN
+    IF p_anio IS NULL OR to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- dos sesiones que escriben el mismo año nuevo a la vez: la segunda espera aca
+    -- (el ATTACH igual necesita este bloqueo) y despues ya ve la particion creada
+    LOCK TABLE precio_productor_default IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE precio_productor INCLUDING DEFAULTS INCLUDING GENERATED)', v_nombre);
+    PERFORM set_config('app.moviendo_particion', 'on', true);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM precio_productor_default WHERE anio = %s RETURNING *)
+         INSERT INTO %I (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+         SELECT id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg FROM movidas',
+        p_anio, v_nombre
+    );
+    PERFORM set_config('app.moviendo_particion', 'off', true);
+    EXECUTE format(
+        'ALTER TABLE precio_productor ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+        v_nombre, p_anio, p_anio + 1
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones de los años p_anios (los cargadores la llaman con
+-- los años del archivo antes de escribir, asi nada cae en precio_productor_default)
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_anios(p_anios INT[])
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_anio INT;
+    v_nombre TEXT;
+BEGIN
+    FOR v_anio IN SELECT DISTINCT a FROM unnest(p_anios) AS a WHERE a IS NOT NULL ORDER BY 1 LOOP
+        v_nombre := crear_particion_precio_productor(v_anio);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar precio productor
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_producto_id INT := p_producto_id;
+    precio_existente RECORD;
+BEGIN
+    PERFORM crear_particion_precio_productor(p_anio);
+
+    -- Obtener ID del producto
+    IF v_producto_id IS NULL THEN
+        SELECT id INTO v_producto_id
+        FROM producto
+        WHERE nombre = p_nombre_producto;
+    END IF;
+
+    IF v_producto_id IS NULL THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
+    END IF;
+
+    -- Buscar si ya existe registro del precio, bloqueando la fila si existe
+    SELECT * INTO precio_existente
+    FROM precio_productor
+    WHERE anio = p_anio
+      AND mes = p_mes
+      AND producto_id = v_producto_id
+    FOR UPDATE;  -- ⛔️ Bloquea la fila si existe
+
+    IF NOT FOUND THEN
+        -- Si no existe, insertar
+        INSERT INTO precio_productor(anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        VALUES (p_anio, p_mes, v_producto_id, p_ponderado_usd, p_ponderado_usd_kg);
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'INSERT',
+            p_usuario_simulado,
+            NULL,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    ELSE
+        -- Si ya existe, actualizar (con la fila bloqueada previamente)
+        UPDATE precio_productor
+        SET
+            ponderado_usd = p_ponderado_usd,
+            ponderado_usd_kg = p_ponderado_usd_kg
+        WHERE id = precio_existente.id;
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'UPDATE',
+            p_usuario_simulado,
+            to_jsonb(precio_existente),
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+BEGIN
+    PERFORM crear_particion_precio_productor(p_anio);
+
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = p_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM producto p
+        WHERE p.id = COALESCE(p_producto_id, (SELECT id FROM producto WHERE nombre = p_nombre_producto))
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT a.id_nuevo, p_anio, p_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.producto_id
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.id = a.id_nuevo THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', p_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', COALESCE(p_nombre_producto, p_producto_id::TEXT);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: insertar/actualizar precios en lote
+-- p_precios es un arreglo JSON de objetos
+--   {"anio": 2024, "mes": "Enero", "nombre_producto": "Aguacate Fuerte",
+--    "ponderado_usd": 10.5, "ponderado_usd_kg": 0.2, "usuario_simulado": "opcional"}
+-- En lugar de nombre_producto se puede mandar "producto_id" (no se busca por nombre).
+-- Todo en una transaccion: una sola busqueda de productos, un solo upsert y un solo
+-- INSERT multi-fila en log_auditoria. Devuelve el resultado de cada elemento
+-- ('insertado', 'actualizado' o 'error' con el motivo) en el orden de entrada.
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- particiones de los años del lote, antes de bloquear o escribir filas
+    PERFORM crear_particiones_anios(ARRAY(
+        SELECT (e->>'anio')::NUMERIC::INT
+        FROM jsonb_array_elements(p_precios) e
+        WHERE jsonb_typeof(e->'anio') = 'number'
+    ));
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN precio_productor pp
+      ON pp.producto_id = COALESCE(
+             CASE WHEN jsonb_typeof(e->'producto_id') = 'number' THEN (e->>'producto_id')::NUMERIC::INT END,
+             (SELECT p.id FROM producto p WHERE p.nombre = e->>'nombre_producto'))
+     AND pp.mes = e->>'mes'
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            CASE WHEN jsonb_typeof(e.valor->'producto_id') = 'number'
+                 THEN (e.valor->>'producto_id')::NUMERIC::INT END AS producto_id_pedido,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    validados AS (
+        SELECT
+            en.indice, en.anio, en.mes, en.precios_ok, en.usuario, en.valor,
+            COALESCE(en.nombre_producto, p.nombre) AS nombre_producto,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN mes_a_numero(en.mes) IS NULL THEN format('mes invalido: %s', en.mes)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto',
+                                              COALESCE(en.nombre_producto, en.producto_id_pedido::TEXT))
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica la ultima
+                WHEN en.indice < MAX(en.indice) OVER (PARTITION BY en.anio, en.mes, p.id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM entrada en
+        -- por id si vino, si no por nombre
+        LEFT JOIN producto pn ON en.producto_id_pedido IS NULL AND pn.nombre = en.nombre_producto
+        LEFT JOIN producto p ON p.id = COALESCE(en.producto_id_pedido, pn.id)
+    ),
+    validos AS MATERIALIZED (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.id_nuevo, v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.anio, pp.mes, pp.producto_id
+    ),
+    escritas AS (
+        SELECT u.anio, u.mes, u.producto_id, (u.id = v.id_nuevo) AS insertado
+        FROM upsert u
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN escritas u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        v.mes,
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN escritas u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
+
+
+-- filas que ya estaban en precio_productor_default
+SELECT * FROM crear_particiones_precio_productor();
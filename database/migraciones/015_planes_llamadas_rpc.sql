@@ -0,0 +1,264 @@
+-- =============================================
+-- MIGRACION 015: planes capturados de las llamadas reales a los RPC
+-- consulta_monitoreada pasa a guardar la llamada a cada RPC (SELECT * FROM obtener_x(...))
+-- en vez de una copia de su consulta interna, que quedaba desactualizada. Las funciones
+-- de lectura pasan a LANGUAGE sql STABLE para que el planificador las expanda y el
+-- EXPLAIN muestre su plan por dentro. parametro_sql puede devolver varias columnas.
+-- Requiere las migraciones 009 y 013. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION public.obtener_productos()
+ RETURNS TABLE(id integer, nombre text)
+ LANGUAGE sql
+ STABLE
+AS $function$
+    SELECT p.id, p.nombre
+    FROM public.producto p
+    ORDER BY p.nombre;
+$function$;
+
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_completos(
+    prod_id INT,
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(anio INT, mes TEXT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = prod_id
+      AND pp.periodo BETWEEN COALESCE(date_trunc('month', p_desde::TIMESTAMP)::DATE, '-infinity')
+                         AND COALESCE(date_trunc('month', p_hasta::TIMESTAMP)::DATE, 'infinity')
+      -- el mismo rango en anio, para que solo se lean las particiones de esos años
+      AND pp.anio BETWEEN COALESCE(extract(year FROM p_desde)::INT, 0)
+                      AND COALESCE(extract(year FROM p_hasta)::INT, 9999)
+    ORDER BY pp.periodo;
+$$;
+
+-- historico de varios productos en una sola llamada (el comparador de analisis.py).
+-- Sin el nombre ni el mes en texto: el cliente ya tiene el catalogo y el mes sale de periodo.
+-- p_desde / p_hasta: meses del rango (inclusive); NULL = sin limite. Un año es
+-- p_desde = 'AAAA-01-01', p_hasta = 'AAAA-12-01'.
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_productos(
+    prod_ids INT[],
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(producto_id INT, anio INT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = ANY(prod_ids)
+      AND pp.periodo BETWEEN COALESCE(date_trunc('month', p_desde::TIMESTAMP)::DATE, '-infinity')
+                         AND COALESCE(date_trunc('month', p_hasta::TIMESTAMP)::DATE, 'infinity')
+      AND pp.anio BETWEEN COALESCE(extract(year FROM p_desde)::INT, 0)
+                      AND COALESCE(extract(year FROM p_hasta)::INT, 9999)
+    ORDER BY pp.producto_id, pp.periodo;
+$$;
+
+CREATE OR REPLACE FUNCTION obtener_promedio_usd_por_anio()
+RETURNS TABLE(nombre TEXT, anio INT, promedio_usd NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    -- se lee de la tabla de resumen: O(productos x años) en vez de recorrer precio_productor
+    SELECT
+        p.nombre,
+        r.anio,
+        ROUND(r.promedio_usd, 2) AS promedio_usd
+    FROM
+        resumen_precio_anual r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY p.nombre, r.anio;
+$$;
+
+CREATE OR REPLACE FUNCTION obtener_variacion_maxima_usd()
+RETURNS TABLE(nombre TEXT, variacion NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        p.nombre,
+        r.max_usd - r.min_usd AS variacion
+    FROM
+        resumen_precio_producto r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY variacion DESC;
+$$;
+
+-- =============================================
+-- FUNCION: capturar el plan de una consulta registrada
+-- Se ejecuta p_repeticiones veces y se guarda la mas rapida (la primera suele pagar la
+-- cache fria). Marca como regresion, respecto de la captura anterior:
+--   * una tabla con mas lecturas Seq Scan y menos lecturas por indice que antes
+--     (en una tabla particionada se cuenta una lectura por particion)
+--   * una ejecucion p_factor_lento veces mas lenta (si pasa de p_ms_minimo, para no
+--     marcar ruido en consultas de fracciones de milisegundo)
+-- Devuelve el id de la captura.
+-- =============================================
+CREATE OR REPLACE FUNCTION capturar_plan(
+    p_consulta TEXT,
+    p_repeticiones INT DEFAULT 3,
+    p_factor_lento NUMERIC DEFAULT 2,
+    p_ms_minimo NUMERIC DEFAULT 1
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_registro consulta_monitoreada%ROWTYPE;
+    v_sql TEXT;
+    v_parametros TEXT[];
+    v_explain JSONB;
+    v_plan JSONB;
+    v_accesos JSONB;
+    v_filas_tablas JSONB;
+    v_anterior captura_plan%ROWTYPE;
+    v_regresiones TEXT[] := '{}';
+    v_relacion TEXT;
+    v_seq INT;
+    v_indice INT;
+    v_seq_antes INT;
+    v_indice_antes INT;
+    v_id BIGINT;
+BEGIN
+    SELECT * INTO v_registro FROM consulta_monitoreada WHERE nombre = p_consulta;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'La consulta % no esta en consulta_monitoreada', p_consulta;
+    END IF;
+
+    v_sql := v_registro.sql;
+    IF v_registro.parametro_sql IS NOT NULL THEN
+        EXECUTE format(
+            'SELECT array_agg(quote_nullable(e.valor) ORDER BY e.n)
+             FROM (%s) q, json_each_text(row_to_json(q)) WITH ORDINALITY AS e(columna, valor, n)',
+            v_registro.parametro_sql) INTO v_parametros;
+        -- si no devuelve filas (base vacia) todos los parametros van en NULL
+        v_parametros := COALESCE(v_parametros,
+            array_fill('NULL'::TEXT, ARRAY[(length(v_sql) - length(replace(v_sql, '%s', ''))) / 2]));
+        v_sql := format(v_sql, VARIADIC v_parametros);
+    END IF;
+
+    FOR i IN 1..GREATEST(p_repeticiones, 1) LOOP
+        EXECUTE 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' || v_sql INTO v_explain;
+        IF v_plan IS NULL OR (v_explain->0->>'Execution Time')::NUMERIC < (v_plan->>'Execution Time')::NUMERIC THEN
+            v_plan := v_explain->0;
+        END IF;
+    END LOOP;
+
+    -- cada tabla del plan (cualquier nivel) con cuantos nodos de cada tipo la leen y sus filas;
+    -- las particiones se juntan bajo su tabla (precio_productor, log_auditoria)
+    WITH nodos AS (
+        SELECT COALESCE(pg_partition_root(c.oid), c.oid)::regclass::TEXT AS relacion,
+               c.oid, GREATEST(c.reltuples, 0) AS filas, n->>'Node Type' AS nodo
+        FROM jsonb_path_query(v_plan, 'strict $.**') AS n
+        JOIN pg_class c ON c.oid = to_regclass(n->>'Relation Name')
+        WHERE jsonb_typeof(n) = 'object' AND n ? 'Relation Name'
+    )
+    SELECT jsonb_object_agg(a.relacion, a.nodos), jsonb_object_agg(a.relacion, f.filas)
+    INTO v_accesos, v_filas_tablas
+    FROM (
+        SELECT relacion, jsonb_object_agg(nodo, n) AS nodos
+        FROM (SELECT relacion, nodo, count(*) AS n FROM nodos GROUP BY relacion, nodo) c
+        GROUP BY relacion
+    ) a
+    JOIN (
+        SELECT relacion, sum(filas)::BIGINT AS filas
+        FROM (SELECT DISTINCT relacion, oid, filas FROM nodos) d
+        GROUP BY relacion
+    ) f USING (relacion);
+
+    SELECT * INTO v_anterior
+    FROM captura_plan
+    WHERE consulta = p_consulta
+    ORDER BY fecha DESC, id DESC
+    LIMIT 1;
+
+    IF FOUND THEN
+        FOR v_relacion IN SELECT jsonb_object_keys(COALESCE(v_accesos, '{}')) LOOP
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq, v_indice
+            FROM jsonb_each_text(v_accesos->v_relacion) AS e(nodo, n);
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq_antes, v_indice_antes
+            FROM jsonb_each_text(COALESCE(v_anterior.accesos->v_relacion, '{}')) AS e(nodo, n);
+
+            IF v_seq > v_seq_antes AND v_indice < v_indice_antes THEN
+                v_regresiones := v_regresiones || format('Seq Scan en %s en lugar de indice (%s -> %s lecturas con indice)',
+                    v_relacion, v_indice_antes, v_indice);
+            END IF;
+        END LOOP;
+
+        IF (v_plan->>'Execution Time')::NUMERIC >= p_ms_minimo
+           AND (v_plan->>'Execution Time')::NUMERIC >= p_factor_lento * v_anterior.ejecucion_ms THEN
+            v_regresiones := v_regresiones || format('%sx mas lenta (%s ms, antes %s ms)',
+                round((v_plan->>'Execution Time')::NUMERIC / NULLIF(v_anterior.ejecucion_ms, 0), 1),
+                round((v_plan->>'Execution Time')::NUMERIC, 3), round(v_anterior.ejecucion_ms, 3));
+        END IF;
+    END IF;
+
+    INSERT INTO captura_plan(consulta, plan, ejecucion_ms, planificacion_ms, filas_resultado,
+                             filas_tablas, accesos, regresiones)
+    VALUES (
+        p_consulta,
+        v_plan,
+        (v_plan->>'Execution Time')::NUMERIC,
+        (v_plan->>'Planning Time')::NUMERIC,
+        (v_plan->'Plan'->>'Actual Rows')::BIGINT,
+        v_filas_tablas,
+        v_accesos,
+        v_regresiones
+    )
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO consulta_monitoreada(nombre, sql, parametro_sql) VALUES
+    ('obtener_productos',
+     'SELECT * FROM obtener_productos()',
+     NULL),
+    ('obtener_version_catalogo',
+     'SELECT obtener_version_catalogo()',
+     NULL),
+    ('obtener_version_datos',
+     'SELECT obtener_version_datos()',
+     NULL),
+    ('obtener_precios_historicos_completos',
+     'SELECT * FROM obtener_precios_historicos_completos(%s)',
+     -- el producto con mas filas
+     'SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 1'),
+    ('obtener_precios_historicos_productos',
+     'SELECT * FROM obtener_precios_historicos_productos(%s::int[])',
+     -- los 20 productos con mas filas
+     'SELECT array_agg(producto_id)::TEXT FROM (
+          SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t'),
+    ('obtener_precios_historicos_productos_anio',
+     -- el filtro por año de analisis.py, con el ultimo año completo
+     'SELECT * FROM obtener_precios_historicos_productos(%s::int[], %s::date, %s::date)',
+     'SELECT (SELECT array_agg(producto_id)::TEXT FROM (
+                  SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t) AS ids,
+             make_date(extract(year FROM now())::INT - 1, 1, 1) AS desde,
+             make_date(extract(year FROM now())::INT - 1, 12, 1) AS hasta'),
+    ('obtener_anios_productos',
+     'SELECT * FROM obtener_anios_productos(%s::int[])',
+     'SELECT array_agg(producto_id)::TEXT FROM (
+          SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t'),
+    ('obtener_promedio_usd_por_anio',
+     'SELECT * FROM obtener_promedio_usd_por_anio()',
+     NULL),
+    ('obtener_variacion_maxima_usd',
+     'SELECT * FROM obtener_variacion_maxima_usd()',
+     NULL),
+    ('obtener_logs_auditoria',
+     -- los 500 de logs.py
+     'SELECT * FROM obtener_logs_auditoria(%s)',
+     'SELECT 500')
+ON CONFLICT (nombre) DO UPDATE
+SET sql = EXCLUDED.sql,
+    parametro_sql = EXCLUDED.parametro_sql;
+
@@ -0,0 +1,26 @@
+-- =============================================
+-- MIGRACION 016: huellas por (producto, año) para la carga incremental
+-- incremental.py deja de bajar todas las filas de precio_productor: compara una huella
+-- por grupo calculada en la base. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION obtener_huellas_precios(p_anios INT[] DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(h.producto_id || ':' || h.anio, h.huella), '{}'::JSONB)
+    FROM (
+        SELECT l.producto_id, l.anio, md5(string_agg(l.linea, ';' ORDER BY l.linea COLLATE "C")) AS huella
+        FROM (
+            SELECT pp.producto_id, pp.anio,
+                   -- format deja '' en los NULL (concat_ws los saltearia)
+                   format('%s|%s|%s', mes_a_numero(pp.mes), round(pp.ponderado_usd, 2),
+                          round(pp.ponderado_usd_kg, 2)) AS linea
+            FROM precio_productor pp
+            WHERE pp.producto_id IS NOT NULL
+              AND (p_anios IS NULL OR pp.anio = ANY(p_anios))
+        ) l
+        GROUP BY l.producto_id, l.anio
+    ) h;
+$$;
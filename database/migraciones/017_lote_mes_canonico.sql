@@ -0,0 +1,176 @@
+-- =============================================
+-- MIGRACION 017: mes canonico en insertar_precios_productor_lote
+-- El lote guarda el mes con nombre_mes(mes_a_numero(mes)): 'enero' y 'Enero' ya no son
+-- dos filas distintas. La clave repetida en el lote se busca solo entre los elementos
+-- validos. Requiere la migracion 014. Se puede ejecutar mas de una vez.
+-- =============================================
+
+-- ---------------------------------------------
+-- Funcion: nombre del mes como se guarda en precio_productor (9 -> 'Septiembre')
+-- nombre_mes(mes_a_numero(x)) lleva 'enero', ' ENERO' o 'Setiembre' al mismo texto,
+-- que es parte de la clave unica (anio, mes, producto_id)
+-- ---------------------------------------------
+CREATE OR REPLACE FUNCTION nombre_mes(p_numero INT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT (ARRAY['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+                  'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'])[p_numero];
+$$;
+
+
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- particiones de los años del lote, antes de bloquear o escribir filas
+    PERFORM crear_particiones_anios(ARRAY(
+        SELECT (e->>'anio')::NUMERIC::INT
+        FROM jsonb_array_elements(p_precios) e
+        WHERE jsonb_typeof(e->'anio') = 'number'
+    ));
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN precio_productor pp
+      ON pp.producto_id = COALESCE(
+             CASE WHEN jsonb_typeof(e->'producto_id') = 'number' THEN (e->>'producto_id')::NUMERIC::INT END,
+             (SELECT p.id FROM producto p WHERE p.nombre = e->>'nombre_producto'))
+     AND pp.mes = nombre_mes(mes_a_numero(e->>'mes'))
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes_pedido,
+            nombre_mes(mes_a_numero(e.valor->>'mes')) AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            CASE WHEN jsonb_typeof(e.valor->'producto_id') = 'number'
+                 THEN (e.valor->>'producto_id')::NUMERIC::INT END AS producto_id_pedido,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    revisados AS (
+        SELECT
+            en.indice, en.anio, en.mes_pedido, en.mes, en.precios_ok, en.usuario, en.valor,
+            COALESCE(en.nombre_producto, p.nombre) AS nombre_producto,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN en.mes IS NULL THEN format('mes invalido: %s', en.mes_pedido)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto',
+                                              COALESCE(en.nombre_producto, en.producto_id_pedido::TEXT))
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+            END AS error
+        FROM entrada en
+        -- por id si vino, si no por nombre
+        LEFT JOIN producto pn ON en.producto_id_pedido IS NULL AND pn.nombre = en.nombre_producto
+        LEFT JOIN producto p ON p.id = COALESCE(en.producto_id_pedido, pn.id)
+    ),
+    validados AS (
+        SELECT
+            r.indice, r.anio, r.mes_pedido, r.mes, r.usuario, r.valor, r.nombre_producto, r.producto_id,
+            CASE
+                WHEN r.error IS NOT NULL THEN r.error
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica el ultimo
+                -- elemento valido de cada clave (uno con error no le gana a uno anterior)
+                WHEN r.indice < MAX(r.indice) FILTER (WHERE r.error IS NULL)
+                                 OVER (PARTITION BY r.anio, r.mes, r.producto_id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM revisados r
+    ),
+    validos AS MATERIALIZED (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.id_nuevo, v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.anio, pp.mes, pp.producto_id
+    ),
+    escritas AS (
+        SELECT u.anio, u.mes, u.producto_id, (u.id = v.id_nuevo) AS insertado
+        FROM upsert u
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN escritas u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        COALESCE(v.mes, v.mes_pedido),
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN escritas u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
+
@@ -0,0 +1,53 @@
+-- =============================================
+-- MIGRACION 018: limites de periodo opcionales en los historicos
+-- Cada limite (p_desde / p_hasta) se aplica solo si viene: con los dos en NULL el
+-- BETWEEN '-infinity' AND 'infinity' dejaba afuera las filas con periodo NULL.
+-- Requiere la migracion 015. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_completos(
+    prod_id INT,
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(anio INT, mes TEXT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = prod_id
+      -- cada limite solo si viene (sin limites tambien salen las filas con periodo NULL)
+      AND (p_desde IS NULL OR pp.periodo >= date_trunc('month', p_desde::TIMESTAMP)::DATE)
+      AND (p_hasta IS NULL OR pp.periodo <= date_trunc('month', p_hasta::TIMESTAMP)::DATE)
+      -- el mismo rango en anio, para que solo se lean las particiones de esos años
+      AND (p_desde IS NULL OR pp.anio >= extract(year FROM p_desde)::INT)
+      AND (p_hasta IS NULL OR pp.anio <= extract(year FROM p_hasta)::INT)
+    ORDER BY pp.periodo;
+$$;
+
+
+
+-- historico de varios productos en una sola llamada (el comparador de analisis.py).
+-- Sin el nombre ni el mes en texto: el cliente ya tiene el catalogo y el mes sale de periodo.
+-- p_desde / p_hasta: meses del rango (inclusive); NULL = sin limite. Un año es
+-- p_desde = 'AAAA-01-01', p_hasta = 'AAAA-12-01'.
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_productos(
+    prod_ids INT[],
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(producto_id INT, anio INT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = ANY(prod_ids)
+      AND (p_desde IS NULL OR pp.periodo >= date_trunc('month', p_desde::TIMESTAMP)::DATE)
+      AND (p_hasta IS NULL OR pp.periodo <= date_trunc('month', p_hasta::TIMESTAMP)::DATE)
+      AND (p_desde IS NULL OR pp.anio >= extract(year FROM p_desde)::INT)
+      AND (p_hasta IS NULL OR pp.anio <= extract(year FROM p_hasta)::INT)
+    ORDER BY pp.producto_id, pp.periodo;
+$$;
+
@@ -0,0 +1,56 @@
+-- =============================================
+-- MIGRACION 019: obtener_logs_auditoria sin volcar la auditoria pendiente
+-- Leer el log ya no llama a volcar_auditoria_pendiente() (que toma un advisory lock y
+-- escribe en log_auditoria en cada lectura): devuelve log_auditoria UNION ALL
+-- log_auditoria_pendiente y el volcado queda para el job de pg_cron.
+-- Requiere la migracion 006. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION obtener_logs_auditoria(p_n_registros INT)
+RETURNS TABLE(
+    id BIGINT,
+    fecha TIMESTAMP,
+    usuario_simulado TEXT,
+    tabla_afectada TEXT,
+    operacion TEXT,
+    datos_antes JSONB,
+    datos_despues JSONB
+) AS $$
+DECLARE
+    v_ventana INTERVAL := INTERVAL '1 hour';
+    v_desde TIMESTAMP;
+    v_filas BIGINT;
+BEGIN
+    -- la ventana se cuenta solo en log_auditoria: si ahi ya hay p_n_registros filas, lo
+    -- pendiente que quede fuera de la ventana es mas viejo que todas ellas
+    LOOP
+        v_desde := now() - v_ventana;
+        SELECT count(*) INTO v_filas
+        FROM (SELECT 1 FROM log_auditoria l WHERE l.fecha >= v_desde LIMIT p_n_registros) x;
+        EXIT WHEN v_filas >= p_n_registros;
+        IF v_ventana > INTERVAL '50 years' THEN
+            v_desde := '-infinity';  -- no hay tantas filas: se devuelve todo
+            EXIT;
+        END IF;
+        v_ventana := v_ventana * 8;
+    END LOOP;
+
+    RETURN QUERY
+    SELECT t.id, t.fecha, t.usuario_simulado, t.tabla_afectada, t.operacion, t.datos_antes, t.datos_despues
+    FROM (
+        SELECT l.id, l.fecha, l.usuario_simulado, l.tabla_afectada, l.operacion,
+               l.datos_antes, l.datos_despues, 0 AS origen, l.id AS orden
+        FROM log_auditoria l
+        WHERE l.fecha >= v_desde
+        UNION ALL
+        SELECT NULL::BIGINT, p.fecha, p.usuario_simulado, p.tabla_afectada, p.operacion,
+               p.datos_antes, p.datos_despues, 1, p.id
+        FROM log_auditoria_pendiente p
+        WHERE p.fecha >= v_desde
+    ) t
+    -- a igual fecha, lo pendiente es posterior a lo ya volcado
+    ORDER BY t.fecha DESC, t.origen DESC, t.orden DESC
+    LIMIT p_n_registros;
+END;
+$$ LANGUAGE plpgsql;
+
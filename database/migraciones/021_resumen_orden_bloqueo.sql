@@ -0,0 +1,104 @@
+-- =============================================
+-- MIGRACION 021: orden fijo de bloqueo en las tablas de resumen
+-- Cada escritura en precio_productor actualiza, en el mismo COMMIT, la fila de
+-- resumen_precio_anual de su (producto, año) y la de resumen_precio_producto de su
+-- producto: todos los escritores de un producto quedan serializados en esa fila caliente
+-- (eso no cambia). Lo que se corrige es el deadlock entre lotes concurrentes de varias
+-- filas (los 4 lotes REST en paralelo, insertar_precios_productor_lote), que tomaban esas
+-- filas en el orden del hash aggregate: ahora se bloquean en orden de (producto_id, anio)
+-- y de producto_id.
+-- Requiere la migracion 002. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION recalcular_resumen_producto(p_producto_ids INT[])
+RETURNS VOID AS $$
+BEGIN
+    -- bloqueo en orden de producto_id, igual que trigger_resumen_precio
+    PERFORM 1 FROM resumen_precio_producto
+    WHERE producto_id = ANY(p_producto_ids)
+    ORDER BY producto_id
+    FOR UPDATE;
+
+    DELETE FROM resumen_precio_producto WHERE producto_id = ANY(p_producto_ids);
+
+    INSERT INTO resumen_precio_producto(producto_id, min_usd, max_usd)
+    SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+    FROM precio_productor
+    WHERE producto_id = ANY(p_producto_ids)
+    GROUP BY producto_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION trigger_resumen_precio()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_recalcular INT[];
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- el UPDATE ... FROM no sigue un orden fijo: primero se bloquea en orden
+        PERFORM 1 FROM resumen_precio_anual r
+        WHERE (r.producto_id, r.anio) IN (SELECT producto_id, anio FROM viejas)
+        ORDER BY r.producto_id, r.anio
+        FOR UPDATE;
+
+        -- restar las filas viejas
+        UPDATE resumen_precio_anual r
+        SET suma_usd = r.suma_usd - d.suma_usd,
+            filas_usd = r.filas_usd - d.filas_usd,
+            filas = r.filas - d.filas
+        FROM (
+            SELECT producto_id, anio,
+                   COALESCE(SUM(ponderado_usd), 0) AS suma_usd,
+                   COUNT(ponderado_usd) AS filas_usd,
+                   COUNT(*) AS filas
+            FROM viejas
+            WHERE producto_id IS NOT NULL
+            GROUP BY producto_id, anio
+            ORDER BY producto_id, anio
+        ) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio;
+
+        DELETE FROM resumen_precio_anual r
+        USING (SELECT DISTINCT producto_id, anio FROM viejas) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio AND r.filas <= 0;
+
+        -- si salio el valor que era el minimo o el maximo, ese producto se recalcula
+        SELECT array_agg(DISTINCT v.producto_id) INTO v_recalcular
+        FROM viejas v
+        JOIN resumen_precio_producto r ON r.producto_id = v.producto_id
+        WHERE v.ponderado_usd <= r.min_usd OR v.ponderado_usd >= r.max_usd;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- sumar las filas nuevas
+        INSERT INTO resumen_precio_anual AS r (producto_id, anio, suma_usd, filas_usd, filas)
+        SELECT producto_id, anio, COALESCE(SUM(ponderado_usd), 0), COUNT(ponderado_usd), COUNT(*)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id, anio
+        -- ON CONFLICT bloquea las filas en el orden en que llegan
+        ORDER BY producto_id, anio
+        ON CONFLICT (producto_id, anio) DO UPDATE
+        SET suma_usd = r.suma_usd + EXCLUDED.suma_usd,
+            filas_usd = r.filas_usd + EXCLUDED.filas_usd,
+            filas = r.filas + EXCLUDED.filas;
+
+        INSERT INTO resumen_precio_producto AS r (producto_id, min_usd, max_usd)
+        SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id
+        ORDER BY producto_id
+        ON CONFLICT (producto_id) DO UPDATE
+        SET min_usd = LEAST(r.min_usd, EXCLUDED.min_usd),
+            max_usd = GREATEST(r.max_usd, EXCLUDED.max_usd);
+    END IF;
+
+    IF v_recalcular IS NOT NULL THEN
+        PERFORM recalcular_resumen_producto(v_recalcular);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
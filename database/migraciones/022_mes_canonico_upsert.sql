@@ -0,0 +1,167 @@
+-- =============================================
+-- MIGRACION 022: mes canonico en insertar_precio_productor y upsert_precio_productor
+-- Igual que el lote (migracion 017), guardan nombre_mes(mes_a_numero(p_mes)): un upsert
+-- de 'enero' choca con la fila 'Enero' en el ON CONFLICT en vez de crear otra, y un mes
+-- que no se reconoce ('1', 'foo') es un error en vez de una fila con periodo NULL.
+-- Requiere las migraciones 014 y 017. Se puede ejecutar mas de una vez.
+-- =============================================
+
+CREATE OR REPLACE FUNCTION insertar_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_producto_id INT := p_producto_id;
+    -- nombre canonico del mes ('enero' -> 'Enero'), igual que insertar_precios_productor_lote
+    v_mes TEXT := nombre_mes(mes_a_numero(p_mes));
+    precio_existente RECORD;
+BEGIN
+    IF v_mes IS NULL THEN
+        RAISE EXCEPTION 'mes invalido: %', p_mes;
+    END IF;
+
+    PERFORM crear_particion_precio_productor(p_anio);
+
+    -- Obtener ID del producto
+    IF v_producto_id IS NULL THEN
+        SELECT id INTO v_producto_id
+        FROM producto
+        WHERE nombre = p_nombre_producto;
+    END IF;
+
+    IF v_producto_id IS NULL THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
+    END IF;
+
+    -- Buscar si ya existe registro del precio, bloqueando la fila si existe
+    SELECT * INTO precio_existente
+    FROM precio_productor
+    WHERE anio = p_anio
+      AND mes = v_mes
+      AND producto_id = v_producto_id
+    FOR UPDATE;  -- ⛔️ Bloquea la fila si existe
+
+    IF NOT FOUND THEN
+        -- Si no existe, insertar
+        INSERT INTO precio_productor(anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        VALUES (p_anio, v_mes, v_producto_id, p_ponderado_usd, p_ponderado_usd_kg);
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'INSERT',
+            p_usuario_simulado,
+            NULL,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', v_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    ELSE
+        -- Si ya existe, actualizar (con la fila bloqueada previamente)
+        UPDATE precio_productor
+        SET
+            ponderado_usd = p_ponderado_usd,
+            ponderado_usd_kg = p_ponderado_usd_kg
+        WHERE id = precio_existente.id;
+
+        PERFORM registrar_auditoria(
+            'precio_productor',
+            'UPDATE',
+            p_usuario_simulado,
+            to_jsonb(precio_existente),
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', v_mes,
+                'producto_id', v_producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+    -- nombre canonico del mes ('enero' -> 'Enero'): es parte de la clave del ON CONFLICT
+    v_mes TEXT := nombre_mes(mes_a_numero(p_mes));
+BEGIN
+    IF v_mes IS NULL THEN
+        RAISE EXCEPTION 'mes invalido: %', p_mes;
+    END IF;
+
+    PERFORM crear_particion_precio_productor(p_anio);
+
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = v_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM producto p
+        WHERE p.id = COALESCE(p_producto_id, (SELECT id FROM producto WHERE nombre = p_nombre_producto))
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT a.id_nuevo, p_anio, v_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.producto_id
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.id = a.id_nuevo THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', v_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', COALESCE(p_nombre_producto, p_producto_id::TEXT);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
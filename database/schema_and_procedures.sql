@@ -21,21 +21,248 @@ CREATE TABLE IF NOT EXISTS producto (
 
 CREATE INDEX idx_producto_nombre ON producto(nombre);
 
+-- ---------------------------------------------
+-- Tabla: catalogo_version
+-- Una sola fila con un contador que sube cada vez que cambia producto (ver
+-- trigger_catalogo_version). Los clientes guardan el catalogo en cache y solo
+-- lo vuelven a pedir cuando cambia este numero.
+-- ---------------------------------------------
+CREATE TABLE IF NOT EXISTS catalogo_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalogo_version(id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- ---------------------------------------------
+-- Funcion: numero de mes a partir del nombre ('Enero' -> 1)
+-- IMMUTABLE para poder usarla en la columna generada periodo
+-- ---------------------------------------------
+CREATE OR REPLACE FUNCTION mes_a_numero(p_mes TEXT)
+RETURNS INT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE lower(trim(p_mes))
+        WHEN 'enero' THEN 1
+        WHEN 'febrero' THEN 2
+        WHEN 'marzo' THEN 3
+        WHEN 'abril' THEN 4
+        WHEN 'mayo' THEN 5
+        WHEN 'junio' THEN 6
+        WHEN 'julio' THEN 7
+        WHEN 'agosto' THEN 8
+        WHEN 'septiembre' THEN 9
+        WHEN 'setiembre' THEN 9
+        WHEN 'octubre' THEN 10
+        WHEN 'noviembre' THEN 11
+        WHEN 'diciembre' THEN 12
+    END;
+$$;
+
+-- ---------------------------------------------
+-- Funcion: nombre del mes como se guarda en precio_productor (9 -> 'Septiembre')
+-- nombre_mes(mes_a_numero(x)) lleva 'enero', ' ENERO' o 'Setiembre' al mismo texto,
+-- que es parte de la clave unica (anio, mes, producto_id)
+-- ---------------------------------------------
+CREATE OR REPLACE FUNCTION nombre_mes(p_numero INT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT (ARRAY['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+                  'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'])[p_numero];
+$$;
+
 -- ---------------------------------------------
 -- Tabla: precio_productor
+-- periodo = primer dia del mes, se calcula solo a partir de anio y mes
+-- (lo mantienen insertar_precio_productor, el cargador y cualquier otro INSERT/UPDATE)
+-- Particionada por año (anio): las consultas con filtro de año solo leen esas
+-- particiones. Las particiones precio_productor_pAAAA las crean las funciones de
+-- escritura (insertar/upsert/lote) y los cargadores antes de escribir, con
+-- crear_particion_precio_productor(); lo que igual caiga en precio_productor_default
+-- se mueve a su particion con crear_particiones_precio_productor().
 -- ---------------------------------------------
 CREATE TABLE IF NOT EXISTS precio_productor (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     anio INT NOT NULL,
     mes TEXT NOT NULL,
     producto_id INT REFERENCES producto(id),
     ponderado_usd NUMERIC,
     ponderado_usd_kg NUMERIC,
+    periodo DATE GENERATED ALWAYS AS (make_date(anio, mes_a_numero(mes), 1)) STORED,
+    -- en una tabla particionada las claves unicas deben incluir anio
+    PRIMARY KEY (id, anio),
     UNIQUE(anio, mes, producto_id)
-);
+) PARTITION BY RANGE (anio);
+
+CREATE TABLE IF NOT EXISTS precio_productor_default PARTITION OF precio_productor DEFAULT;
 
 CREATE INDEX idx_precio_productor_producto_id ON precio_productor(producto_id);
 CREATE INDEX idx_precio_anio_mes_producto ON precio_productor(anio, mes, producto_id);
+-- consultas por producto y rango de fechas (historicos) como index range scan, sin ordenar
+CREATE INDEX idx_precio_producto_periodo ON precio_productor(producto_id, periodo)
+    INCLUDE (ponderado_usd, ponderado_usd_kg);
+
+-- =============================================
+-- FUNCION: crear la particion de precio_productor del año p_anio
+-- Si precio_productor_default ya tiene filas de ese año, se pasan a la particion nueva
+-- (sin auditoria: las filas no cambian, solo de lugar). Devuelve el nombre de la
+-- particion, o NULL si ya existia.
+-- La llaman las funciones de escritura en cada llamada: si la particion existe solo
+-- cuesta un to_regclass. SECURITY DEFINER porque ATTACH PARTITION requiere ser dueño
+-- de precio_productor y las RPC corren con el rol de la API.
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particion_precio_productor(p_anio INT)
+RETURNS TEXT
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_nombre TEXT := 'precio_productor_p' || p_anio;
+BEGIN
+    IF p_anio IS NULL OR to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- dos sesiones que escriben el mismo año nuevo a la vez: la segunda espera aca
+    -- (el ATTACH igual necesita este bloqueo) y despues ya ve la particion creada
+    LOCK TABLE precio_productor_default IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE precio_productor INCLUDING DEFAULTS INCLUDING GENERATED)', v_nombre);
+    PERFORM set_config('app.moviendo_particion', 'on', true);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM precio_productor_default WHERE anio = %s RETURNING *)
+         INSERT INTO %I (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+         SELECT id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg FROM movidas',
+        p_anio, v_nombre
+    );
+    PERFORM set_config('app.moviendo_particion', 'off', true);
+    EXECUTE format(
+        'ALTER TABLE precio_productor ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+        v_nombre, p_anio, p_anio + 1
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones del año actual y de los proximos p_anios_adelante,
+-- y las de los años que hayan quedado en precio_productor_default
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_precio_productor(p_anios_adelante INT DEFAULT 1)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_anio INT;
+    v_nombre TEXT;
+BEGIN
+    FOR v_anio IN
+        SELECT DISTINCT anio FROM precio_productor_default
+        UNION
+        SELECT extract(year FROM now())::INT + i FROM generate_series(0, p_anios_adelante) AS i
+        ORDER BY 1
+    LOOP
+        v_nombre := crear_particion_precio_productor(v_anio);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones de los años p_anios (los cargadores la llaman con
+-- los años del archivo antes de escribir, asi nada cae en precio_productor_default)
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_anios(p_anios INT[])
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_anio INT;
+    v_nombre TEXT;
+BEGIN
+    FOR v_anio IN SELECT DISTINCT a FROM unnest(p_anios) AS a WHERE a IS NOT NULL ORDER BY 1 LOOP
+        v_nombre := crear_particion_precio_productor(v_anio);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_precio_productor();
+
+-- =============================================
+-- FUNCION: mantenimiento de precio_productor
+-- Crea las particiones que faltan y, si se indica p_tablespace (un tablespace en disco
+-- mas barato), mueve ahi las particiones de años anteriores a los ultimos
+-- p_anios_recientes, con sus indices. Los datos siguen en la tabla: solo cambia donde
+-- se guardan. Pensada para correr una vez por mes, por ejemplo con pg_cron:
+--   SELECT cron.schedule('mantener-precio-productor', '0 4 1 * *', 'SELECT * FROM mantener_precio_productor()');
+-- =============================================
+CREATE OR REPLACE FUNCTION mantener_precio_productor(
+    p_anios_recientes INT DEFAULT 3,
+    p_tablespace TEXT DEFAULT NULL
+)
+RETURNS TABLE(particion TEXT, accion TEXT) AS $$
+DECLARE
+    v_limite INT := extract(year FROM now())::INT - p_anios_recientes + 1;
+    v_nombre TEXT;
+    v_indice TEXT;
+BEGIN
+    FOR v_nombre IN SELECT * FROM crear_particiones_precio_productor() LOOP
+        RETURN QUERY SELECT v_nombre, 'creada'::TEXT;
+    END LOOP;
+
+    IF p_tablespace IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR v_nombre IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace
+        WHERE i.inhparent = 'precio_productor'::regclass
+          AND c.relname ~ '^precio_productor_p[0-9]{4}$'
+          AND substr(c.relname, 19)::INT < v_limite
+          AND t.spcname IS DISTINCT FROM p_tablespace
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE %I SET TABLESPACE %I', v_nombre, p_tablespace);
+        FOR v_indice IN
+            SELECT indexrelid::regclass::TEXT FROM pg_index WHERE indrelid = v_nombre::regclass
+        LOOP
+            EXECUTE format('ALTER INDEX %s SET TABLESPACE %I', v_indice, p_tablespace);
+        END LOOP;
+        RETURN QUERY SELECT v_nombre, ('movida a ' || p_tablespace)::TEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ---------------------------------------------
+-- Tablas de resumen (agregados) de precio_productor
+-- Las mantienen los triggers trg_resumen_precio_* (ver abajo), asi que estan al dia
+-- con insertar_precio_productor, el cargador y cualquier otro INSERT/UPDATE/DELETE.
+-- ---------------------------------------------
+CREATE TABLE IF NOT EXISTS resumen_precio_anual (
+    producto_id INT NOT NULL REFERENCES producto(id) ON DELETE CASCADE,
+    anio INT NOT NULL,
+    suma_usd NUMERIC NOT NULL DEFAULT 0,
+    filas_usd BIGINT NOT NULL DEFAULT 0,   -- filas con ponderado_usd no nulo
+    filas BIGINT NOT NULL DEFAULT 0,       -- todas las filas del producto en el año
+    promedio_usd NUMERIC GENERATED ALWAYS AS (suma_usd / NULLIF(filas_usd, 0)) STORED,
+    PRIMARY KEY (producto_id, anio)
+);
+
+CREATE TABLE IF NOT EXISTS resumen_precio_producto (
+    producto_id INT PRIMARY KEY REFERENCES producto(id) ON DELETE CASCADE,
+    min_usd NUMERIC,
+    max_usd NUMERIC
+);
 
 
 
@@ -44,13 +271,44 @@ CREATE INDEX idx_precio_anio_mes_producto ON precio_productor(anio, mes, product
 
 -- ---------------------------------------------
 -- Tabla: log_auditoria
+-- Particionada por mes (fecha). Las particiones log_auditoria_pAAAAMM las crea
+-- crear_particiones_log_auditoria(); lo que no tenga particion cae en
+-- log_auditoria_default y se mueve a la suya en la siguiente corrida.
 -- ---------------------------------------------
 CREATE TABLE IF NOT EXISTS log_auditoria (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     tabla_afectada TEXT NOT NULL,
     operacion TEXT NOT NULL,
     usuario_simulado TEXT,
-    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    datos_antes JSONB,
+    datos_despues JSONB,
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
+
+CREATE TABLE IF NOT EXISTS log_auditoria_default PARTITION OF log_auditoria DEFAULT;
+
+-- el log solo crece y se escribe en orden de fecha: BRIN ocupa muy poco y sirve para rangos
+CREATE INDEX idx_log_auditoria_fecha ON log_auditoria USING BRIN (fecha)
+    WITH (pages_per_range = 32, autosummarize = on);
+CREATE INDEX idx_log_auditoria_tabla_fecha ON log_auditoria(tabla_afectada, fecha);
+
+-- las particiones viejas se mueven aqui (ver mantener_log_auditoria)
+CREATE SCHEMA IF NOT EXISTS auditoria_archivo;
+
+-- ---------------------------------------------
+-- Tabla: log_auditoria_pendiente
+-- Eventos de auditoria en modo diferido (app.auditoria_diferida = 'on'), antes de
+-- pasar a log_auditoria con volcar_auditoria_pendiente(). UNLOGGED y sin indices para
+-- que escribir aqui sea barato; a cambio, si el servidor se cae se pierde lo que
+-- todavia no se volco.
+-- ---------------------------------------------
+CREATE UNLOGGED TABLE IF NOT EXISTS log_auditoria_pendiente (
+    id BIGSERIAL,   -- orden de llegada de los eventos
+    tabla_afectada TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    usuario_simulado TEXT,
+    fecha TIMESTAMP NOT NULL,
     datos_antes JSONB,
     datos_despues JSONB
 );
@@ -73,6 +331,219 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- =============================================
+-- FUNCION: crear la particion mensual de log_auditoria que contiene p_mes
+-- Si log_auditoria_default ya tiene filas de ese mes, se pasan a la particion nueva.
+-- Devuelve el nombre de la particion, o NULL si ya existia.
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particion_log_auditoria(p_mes DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_desde DATE := date_trunc('month', p_mes)::DATE;
+    v_hasta DATE := (date_trunc('month', p_mes) + INTERVAL '1 month')::DATE;
+    v_nombre TEXT := 'log_auditoria_p' || to_char(p_mes, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE log_auditoria INCLUDING DEFAULTS)', v_nombre);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM log_auditoria_default WHERE fecha >= %L AND fecha < %L RETURNING *)
+         INSERT INTO %I SELECT * FROM movidas',
+        v_desde, v_hasta, v_nombre
+    );
+    EXECUTE format(
+        'ALTER TABLE log_auditoria ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_nombre, v_desde, v_hasta
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: crear las particiones del mes actual y de los proximos p_meses_adelante,
+-- y las de los meses que hayan quedado en log_auditoria_default
+-- =============================================
+CREATE OR REPLACE FUNCTION crear_particiones_log_auditoria(p_meses_adelante INT DEFAULT 3)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_mes DATE;
+    v_nombre TEXT;
+BEGIN
+    FOR v_mes IN
+        SELECT DISTINCT date_trunc('month', fecha)::DATE FROM log_auditoria_default
+        UNION
+        SELECT (date_trunc('month', now()) + make_interval(months => i))::DATE
+        FROM generate_series(0, p_meses_adelante) AS i
+        ORDER BY 1
+    LOOP
+        v_nombre := crear_particion_log_auditoria(v_mes);
+        IF v_nombre IS NOT NULL THEN
+            RETURN NEXT v_nombre;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_log_auditoria();
+
+-- =============================================
+-- FUNCION: mantenimiento de log_auditoria (retencion)
+-- Crea las particiones que faltan y separa las de meses anteriores a p_meses_retencion:
+-- con p_archivar se mueven al schema auditoria_archivo (se pueden exportar y borrar
+-- despues), si no se borran. Pensada para correr una vez por dia o por mes, por ejemplo
+-- con pg_cron:
+--   SELECT cron.schedule('mantener-log-auditoria', '0 3 * * *', 'SELECT * FROM mantener_log_auditoria()');
+-- =============================================
+CREATE OR REPLACE FUNCTION mantener_log_auditoria(
+    p_meses_retencion INT DEFAULT 12,
+    p_archivar BOOLEAN DEFAULT TRUE
+)
+RETURNS TABLE(particion TEXT, accion TEXT) AS $$
+DECLARE
+    v_limite TEXT := to_char(date_trunc('month', now()) - make_interval(months => p_meses_retencion), 'YYYYMM');
+    v_nombre TEXT;
+BEGIN
+    FOR v_nombre IN SELECT * FROM crear_particiones_log_auditoria() LOOP
+        RETURN QUERY SELECT v_nombre, 'creada'::TEXT;
+    END LOOP;
+
+    FOR v_nombre IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'log_auditoria'::regclass
+          AND c.relname ~ '^log_auditoria_p[0-9]{6}$'
+          AND substr(c.relname, 16) < v_limite
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE log_auditoria DETACH PARTITION %I', v_nombre);
+        IF p_archivar THEN
+            EXECUTE format('ALTER TABLE %I SET SCHEMA auditoria_archivo', v_nombre);
+            RETURN QUERY SELECT v_nombre, 'archivada'::TEXT;
+        ELSE
+            EXECUTE format('DROP TABLE %I', v_nombre);
+            RETURN QUERY SELECT v_nombre, 'borrada'::TEXT;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- AUDITORIA DIFERIDA (opcional)
+-- Con app.auditoria_diferida = 'on' cada INSERT en log_auditoria (registrar_auditoria,
+-- el trigger de DELETE, upsert_precio_productor, insertar_precios_productor_lote) se
+-- guarda en log_auditoria_pendiente y se vuelca despues en bloque. Se activa por sesion
+-- (SET app.auditoria_diferida = 'on') o para todos, por ejemplo:
+--   ALTER DATABASE postgres SET app.auditoria_diferida = 'on';
+-- y el volcado se programa con pg_cron:
+--   SELECT cron.schedule('volcar-auditoria', '* * * * *', 'SELECT volcar_auditoria_pendiente()');
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_auditoria_diferida()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.auditoria_diferida', true) = 'on' THEN
+        INSERT INTO log_auditoria_pendiente(tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues)
+        VALUES (NEW.tabla_afectada, NEW.operacion, NEW.usuario_simulado, NEW.fecha, NEW.datos_antes, NEW.datos_despues);
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS auditoria_diferida ON log_auditoria;
+CREATE TRIGGER auditoria_diferida
+BEFORE INSERT ON log_auditoria
+FOR EACH ROW
+EXECUTE FUNCTION trigger_auditoria_diferida();
+
+-- =============================================
+-- FUNCION: pasar los eventos pendientes a log_auditoria en un solo INSERT
+-- Respeta el orden de llegada (id), la fecha original y el usuario de cada evento.
+-- Devuelve cuantos eventos se volcaron.
+-- =============================================
+CREATE OR REPLACE FUNCTION volcar_auditoria_pendiente()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+    v_modo TEXT := current_setting('app.auditoria_diferida', true);
+BEGIN
+    -- un volcado a la vez, para que los id de log_auditoria sigan el orden de los eventos
+    PERFORM pg_advisory_xact_lock(hashtext('volcar_auditoria_pendiente'));
+    -- el INSERT de abajo no debe volver a la tabla pendiente
+    PERFORM set_config('app.auditoria_diferida', 'off', true);
+
+    WITH lote AS (
+        DELETE FROM log_auditoria_pendiente
+        RETURNING *
+    )
+    INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues)
+    SELECT tabla_afectada, operacion, usuario_simulado, fecha, datos_antes, datos_despues
+    FROM lote
+    ORDER BY id;
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    PERFORM set_config('app.auditoria_diferida', COALESCE(v_modo, ''), true);
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: ultimos p_n_registros del log (la usa logs.py)
+-- Busca en una ventana de tiempo que se agranda hasta tener suficientes filas, asi el
+-- indice BRIN de fecha solo lee los bloques recientes en vez de ordenar toda la tabla.
+-- En modo diferido suma los eventos de log_auditoria_pendiente (con id NULL, todavia no
+-- tienen id en log_auditoria) sin volcarlos: leer no escribe, el volcado es de pg_cron.
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_logs_auditoria(p_n_registros INT)
+RETURNS TABLE(
+    id BIGINT,
+    fecha TIMESTAMP,
+    usuario_simulado TEXT,
+    tabla_afectada TEXT,
+    operacion TEXT,
+    datos_antes JSONB,
+    datos_despues JSONB
+) AS $$
+DECLARE
+    v_ventana INTERVAL := INTERVAL '1 hour';
+    v_desde TIMESTAMP;
+    v_filas BIGINT;
+BEGIN
+    -- la ventana se cuenta solo en log_auditoria: si ahi ya hay p_n_registros filas, lo
+    -- pendiente que quede fuera de la ventana es mas viejo que todas ellas
+    LOOP
+        v_desde := now() - v_ventana;
+        SELECT count(*) INTO v_filas
+        FROM (SELECT 1 FROM log_auditoria l WHERE l.fecha >= v_desde LIMIT p_n_registros) x;
+        EXIT WHEN v_filas >= p_n_registros;
+        IF v_ventana > INTERVAL '50 years' THEN
+            v_desde := '-infinity';  -- no hay tantas filas: se devuelve todo
+            EXIT;
+        END IF;
+        v_ventana := v_ventana * 8;
+    END LOOP;
+
+    RETURN QUERY
+    SELECT t.id, t.fecha, t.usuario_simulado, t.tabla_afectada, t.operacion, t.datos_antes, t.datos_despues
+    FROM (
+        SELECT l.id, l.fecha, l.usuario_simulado, l.tabla_afectada, l.operacion,
+               l.datos_antes, l.datos_despues, 0 AS origen, l.id AS orden
+        FROM log_auditoria l
+        WHERE l.fecha >= v_desde
+        UNION ALL
+        SELECT NULL::BIGINT, p.fecha, p.usuario_simulado, p.tabla_afectada, p.operacion,
+               p.datos_antes, p.datos_despues, 1, p.id
+        FROM log_auditoria_pendiente p
+        WHERE p.fecha >= v_desde
+    ) t
+    -- a igual fecha, lo pendiente es posterior a lo ya volcado
+    ORDER BY t.fecha DESC, t.origen DESC, t.orden DESC
+    LIMIT p_n_registros;
+END;
+$$ LANGUAGE plpgsql;
+
 
 
 
@@ -83,15 +554,54 @@ $$ LANGUAGE plpgsql;
 
 CREATE OR REPLACE FUNCTION public.obtener_productos()
  RETURNS TABLE(id integer, nombre text)
- LANGUAGE plpgsql
+ LANGUAGE sql
+ STABLE
 AS $function$
-BEGIN
-    RETURN QUERY
     SELECT p.id, p.nombre
     FROM public.producto p
     ORDER BY p.nombre;
+$function$;
+
+-- =============================================
+-- FUNCION: version actual del catalogo de productos (consulta barata para los clientes)
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_version_catalogo()
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT version FROM catalogo_version WHERE id = 1;
+$$;
+
+-- =============================================
+-- TRIGGER FUNCTION: subir la version del catalogo cuando cambia producto
+-- (insertar_producto, el cargador o cualquier otro cambio). Es por sentencia; en un
+-- INSERT ... ON CONFLICT DO NOTHING que no agrego nada la version no cambia.
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_catalogo_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NOT EXISTS (SELECT 1 FROM nuevos) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
 END;
-$function$
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_catalogo_version_insert
+AFTER INSERT ON producto
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_catalogo_version();
+
+CREATE TRIGGER trg_catalogo_version_cambio
+AFTER UPDATE OR DELETE OR TRUNCATE ON producto
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_catalogo_version();
 
 
 
@@ -168,17 +678,28 @@ CREATE OR REPLACE FUNCTION insertar_precio_productor(
     p_nombre_producto TEXT,
     p_ponderado_usd NUMERIC,
     p_ponderado_usd_kg NUMERIC,
-    p_usuario_simulado TEXT
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
 )
 RETURNS VOID AS $$
 DECLARE
-    v_producto_id INT;
+    v_producto_id INT := p_producto_id;
+    -- nombre canonico del mes ('enero' -> 'Enero'), igual que insertar_precios_productor_lote
+    v_mes TEXT := nombre_mes(mes_a_numero(p_mes));
     precio_existente RECORD;
 BEGIN
+    IF v_mes IS NULL THEN
+        RAISE EXCEPTION 'mes invalido: %', p_mes;
+    END IF;
+
+    PERFORM crear_particion_precio_productor(p_anio);
+
     -- Obtener ID del producto
-    SELECT id INTO v_producto_id
-    FROM producto
-    WHERE nombre = p_nombre_producto;
+    IF v_producto_id IS NULL THEN
+        SELECT id INTO v_producto_id
+        FROM producto
+        WHERE nombre = p_nombre_producto;
+    END IF;
 
     IF v_producto_id IS NULL THEN
         RAISE EXCEPTION 'El producto % no existe en la tabla producto', p_nombre_producto;
@@ -188,14 +709,14 @@ BEGIN
     SELECT * INTO precio_existente
     FROM precio_productor
     WHERE anio = p_anio
-      AND mes = p_mes
+      AND mes = v_mes
       AND producto_id = v_producto_id
     FOR UPDATE;  -- ⛔️ Bloquea la fila si existe
 
     IF NOT FOUND THEN
         -- Si no existe, insertar
         INSERT INTO precio_productor(anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
-        VALUES (p_anio, p_mes, v_producto_id, p_ponderado_usd, p_ponderado_usd_kg);
+        VALUES (p_anio, v_mes, v_producto_id, p_ponderado_usd, p_ponderado_usd_kg);
 
         PERFORM registrar_auditoria(
             'precio_productor',
@@ -204,7 +725,7 @@ BEGIN
             NULL,
             jsonb_build_object(
                 'anio', p_anio,
-                'mes', p_mes,
+                'mes', v_mes,
                 'producto_id', v_producto_id,
                 'ponderado_usd', p_ponderado_usd,
                 'ponderado_usd_kg', p_ponderado_usd_kg
@@ -225,7 +746,7 @@ BEGIN
             to_jsonb(precio_existente),
             jsonb_build_object(
                 'anio', p_anio,
-                'mes', p_mes,
+                'mes', v_mes,
                 'producto_id', v_producto_id,
                 'ponderado_usd', p_ponderado_usd,
                 'ponderado_usd_kg', p_ponderado_usd_kg
@@ -240,6 +761,387 @@ $$ LANGUAGE plpgsql;
 
 
 
+-- =============================================
+-- FUNCION: insertar o actualizar un precio en una sola sentencia
+-- Mismos parametros que insertar_precio_productor, pero sin SELECT ... FOR UPDATE
+-- seguido de INSERT o UPDATE: la busqueda del producto, el bloqueo de la fila,
+-- el INSERT ... ON CONFLICT y la auditoria van en un solo statement.
+-- Si dos sesiones insertan la misma clave nueva a la vez, la segunda espera y
+-- actualiza en lugar de fallar por el UNIQUE.
+-- =============================================
+CREATE OR REPLACE FUNCTION upsert_precio_productor(
+    p_anio INT,
+    p_mes TEXT,
+    p_nombre_producto TEXT,
+    p_ponderado_usd NUMERIC,
+    p_ponderado_usd_kg NUMERIC,
+    p_usuario_simulado TEXT,
+    p_producto_id INT DEFAULT NULL  -- si viene, no se busca el producto por nombre
+)
+RETURNS VOID AS $$
+DECLARE
+    v_filas INT;
+    -- nombre canonico del mes ('enero' -> 'Enero'): es parte de la clave del ON CONFLICT
+    v_mes TEXT := nombre_mes(mes_a_numero(p_mes));
+BEGIN
+    IF v_mes IS NULL THEN
+        RAISE EXCEPTION 'mes invalido: %', p_mes;
+    END IF;
+
+    PERFORM crear_particion_precio_productor(p_anio);
+
+    WITH antes AS MATERIALIZED (
+        -- imagen de la fila antes del cambio (la version mas nueva, bloqueada)
+        SELECT
+            p.id AS producto_id,
+            (SELECT to_jsonb(pp)
+             FROM precio_productor pp
+             WHERE pp.anio = p_anio
+               AND pp.mes = v_mes
+               AND pp.producto_id = p.id
+             FOR UPDATE) AS datos,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM producto p
+        WHERE p.id = COALESCE(p_producto_id, (SELECT id FROM producto WHERE nombre = p_nombre_producto))
+    ),
+    upsert AS (
+        -- se inserta a partir de antes, asi el bloqueo de arriba ocurre primero
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT a.id_nuevo, p_anio, v_mes, a.producto_id, p_ponderado_usd, p_ponderado_usd_kg
+        FROM antes a
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.producto_id
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.id = a.id_nuevo THEN 'INSERT' ELSE 'UPDATE' END,
+            p_usuario_simulado,
+            -- NULL en un UPDATE: otra sesion inserto la clave mientras esta esperaba
+            a.datos,
+            jsonb_build_object(
+                'anio', p_anio,
+                'mes', v_mes,
+                'producto_id', u.producto_id,
+                'ponderado_usd', p_ponderado_usd,
+                'ponderado_usd_kg', p_ponderado_usd_kg
+            )
+        FROM upsert u
+        JOIN antes a USING (producto_id)
+    )
+    -- se cuentan las filas del upsert (en modo diferido el INSERT de auditoria no devuelve filas)
+    SELECT count(*) INTO v_filas FROM upsert;
+
+    IF v_filas = 0 THEN
+        RAISE EXCEPTION 'El producto % no existe en la tabla producto', COALESCE(p_nombre_producto, p_producto_id::TEXT);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- =============================================
+-- FUNCION: insertar/actualizar precios en lote
+-- p_precios es un arreglo JSON de objetos
+--   {"anio": 2024, "mes": "Enero", "nombre_producto": "Aguacate Fuerte",
+--    "ponderado_usd": 10.5, "ponderado_usd_kg": 0.2, "usuario_simulado": "opcional"}
+-- En lugar de nombre_producto se puede mandar "producto_id" (no se busca por nombre).
+-- El mes se guarda con su nombre canonico (nombre_mes), sin importar como venga escrito.
+-- Todo en una transaccion: una sola busqueda de productos, un solo upsert y un solo
+-- INSERT multi-fila en log_auditoria. Devuelve el resultado de cada elemento
+-- ('insertado', 'actualizado' o 'error' con el motivo) en el orden de entrada.
+-- =============================================
+CREATE OR REPLACE FUNCTION insertar_precios_productor_lote(
+    p_precios JSONB,
+    p_usuario_simulado TEXT
+)
+RETURNS TABLE(indice INT, anio INT, mes TEXT, nombre_producto TEXT, resultado TEXT, mensaje TEXT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    IF jsonb_typeof(p_precios) IS DISTINCT FROM 'array' THEN
+        RAISE EXCEPTION 'p_precios debe ser un arreglo JSON';
+    END IF;
+
+    -- particiones de los años del lote, antes de bloquear o escribir filas
+    PERFORM crear_particiones_anios(ARRAY(
+        SELECT (e->>'anio')::NUMERIC::INT
+        FROM jsonb_array_elements(p_precios) e
+        WHERE jsonb_typeof(e->'anio') = 'number'
+    ));
+
+    -- Bloquear las filas que ya existen, en orden de id para no cruzarse con otro lote
+    -- (igual que el FOR UPDATE de insertar_precio_productor)
+    PERFORM 1
+    FROM jsonb_array_elements(p_precios) e
+    JOIN precio_productor pp
+      ON pp.producto_id = COALESCE(
+             CASE WHEN jsonb_typeof(e->'producto_id') = 'number' THEN (e->>'producto_id')::NUMERIC::INT END,
+             (SELECT p.id FROM producto p WHERE p.nombre = e->>'nombre_producto'))
+     AND pp.mes = nombre_mes(mes_a_numero(e->>'mes'))
+     AND pp.anio::TEXT = e->>'anio'
+    ORDER BY pp.id
+    FOR UPDATE OF pp;
+
+    RETURN QUERY
+    WITH entrada AS (
+        SELECT
+            e.n::INT AS indice,
+            CASE WHEN jsonb_typeof(e.valor->'anio') = 'number'
+                 THEN (e.valor->>'anio')::NUMERIC::INT END AS anio,
+            e.valor->>'mes' AS mes_pedido,
+            nombre_mes(mes_a_numero(e.valor->>'mes')) AS mes,
+            e.valor->>'nombre_producto' AS nombre_producto,
+            CASE WHEN jsonb_typeof(e.valor->'producto_id') = 'number'
+                 THEN (e.valor->>'producto_id')::NUMERIC::INT END AS producto_id_pedido,
+            jsonb_typeof(COALESCE(e.valor->'ponderado_usd', 'null')) IN ('number', 'null')
+                AND jsonb_typeof(COALESCE(e.valor->'ponderado_usd_kg', 'null')) IN ('number', 'null') AS precios_ok,
+            COALESCE(NULLIF(trim(e.valor->>'usuario_simulado'), ''), p_usuario_simulado) AS usuario,
+            e.valor
+        FROM jsonb_array_elements(p_precios) WITH ORDINALITY AS e(valor, n)
+    ),
+    revisados AS (
+        SELECT
+            en.indice, en.anio, en.mes_pedido, en.mes, en.precios_ok, en.usuario, en.valor,
+            COALESCE(en.nombre_producto, p.nombre) AS nombre_producto,
+            p.id AS producto_id,
+            CASE
+                WHEN jsonb_typeof(en.valor) IS DISTINCT FROM 'object' THEN 'el elemento no es un objeto JSON'
+                WHEN en.anio IS NULL THEN 'anio invalido'
+                WHEN en.mes IS NULL THEN format('mes invalido: %s', en.mes_pedido)
+                WHEN p.id IS NULL THEN format('El producto %s no existe en la tabla producto',
+                                              COALESCE(en.nombre_producto, en.producto_id_pedido::TEXT))
+                WHEN NOT en.precios_ok THEN 'ponderado_usd y ponderado_usd_kg deben ser numeros o null'
+            END AS error
+        FROM entrada en
+        -- por id si vino, si no por nombre
+        LEFT JOIN producto pn ON en.producto_id_pedido IS NULL AND pn.nombre = en.nombre_producto
+        LEFT JOIN producto p ON p.id = COALESCE(en.producto_id_pedido, pn.id)
+    ),
+    validados AS (
+        SELECT
+            r.indice, r.anio, r.mes_pedido, r.mes, r.usuario, r.valor, r.nombre_producto, r.producto_id,
+            CASE
+                WHEN r.error IS NOT NULL THEN r.error
+                -- ON CONFLICT no puede tocar dos veces la misma fila: se aplica el ultimo
+                -- elemento valido de cada clave (uno con error no le gana a uno anterior)
+                WHEN r.indice < MAX(r.indice) FILTER (WHERE r.error IS NULL)
+                                 OVER (PARTITION BY r.anio, r.mes, r.producto_id)
+                    THEN 'clave repetida en el lote, se aplica el ultimo elemento'
+            END AS error
+        FROM revisados r
+    ),
+    validos AS MATERIALIZED (
+        SELECT
+            v.indice, v.anio, v.mes, v.producto_id, v.usuario,
+            (v.valor->>'ponderado_usd')::NUMERIC AS ponderado_usd,
+            (v.valor->>'ponderado_usd_kg')::NUMERIC AS ponderado_usd_kg,
+            -- id que tendra la fila si se inserta: si RETURNING devuelve otro, fue un UPDATE
+            -- (en una tabla particionada RETURNING no puede leer xmax)
+            nextval('precio_productor_id_seq') AS id_nuevo
+        FROM validados v
+        WHERE v.error IS NULL
+    ),
+    antes AS (
+        -- filas como estaban antes del upsert (ya bloqueadas arriba)
+        SELECT pp.anio, pp.mes, pp.producto_id, to_jsonb(pp) AS datos
+        FROM precio_productor pp
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    usuarios AS (
+        INSERT INTO usuario_simulado(nombre)
+        SELECT DISTINCT v.usuario FROM validos v WHERE v.usuario IS NOT NULL
+        ON CONFLICT (nombre) DO NOTHING
+    ),
+    upsert AS (
+        INSERT INTO precio_productor AS pp (id, anio, mes, producto_id, ponderado_usd, ponderado_usd_kg)
+        SELECT v.id_nuevo, v.anio, v.mes, v.producto_id, v.ponderado_usd, v.ponderado_usd_kg
+        FROM validos v
+        ON CONFLICT (anio, mes, producto_id) DO UPDATE
+        SET ponderado_usd = EXCLUDED.ponderado_usd,
+            ponderado_usd_kg = EXCLUDED.ponderado_usd_kg
+        RETURNING pp.id, pp.anio, pp.mes, pp.producto_id
+    ),
+    escritas AS (
+        SELECT u.anio, u.mes, u.producto_id, (u.id = v.id_nuevo) AS insertado
+        FROM upsert u
+        JOIN validos v USING (anio, mes, producto_id)
+    ),
+    auditoria AS (
+        INSERT INTO log_auditoria(tabla_afectada, operacion, usuario_simulado, datos_antes, datos_despues)
+        SELECT
+            'precio_productor',
+            CASE WHEN u.insertado THEN 'INSERT' ELSE 'UPDATE' END,
+            v.usuario,
+            a.datos,
+            jsonb_build_object(
+                'anio', v.anio,
+                'mes', v.mes,
+                'producto_id', v.producto_id,
+                'ponderado_usd', v.ponderado_usd,
+                'ponderado_usd_kg', v.ponderado_usd_kg
+            )
+        FROM validos v
+        JOIN escritas u USING (anio, mes, producto_id)
+        LEFT JOIN antes a USING (anio, mes, producto_id)
+        ORDER BY v.indice
+    )
+    SELECT
+        v.indice,
+        v.anio,
+        COALESCE(v.mes, v.mes_pedido),
+        v.nombre_producto,
+        CASE
+            WHEN v.error IS NOT NULL THEN 'error'
+            WHEN u.insertado THEN 'insertado'
+            ELSE 'actualizado'
+        END,
+        v.error
+    FROM validados v
+    LEFT JOIN escritas u
+      ON v.error IS NULL
+     AND u.anio = v.anio AND u.mes = v.mes AND u.producto_id = v.producto_id
+    ORDER BY v.indice;
+END;
+$$;
+
+
+-- =============================================
+-- FUNCION: huella de los precios de cada (producto, año) para la carga incremental
+-- md5 de las lineas 'mes|usd|usd_kg' (mes en numero, precios redondeados al centavo)
+-- ordenadas; incremental.py arma la misma huella con el CSV y solo sube los grupos que
+-- difieren. Devuelve un solo objeto {"producto_id:anio": huella} para que PostgREST no
+-- lo corte en paginas. p_anios: solo esos años (NULL = todos).
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_huellas_precios(p_anios INT[] DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(h.producto_id || ':' || h.anio, h.huella), '{}'::JSONB)
+    FROM (
+        SELECT l.producto_id, l.anio, md5(string_agg(l.linea, ';' ORDER BY l.linea COLLATE "C")) AS huella
+        FROM (
+            SELECT pp.producto_id, pp.anio,
+                   -- format deja '' en los NULL (concat_ws los saltearia)
+                   format('%s|%s|%s', mes_a_numero(pp.mes), round(pp.ponderado_usd, 2),
+                          round(pp.ponderado_usd_kg, 2)) AS linea
+            FROM precio_productor pp
+            WHERE pp.producto_id IS NOT NULL
+              AND (p_anios IS NULL OR pp.anio = ANY(p_anios))
+        ) l
+        GROUP BY l.producto_id, l.anio
+    ) h;
+$$;
+
+
+
+--============================
+-- Funciones de consulta que usa analisis.py
+--============================
+
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_completos(
+    prod_id INT,
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(anio INT, mes TEXT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.anio, pp.mes, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = prod_id
+      -- cada limite solo si viene (sin limites tambien salen las filas con periodo NULL)
+      AND (p_desde IS NULL OR pp.periodo >= date_trunc('month', p_desde::TIMESTAMP)::DATE)
+      AND (p_hasta IS NULL OR pp.periodo <= date_trunc('month', p_hasta::TIMESTAMP)::DATE)
+      -- el mismo rango en anio, para que solo se lean las particiones de esos años
+      AND (p_desde IS NULL OR pp.anio >= extract(year FROM p_desde)::INT)
+      AND (p_hasta IS NULL OR pp.anio <= extract(year FROM p_hasta)::INT)
+    ORDER BY pp.periodo;
+$$;
+
+
+-- historico de varios productos en una sola llamada (el comparador de analisis.py).
+-- Sin el nombre ni el mes en texto: el cliente ya tiene el catalogo y el mes sale de periodo.
+-- p_desde / p_hasta: meses del rango (inclusive); NULL = sin limite. Un año es
+-- p_desde = 'AAAA-01-01', p_hasta = 'AAAA-12-01'.
+CREATE OR REPLACE FUNCTION obtener_precios_historicos_productos(
+    prod_ids INT[],
+    p_desde DATE DEFAULT NULL,
+    p_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE(producto_id INT, anio INT, periodo DATE, ponderado_usd NUMERIC, ponderado_usd_kg NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT pp.producto_id, pp.anio, pp.periodo, pp.ponderado_usd, pp.ponderado_usd_kg
+    FROM precio_productor pp
+    WHERE pp.producto_id = ANY(prod_ids)
+      AND (p_desde IS NULL OR pp.periodo >= date_trunc('month', p_desde::TIMESTAMP)::DATE)
+      AND (p_hasta IS NULL OR pp.periodo <= date_trunc('month', p_hasta::TIMESTAMP)::DATE)
+      AND (p_desde IS NULL OR pp.anio >= extract(year FROM p_desde)::INT)
+      AND (p_hasta IS NULL OR pp.anio <= extract(year FROM p_hasta)::INT)
+    ORDER BY pp.producto_id, pp.periodo;
+$$;
+
+
+-- años con datos de los productos (para el filtro por año sin bajar el historico)
+CREATE OR REPLACE FUNCTION obtener_anios_productos(prod_ids INT[])
+RETURNS TABLE(anio INT, filas BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT r.anio, sum(r.filas)::BIGINT
+    FROM resumen_precio_anual r
+    WHERE r.producto_id = ANY(prod_ids)
+      AND r.filas > 0
+    GROUP BY r.anio
+    ORDER BY r.anio;
+$$;
+
+
+CREATE OR REPLACE FUNCTION obtener_promedio_usd_por_anio()
+RETURNS TABLE(nombre TEXT, anio INT, promedio_usd NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    -- se lee de la tabla de resumen: O(productos x años) en vez de recorrer precio_productor
+    SELECT
+        p.nombre,
+        r.anio,
+        ROUND(r.promedio_usd, 2) AS promedio_usd
+    FROM
+        resumen_precio_anual r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY p.nombre, r.anio;
+$$;
+
+
+CREATE OR REPLACE FUNCTION obtener_variacion_maxima_usd()
+RETURNS TABLE(nombre TEXT, variacion NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        p.nombre,
+        r.max_usd - r.min_usd AS variacion
+    FROM
+        resumen_precio_producto r
+    JOIN producto p ON r.producto_id = p.id
+    ORDER BY variacion DESC;
+$$;
+
+
+
+
+
+
 --============================
 --function explain promedios
 --============================
@@ -255,13 +1157,12 @@ BEGIN
         EXPLAIN (FORMAT TEXT)
         SELECT
             p.nombre,
-            pp.anio,
-            ROUND(AVG(pp.ponderado_usd), 2) AS promedio_usd
+            r.anio,
+            ROUND(r.promedio_usd, 2) AS promedio_usd
         FROM
-            precio_productor pp
-        JOIN producto p ON pp.producto_id = p.id
-        GROUP BY p.nombre, pp.anio
-        ORDER BY p.nombre, pp.anio
+            resumen_precio_anual r
+        JOIN producto p ON r.producto_id = p.id
+        ORDER BY p.nombre, r.anio
     ';
 END;
 $$;
@@ -281,21 +1182,13 @@ BEGIN
     RETURN QUERY
     EXECUTE '
         EXPLAIN (FORMAT TEXT)
-        WITH stats AS (
-            SELECT
-                producto_id,
-                MAX(ponderado_usd) - MIN(ponderado_usd) AS variacion
-            FROM
-                precio_productor
-            GROUP BY producto_id
-        )
         SELECT
             p.nombre,
-            s.variacion
+            r.max_usd - r.min_usd AS variacion
         FROM
-            stats s
-        JOIN producto p ON s.producto_id = p.id
-        ORDER BY s.variacion DESC
+            resumen_precio_producto r
+        JOIN producto p ON r.producto_id = p.id
+        ORDER BY variacion DESC
     ';
 END;
 $$;
@@ -309,14 +1202,518 @@ $$;
 
 
 
+-- =============================================
+-- CAPTURA DE PLANES Y REGRESIONES
+-- consulta_monitoreada tiene la llamada a cada RPC obtener_*, la misma que hace la app,
+-- asi que un cambio en la funcion se mide sin tocar el registro. Las funciones de
+-- lectura que devuelven tablas son LANGUAGE sql STABLE de un solo SELECT: el
+-- planificador las expande en la llamada y el EXPLAIN muestra su plan por dentro. De
+-- las demas (obtener_logs_auditoria en plpgsql, las de version que devuelven un numero)
+-- el plan solo muestra la llamada y se compara el tiempo.
+-- capturar_planes() corre
+-- EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) de cada una, guarda el plan en captura_plan
+-- y lo compara con la captura anterior. Pensada para correr todos los dias, por
+-- ejemplo con pg_cron:
+--   SELECT cron.schedule('capturar-planes', '30 3 * * *', 'SELECT * FROM capturar_planes()');
+-- =============================================
+CREATE TABLE IF NOT EXISTS consulta_monitoreada (
+    nombre TEXT PRIMARY KEY,
+    sql TEXT NOT NULL,       -- la llamada al RPC, con %s donde van los parametros
+    parametro_sql TEXT       -- consulta que devuelve una fila con el valor de cada %s, en orden
+                             -- (los arreglos como texto: array_agg(...)::TEXT)
+);
+
+CREATE TABLE IF NOT EXISTS captura_plan (
+    id BIGSERIAL PRIMARY KEY,
+    consulta TEXT NOT NULL REFERENCES consulta_monitoreada(nombre) ON DELETE CASCADE,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    plan JSONB NOT NULL,
+    ejecucion_ms NUMERIC NOT NULL,
+    planificacion_ms NUMERIC NOT NULL,
+    filas_resultado BIGINT,
+    filas_tablas JSONB,      -- filas estimadas (reltuples) de cada tabla del plan al capturar
+    accesos JSONB,           -- nodos que leen cada tabla, por tipo: {"producto": {"Seq Scan": 1}}
+    regresiones TEXT[] NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_captura_plan_consulta_fecha ON captura_plan(consulta, fecha DESC);
+
+INSERT INTO consulta_monitoreada(nombre, sql, parametro_sql) VALUES
+    ('obtener_productos',
+     'SELECT * FROM obtener_productos()',
+     NULL),
+    ('obtener_version_catalogo',
+     'SELECT obtener_version_catalogo()',
+     NULL),
+    ('obtener_version_datos',
+     'SELECT obtener_version_datos()',
+     NULL),
+    ('obtener_precios_historicos_completos',
+     'SELECT * FROM obtener_precios_historicos_completos(%s)',
+     -- el producto con mas filas
+     'SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 1'),
+    ('obtener_precios_historicos_productos',
+     'SELECT * FROM obtener_precios_historicos_productos(%s::int[])',
+     -- los 20 productos con mas filas
+     'SELECT array_agg(producto_id)::TEXT FROM (
+          SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t'),
+    ('obtener_precios_historicos_productos_anio',
+     -- el filtro por año de analisis.py, con el ultimo año completo
+     'SELECT * FROM obtener_precios_historicos_productos(%s::int[], %s::date, %s::date)',
+     'SELECT (SELECT array_agg(producto_id)::TEXT FROM (
+                  SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t) AS ids,
+             make_date(extract(year FROM now())::INT - 1, 1, 1) AS desde,
+             make_date(extract(year FROM now())::INT - 1, 12, 1) AS hasta'),
+    ('obtener_anios_productos',
+     'SELECT * FROM obtener_anios_productos(%s::int[])',
+     'SELECT array_agg(producto_id)::TEXT FROM (
+          SELECT producto_id FROM resumen_precio_anual GROUP BY producto_id ORDER BY sum(filas) DESC LIMIT 20) t'),
+    ('obtener_promedio_usd_por_anio',
+     'SELECT * FROM obtener_promedio_usd_por_anio()',
+     NULL),
+    ('obtener_variacion_maxima_usd',
+     'SELECT * FROM obtener_variacion_maxima_usd()',
+     NULL),
+    ('obtener_logs_auditoria',
+     -- los 500 de logs.py
+     'SELECT * FROM obtener_logs_auditoria(%s)',
+     'SELECT 500')
+ON CONFLICT (nombre) DO UPDATE
+SET sql = EXCLUDED.sql,
+    parametro_sql = EXCLUDED.parametro_sql;
+
+-- =============================================
+-- FUNCION: capturar el plan de una consulta registrada
+-- Se ejecuta p_repeticiones veces y se guarda la mas rapida (la primera suele pagar la
+-- cache fria). Marca como regresion, respecto de la captura anterior:
+--   * una tabla con mas lecturas Seq Scan y menos lecturas por indice que antes
+--     (en una tabla particionada se cuenta una lectura por particion)
+--   * una ejecucion p_factor_lento veces mas lenta (si pasa de p_ms_minimo, para no
+--     marcar ruido en consultas de fracciones de milisegundo)
+-- Devuelve el id de la captura.
+-- =============================================
+CREATE OR REPLACE FUNCTION capturar_plan(
+    p_consulta TEXT,
+    p_repeticiones INT DEFAULT 3,
+    p_factor_lento NUMERIC DEFAULT 2,
+    p_ms_minimo NUMERIC DEFAULT 1
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_registro consulta_monitoreada%ROWTYPE;
+    v_sql TEXT;
+    v_parametros TEXT[];
+    v_explain JSONB;
+    v_plan JSONB;
+    v_accesos JSONB;
+    v_filas_tablas JSONB;
+    v_anterior captura_plan%ROWTYPE;
+    v_regresiones TEXT[] := '{}';
+    v_relacion TEXT;
+    v_seq INT;
+    v_indice INT;
+    v_seq_antes INT;
+    v_indice_antes INT;
+    v_id BIGINT;
+BEGIN
+    SELECT * INTO v_registro FROM consulta_monitoreada WHERE nombre = p_consulta;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'La consulta % no esta en consulta_monitoreada', p_consulta;
+    END IF;
+
+    v_sql := v_registro.sql;
+    IF v_registro.parametro_sql IS NOT NULL THEN
+        EXECUTE format(
+            'SELECT array_agg(quote_nullable(e.valor) ORDER BY e.n)
+             FROM (%s) q, json_each_text(row_to_json(q)) WITH ORDINALITY AS e(columna, valor, n)',
+            v_registro.parametro_sql) INTO v_parametros;
+        -- si no devuelve filas (base vacia) todos los parametros van en NULL
+        v_parametros := COALESCE(v_parametros,
+            array_fill('NULL'::TEXT, ARRAY[(length(v_sql) - length(replace(v_sql, '%s', ''))) / 2]));
+        v_sql := format(v_sql, VARIADIC v_parametros);
+    END IF;
+
+    FOR i IN 1..GREATEST(p_repeticiones, 1) LOOP
+        EXECUTE 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' || v_sql INTO v_explain;
+        IF v_plan IS NULL OR (v_explain->0->>'Execution Time')::NUMERIC < (v_plan->>'Execution Time')::NUMERIC THEN
+            v_plan := v_explain->0;
+        END IF;
+    END LOOP;
+
+    -- cada tabla del plan (cualquier nivel) con cuantos nodos de cada tipo la leen y sus filas;
+    -- las particiones se juntan bajo su tabla (precio_productor, log_auditoria)
+    WITH nodos AS (
+        SELECT COALESCE(pg_partition_root(c.oid), c.oid)::regclass::TEXT AS relacion,
+               c.oid, GREATEST(c.reltuples, 0) AS filas, n->>'Node Type' AS nodo
+        FROM jsonb_path_query(v_plan, 'strict $.**') AS n
+        JOIN pg_class c ON c.oid = to_regclass(n->>'Relation Name')
+        WHERE jsonb_typeof(n) = 'object' AND n ? 'Relation Name'
+    )
+    SELECT jsonb_object_agg(a.relacion, a.nodos), jsonb_object_agg(a.relacion, f.filas)
+    INTO v_accesos, v_filas_tablas
+    FROM (
+        SELECT relacion, jsonb_object_agg(nodo, n) AS nodos
+        FROM (SELECT relacion, nodo, count(*) AS n FROM nodos GROUP BY relacion, nodo) c
+        GROUP BY relacion
+    ) a
+    JOIN (
+        SELECT relacion, sum(filas)::BIGINT AS filas
+        FROM (SELECT DISTINCT relacion, oid, filas FROM nodos) d
+        GROUP BY relacion
+    ) f USING (relacion);
+
+    SELECT * INTO v_anterior
+    FROM captura_plan
+    WHERE consulta = p_consulta
+    ORDER BY fecha DESC, id DESC
+    LIMIT 1;
+
+    IF FOUND THEN
+        FOR v_relacion IN SELECT jsonb_object_keys(COALESCE(v_accesos, '{}')) LOOP
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq, v_indice
+            FROM jsonb_each_text(v_accesos->v_relacion) AS e(nodo, n);
+            SELECT COALESCE(sum(n::INT) FILTER (WHERE nodo = 'Seq Scan'), 0),
+                   COALESCE(sum(n::INT) FILTER (WHERE nodo <> 'Seq Scan'), 0)
+            INTO v_seq_antes, v_indice_antes
+            FROM jsonb_each_text(COALESCE(v_anterior.accesos->v_relacion, '{}')) AS e(nodo, n);
+
+            IF v_seq > v_seq_antes AND v_indice < v_indice_antes THEN
+                v_regresiones := v_regresiones || format('Seq Scan en %s en lugar de indice (%s -> %s lecturas con indice)',
+                    v_relacion, v_indice_antes, v_indice);
+            END IF;
+        END LOOP;
+
+        IF (v_plan->>'Execution Time')::NUMERIC >= p_ms_minimo
+           AND (v_plan->>'Execution Time')::NUMERIC >= p_factor_lento * v_anterior.ejecucion_ms THEN
+            v_regresiones := v_regresiones || format('%sx mas lenta (%s ms, antes %s ms)',
+                round((v_plan->>'Execution Time')::NUMERIC / NULLIF(v_anterior.ejecucion_ms, 0), 1),
+                round((v_plan->>'Execution Time')::NUMERIC, 3), round(v_anterior.ejecucion_ms, 3));
+        END IF;
+    END IF;
+
+    INSERT INTO captura_plan(consulta, plan, ejecucion_ms, planificacion_ms, filas_resultado,
+                             filas_tablas, accesos, regresiones)
+    VALUES (
+        p_consulta,
+        v_plan,
+        (v_plan->>'Execution Time')::NUMERIC,
+        (v_plan->>'Planning Time')::NUMERIC,
+        (v_plan->'Plan'->>'Actual Rows')::BIGINT,
+        v_filas_tablas,
+        v_accesos,
+        v_regresiones
+    )
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: capturar los planes de todas las consultas registradas
+-- =============================================
+CREATE OR REPLACE FUNCTION capturar_planes(
+    p_repeticiones INT DEFAULT 3,
+    p_factor_lento NUMERIC DEFAULT 2,
+    p_ms_minimo NUMERIC DEFAULT 1
+)
+RETURNS TABLE(consulta TEXT, ejecucion_ms NUMERIC, regresiones TEXT[]) AS $$
+#variable_conflict use_column
+DECLARE
+    v_nombre TEXT;
+    v_id BIGINT;
+BEGIN
+    FOR v_nombre IN SELECT nombre FROM consulta_monitoreada ORDER BY nombre LOOP
+        v_id := capturar_plan(v_nombre, p_repeticiones, p_factor_lento, p_ms_minimo);
+        RETURN QUERY
+        SELECT c.consulta, c.ejecucion_ms, c.regresiones FROM captura_plan c WHERE c.id = v_id;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCION: ultima captura de cada consulta, con el tiempo de la anterior
+-- (la usa analisis.py)
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_capturas_plan()
+RETURNS TABLE(
+    consulta TEXT,
+    fecha TIMESTAMP,
+    ejecucion_ms NUMERIC,
+    ejecucion_ms_anterior NUMERIC,
+    filas_resultado BIGINT,
+    filas_tablas JSONB,
+    accesos JSONB,
+    regresiones TEXT[],
+    plan JSONB
+) AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    SELECT c.consulta, c.fecha, c.ejecucion_ms, c.anterior_ms, c.filas_resultado,
+           c.filas_tablas, c.accesos, c.regresiones, c.plan
+    FROM (
+        SELECT cp.*,
+               lag(cp.ejecucion_ms) OVER (PARTITION BY cp.consulta ORDER BY cp.fecha, cp.id) AS anterior_ms,
+               row_number() OVER (PARTITION BY cp.consulta ORDER BY cp.fecha DESC, cp.id DESC) AS n
+        FROM captura_plan cp
+    ) c
+    WHERE c.n = 1
+    ORDER BY cardinality(c.regresiones) DESC, c.consulta;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =============================================
+-- ASESOR DE INDICES
+-- analizar_indices() revisa los indices del schema public con el catalogo y las
+-- estadisticas acumuladas desde el ultimo reset (pg_stat_user_indexes,
+-- pg_stat_user_tables, los planes de captura_plan y, si esta instalada,
+-- pg_stat_statements), o sea con la carga que de verdad produjeron los RPC y las
+-- simulaciones. Un hallazgo por fila:
+--   redundante: sus columnas son el inicio de otro indice btree de la misma tabla
+--   sin_uso:    ninguna lectura desde el reset (no se cuentan los de PK/UNIQUE)
+--   faltante:   una FK sin indice, o una consulta de captura_plan que lee la tabla con
+--               Seq Scan y descarta muchas filas con el filtro
+-- escrituras_indice: entradas que escribe el indice (filas insertadas + actualizaciones
+--   no HOT de la tabla): lo que se ahorra al borrarlo o lo que cuesta crearlo.
+-- beneficio_lectura: lecturas que hicieron con el indice (idx_scan) en los existentes;
+--   filas que no habria que leer en los faltantes.
+-- En las tablas particionadas se suman las estadisticas de todas las particiones.
+-- =============================================
+CREATE OR REPLACE FUNCTION analizar_indices(p_filas_minimas BIGINT DEFAULT 1000)
+RETURNS TABLE(
+    hallazgo TEXT,
+    tabla TEXT,
+    indice TEXT,
+    columnas TEXT,
+    detalle TEXT,
+    tamano_bytes BIGINT,
+    escrituras_indice BIGINT,
+    beneficio_lectura BIGINT,
+    sugerencia TEXT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_hay_pss BOOLEAN := to_regclass('pg_stat_statements') IS NOT NULL;
+    v_candidato RECORD;
+    v_llamadas BIGINT;
+BEGIN
+    -- redundantes y sin uso
+    RETURN QUERY
+    WITH tablas AS (
+        SELECT c.oid, c.relname
+        FROM pg_class c
+        WHERE c.relnamespace = 'public'::regnamespace
+          AND c.relkind IN ('r', 'p')
+          AND NOT c.relispartition
+    ),
+    -- las estadisticas de cada particion se suman en su tabla (pg_partition_root)
+    escrituras AS (
+        SELECT COALESCE(pg_partition_root(s.relid), s.relid) AS oid,
+               sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd)::BIGINT AS filas
+        FROM pg_stat_user_tables s
+        GROUP BY 1
+    ),
+    indices AS (
+        SELECT
+            i.indexrelid AS oid,
+            i.indrelid AS tabla_oid,
+            ic.relname AS nombre,
+            am.amname,
+            i.indisunique,
+            EXISTS (SELECT 1 FROM pg_constraint k
+                    WHERE k.conindid = i.indexrelid AND k.conrelid = i.indrelid
+                      AND k.contype IN ('p', 'u', 'x')) AS de_restriccion,
+            i.indpred IS NOT NULL OR i.indexprs IS NOT NULL AS especial,
+            string_to_array(i.indkey::TEXT, ' ')::INT[] AS todas,
+            (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:i.indnkeyatts] AS claves
+        FROM pg_index i
+        JOIN tablas t ON t.oid = i.indrelid
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = ic.relam
+    ),
+    uso AS (
+        SELECT COALESCE(pg_partition_root(s.indexrelid), s.indexrelid) AS oid,
+               sum(s.idx_scan)::BIGINT AS lecturas,
+               sum(pg_relation_size(s.indexrelid))::BIGINT AS tamano
+        FROM pg_stat_user_indexes s
+        GROUP BY 1
+    ),
+    redundantes AS (
+        SELECT DISTINCT ON (a.oid) a.oid, b.nombre AS cubierto_por
+        FROM indices a
+        JOIN indices b ON b.tabla_oid = a.tabla_oid AND b.oid <> a.oid
+        WHERE a.amname = 'btree' AND b.amname = 'btree'
+          AND NOT a.especial AND NOT b.especial
+          AND NOT a.de_restriccion
+          AND b.claves[1:cardinality(a.claves)] = a.claves
+          AND a.todas <@ b.todas
+          AND (NOT a.indisunique OR (b.indisunique AND b.claves = a.claves))
+          -- de dos indices iguales se marca uno solo (se queda el de la restriccion o el mas viejo)
+          AND NOT (b.claves = a.claves AND b.todas <@ a.todas AND a.indisunique = b.indisunique
+                   AND NOT b.de_restriccion AND b.oid > a.oid)
+        ORDER BY a.oid, b.de_restriccion DESC, cardinality(b.claves)
+    ),
+    hallazgos AS (
+        SELECT ix.*, r.cubierto_por,
+               CASE WHEN r.oid IS NOT NULL THEN 'redundante' ELSE 'sin_uso' END AS tipo
+        FROM indices ix
+        LEFT JOIN redundantes r ON r.oid = ix.oid
+        JOIN uso u ON u.oid = ix.oid
+        WHERE r.oid IS NOT NULL
+           OR (u.lecturas = 0 AND NOT ix.indisunique AND NOT ix.de_restriccion)
+    )
+    SELECT
+        h.tipo,
+        t.relname::TEXT,
+        h.nombre::TEXT,
+        (SELECT string_agg(a.attname, ', ' ORDER BY k.n)
+         FROM unnest(h.claves) WITH ORDINALITY AS k(attnum, n)
+         JOIN pg_attribute a ON a.attrelid = h.tabla_oid AND a.attnum = k.attnum),
+        CASE h.tipo
+            WHEN 'redundante' THEN format('sus columnas son el inicio de %s, que puede atender sus %s lecturas',
+                                          h.cubierto_por, u.lecturas)
+            ELSE 'ninguna lectura lo uso desde el ultimo reset de estadisticas'
+        END,
+        u.tamano,
+        e.filas,
+        u.lecturas,
+        format('DROP INDEX %I;', h.nombre)
+    FROM hallazgos h
+    JOIN tablas t ON t.oid = h.tabla_oid
+    JOIN uso u ON u.oid = h.oid
+    JOIN escrituras e ON e.oid = h.tabla_oid
+    ORDER BY h.tipo, e.filas DESC;
+
+    -- FK sin indice: cada DELETE/UPDATE de la tabla referenciada recorre esta tabla
+    RETURN QUERY
+    SELECT
+        'faltante'::TEXT,
+        c.relname::TEXT,
+        NULL::TEXT,
+        (SELECT string_agg(a.attname, ', ' ORDER BY k.n)
+         FROM unnest(f.conkey) WITH ORDINALITY AS k(attnum, n)
+         JOIN pg_attribute a ON a.attrelid = f.conrelid AND a.attnum = k.attnum),
+        format('FK %s hacia %s sin indice', f.conname, f.confrelid::regclass),
+        NULL::BIGINT,
+        (SELECT COALESCE(sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd), 0)::BIGINT
+         FROM pg_stat_user_tables s
+         WHERE COALESCE(pg_partition_root(s.relid), s.relid) = f.conrelid),
+        ((SELECT COALESCE(sum(s.n_tup_del + s.n_tup_upd), 0)
+          FROM pg_stat_user_tables s WHERE s.relid = f.confrelid)
+         * GREATEST(c.reltuples, 0))::BIGINT,
+        format('CREATE INDEX ON %I (%s);', c.relname,
+               (SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY k.n)
+                FROM unnest(f.conkey) WITH ORDINALITY AS k(attnum, n)
+                JOIN pg_attribute a ON a.attrelid = f.conrelid AND a.attnum = k.attnum))
+    FROM pg_constraint f
+    JOIN pg_class c ON c.oid = f.conrelid
+    WHERE f.contype = 'f'
+      AND c.relnamespace = 'public'::regnamespace
+      AND NOT c.relispartition
+      AND NOT EXISTS (
+          SELECT 1 FROM pg_index i
+          WHERE i.indrelid = f.conrelid
+            AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:cardinality(f.conkey)] @> f.conkey::INT[]
+            AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1:cardinality(f.conkey)] <@ f.conkey::INT[]
+      );
+
+    -- Seq Scan con filtro en la ultima captura de cada consulta (ver capturar_planes)
+    FOR v_candidato IN
+        WITH ultimas AS (
+            SELECT DISTINCT ON (cp.consulta) cp.consulta, cp.plan,
+                   -- la funcion que llama la consulta: 'SELECT * FROM obtener_x(%s)' -> obtener_x
+                   substring(cm.sql FROM '(\w+)\s*\(') AS funcion
+            FROM captura_plan cp
+            JOIN consulta_monitoreada cm ON cm.nombre = cp.consulta
+            ORDER BY cp.consulta, cp.fecha DESC, cp.id DESC
+        ),
+        nodos AS (
+            SELECT u.consulta, u.funcion,
+                   COALESCE(pg_partition_root(c.oid), c.oid) AS tabla_oid,
+                   n->>'Filter' AS filtro,
+                   COALESCE((n->>'Rows Removed by Filter')::NUMERIC, 0) * COALESCE((n->>'Actual Loops')::NUMERIC, 1) AS descartadas,
+                   COALESCE((n->>'Actual Rows')::NUMERIC, 0) * COALESCE((n->>'Actual Loops')::NUMERIC, 1) AS devueltas
+            FROM ultimas u
+            CROSS JOIN LATERAL jsonb_path_query(u.plan, 'strict $.**') AS n
+            JOIN pg_class c ON c.oid = to_regclass(n->>'Relation Name')
+            WHERE jsonb_typeof(n) = 'object'
+              AND n->>'Node Type' = 'Seq Scan'
+              AND n ? 'Filter'
+        ),
+        por_tabla AS (
+            SELECT consulta, funcion, tabla_oid, min(filtro) AS filtro,
+                   sum(descartadas)::BIGINT AS descartadas, sum(devueltas)::BIGINT AS devueltas
+            FROM nodos
+            GROUP BY consulta, funcion, tabla_oid
+        )
+        SELECT p.*, t.relname, col.attnums, col.nombres
+        FROM por_tabla p
+        JOIN pg_class t ON t.oid = p.tabla_oid
+        CROSS JOIN LATERAL (
+            -- columnas de la tabla que aparecen en el filtro
+            SELECT array_agg(a.attnum ORDER BY a.attnum) AS attnums,
+                   string_agg(quote_ident(a.attname), ', ' ORDER BY a.attnum) AS nombres
+            FROM pg_attribute a
+            WHERE a.attrelid = p.tabla_oid AND a.attnum > 0 AND NOT a.attisdropped
+              AND p.filtro ~ ('\m' || a.attname || '\M')
+        ) col
+        WHERE p.descartadas >= p_filas_minimas
+          AND p.descartadas > 10 * p.devueltas
+          AND col.attnums IS NOT NULL
+          -- si ya hay un indice que empieza por alguna de esas columnas, no es falta de indice
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_index i
+              WHERE i.indrelid = p.tabla_oid
+                AND (string_to_array(i.indkey::TEXT, ' ')::INT[])[1] = ANY(col.attnums)
+          )
+    LOOP
+        v_llamadas := NULL;
+        IF v_hay_pss AND v_candidato.funcion IS NOT NULL THEN
+            -- el nombre completo seguido de '(' (PostgREST lo escribe entre comillas):
+            -- obtener_x no cuenta las llamadas a obtener_x_anio
+            EXECUTE 'SELECT sum(calls)::BIGINT FROM pg_stat_statements WHERE query ~* $1'
+            INTO v_llamadas
+            USING '\m' || v_candidato.funcion || '"?\s*\(';
+        END IF;
+
+        RETURN QUERY
+        SELECT
+            'faltante'::TEXT,
+            v_candidato.relname::TEXT,
+            NULL::TEXT,
+            v_candidato.nombres,
+            format('%s: Seq Scan descarta %s filas por ejecucion (filtro %s); %s',
+                   v_candidato.consulta, v_candidato.descartadas, v_candidato.filtro,
+                   CASE WHEN v_llamadas IS NULL THEN 'beneficio por ejecucion (sin pg_stat_statements)'
+                        ELSE format('%s llamadas en pg_stat_statements', v_llamadas) END),
+            NULL::BIGINT,
+            (SELECT COALESCE(sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd), 0)::BIGINT
+             FROM pg_stat_user_tables s
+             WHERE COALESCE(pg_partition_root(s.relid), s.relid) = v_candidato.tabla_oid),
+            v_candidato.descartadas * COALESCE(NULLIF(v_llamadas, 0), 1),
+            format('CREATE INDEX ON %I (%s);', v_candidato.relname, v_candidato.nombres);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
 -- =============================================
 -- TRIGGER FUNCTION: auditoría en DELETE
+-- El nombre de la tabla se pasa como argumento: en una tabla particionada
+-- TG_TABLE_NAME seria el de la particion. No audita las filas que
+-- crear_particion_precio_productor solo cambia de particion.
 -- =============================================
 CREATE OR REPLACE FUNCTION trigger_auditoria_delete()
 RETURNS TRIGGER AS $$
 BEGIN
+    IF current_setting('app.moviendo_particion', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
     PERFORM registrar_auditoria(
-        TG_TABLE_NAME,
+        COALESCE(TG_ARGV[0], TG_TABLE_NAME),
         'DELETE',
         current_setting('app.usuario_simulado', true),
         to_jsonb(OLD),
@@ -332,7 +1729,211 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER auditoria_delete_precio
 AFTER DELETE ON precio_productor
 FOR EACH ROW
-EXECUTE FUNCTION trigger_auditoria_delete();
+EXECUTE FUNCTION trigger_auditoria_delete('precio_productor');
+
+
+-- =============================================
+-- FUNCION: recalcular min/max de algunos productos desde precio_productor
+-- (se usa cuando se borra o cambia el valor que era el minimo o el maximo)
+-- =============================================
+CREATE OR REPLACE FUNCTION recalcular_resumen_producto(p_producto_ids INT[])
+RETURNS VOID AS $$
+BEGIN
+    -- bloqueo en orden de producto_id, igual que trigger_resumen_precio
+    PERFORM 1 FROM resumen_precio_producto
+    WHERE producto_id = ANY(p_producto_ids)
+    ORDER BY producto_id
+    FOR UPDATE;
+
+    DELETE FROM resumen_precio_producto WHERE producto_id = ANY(p_producto_ids);
+
+    INSERT INTO resumen_precio_producto(producto_id, min_usd, max_usd)
+    SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+    FROM precio_productor
+    WHERE producto_id = ANY(p_producto_ids)
+    GROUP BY producto_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- TRIGGER FUNCTION: mantener las tablas de resumen
+-- Es por sentencia y usa las tablas de transicion (viejas/nuevas), asi una carga
+-- masiva actualiza cada (producto, año) una sola vez y no fila por fila.
+-- Cada escritura bloquea hasta el COMMIT la fila de resumen de su (producto, año) y la de
+-- su producto: los escritores de un mismo producto quedan serializados en esa fila.
+-- Para que dos lotes concurrentes no se bloqueen en orden cruzado (deadlock), las filas
+-- de resumen se toman siempre en orden de (producto_id, anio) y de producto_id.
+-- =============================================
+CREATE OR REPLACE FUNCTION trigger_resumen_precio()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_recalcular INT[];
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- el UPDATE ... FROM no sigue un orden fijo: primero se bloquea en orden
+        PERFORM 1 FROM resumen_precio_anual r
+        WHERE (r.producto_id, r.anio) IN (SELECT producto_id, anio FROM viejas)
+        ORDER BY r.producto_id, r.anio
+        FOR UPDATE;
+
+        -- restar las filas viejas
+        UPDATE resumen_precio_anual r
+        SET suma_usd = r.suma_usd - d.suma_usd,
+            filas_usd = r.filas_usd - d.filas_usd,
+            filas = r.filas - d.filas
+        FROM (
+            SELECT producto_id, anio,
+                   COALESCE(SUM(ponderado_usd), 0) AS suma_usd,
+                   COUNT(ponderado_usd) AS filas_usd,
+                   COUNT(*) AS filas
+            FROM viejas
+            WHERE producto_id IS NOT NULL
+            GROUP BY producto_id, anio
+            ORDER BY producto_id, anio
+        ) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio;
+
+        DELETE FROM resumen_precio_anual r
+        USING (SELECT DISTINCT producto_id, anio FROM viejas) d
+        WHERE r.producto_id = d.producto_id AND r.anio = d.anio AND r.filas <= 0;
+
+        -- si salio el valor que era el minimo o el maximo, ese producto se recalcula
+        SELECT array_agg(DISTINCT v.producto_id) INTO v_recalcular
+        FROM viejas v
+        JOIN resumen_precio_producto r ON r.producto_id = v.producto_id
+        WHERE v.ponderado_usd <= r.min_usd OR v.ponderado_usd >= r.max_usd;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- sumar las filas nuevas
+        INSERT INTO resumen_precio_anual AS r (producto_id, anio, suma_usd, filas_usd, filas)
+        SELECT producto_id, anio, COALESCE(SUM(ponderado_usd), 0), COUNT(ponderado_usd), COUNT(*)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id, anio
+        -- ON CONFLICT bloquea las filas en el orden en que llegan
+        ORDER BY producto_id, anio
+        ON CONFLICT (producto_id, anio) DO UPDATE
+        SET suma_usd = r.suma_usd + EXCLUDED.suma_usd,
+            filas_usd = r.filas_usd + EXCLUDED.filas_usd,
+            filas = r.filas + EXCLUDED.filas;
+
+        INSERT INTO resumen_precio_producto AS r (producto_id, min_usd, max_usd)
+        SELECT producto_id, MIN(ponderado_usd), MAX(ponderado_usd)
+        FROM nuevas
+        WHERE producto_id IS NOT NULL
+        GROUP BY producto_id
+        ORDER BY producto_id
+        ON CONFLICT (producto_id) DO UPDATE
+        SET min_usd = LEAST(r.min_usd, EXCLUDED.min_usd),
+            max_usd = GREATEST(r.max_usd, EXCLUDED.max_usd);
+    END IF;
+
+    IF v_recalcular IS NOT NULL THEN
+        PERFORM recalcular_resumen_producto(v_recalcular);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trigger_resumen_precio_truncate()
+RETURNS TRIGGER AS $$
+BEGIN
+    TRUNCATE resumen_precio_anual, resumen_precio_producto;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================
+-- ASIGNAR TRIGGERS de resumen a precio_productor
+-- (las tablas de transicion solo se permiten con un evento por trigger)
+-- =============================================
+CREATE TRIGGER trg_resumen_precio_insert
+AFTER INSERT ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+CREATE TRIGGER trg_resumen_precio_update
+AFTER UPDATE ON precio_productor
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+CREATE TRIGGER trg_resumen_precio_delete
+AFTER DELETE ON precio_productor
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio();
+
+CREATE TRIGGER trg_resumen_precio_truncate
+AFTER TRUNCATE ON precio_productor
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_resumen_precio_truncate();
+
+-- =============================================
+-- VERSION DE LOS DATOS (cache de los clientes)
+-- version_precios_seq sube con cada sentencia que cambia filas de precio_productor.
+-- Es una secuencia y no una fila para no bloquear a los escritores concurrentes
+-- (nextval no espera a nadie). Como nextval no es transaccional, la version puede
+-- subir un momento antes de que el cambio se vea; los clientes ademas usan un TTL.
+-- =============================================
+CREATE SEQUENCE IF NOT EXISTS version_precios_seq;
+
+CREATE OR REPLACE FUNCTION trigger_version_precios()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- un INSERT ... ON CONFLICT o un UPDATE que no toco filas no cambia la version
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NOT EXISTS (SELECT 1 FROM nuevas) THEN
+            RETURN NULL;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM viejas) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    PERFORM nextval('version_precios_seq');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_version_precios_insert
+AFTER INSERT ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+CREATE TRIGGER trg_version_precios_update
+AFTER UPDATE ON precio_productor
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+CREATE TRIGGER trg_version_precios_delete
+AFTER DELETE ON precio_productor
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+CREATE TRIGGER trg_version_precios_truncate
+AFTER TRUNCATE ON precio_productor
+FOR EACH STATEMENT
+EXECUTE FUNCTION trigger_version_precios();
+
+-- =============================================
+-- FUNCION: version de los datos que lee analisis.py (precios + catalogo de productos)
+-- Las dos partes solo suben, asi que la suma tambien: si cambia, algo cambio.
+-- =============================================
+CREATE OR REPLACE FUNCTION obtener_version_datos()
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM version_precios_seq)
+         + (SELECT version FROM catalogo_version WHERE id = 1);
+$$;
 
 
 -- =============================================
@@ -361,7 +1962,7 @@ SELECT
 FROM
     precio_productor pp
 JOIN producto p ON pp.producto_id = p.id
-ORDER BY p.nombre, pp.anio, pp.mes;
+ORDER BY p.nombre, pp.periodo;
 
 
 -- =============================================
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+
+# Cache de las consultas de la pagina de analisis, compartida por todas las sesiones.
+# Cada resultado se guarda con la version de los datos (obtener_version_datos, que la base
+# sube con cada escritura en precio_productor o en producto) como parte de la clave: mientras
+# nadie escriba, los reruns de todos los analistas salen de memoria y a la base solo le llega
+# la pregunta por la version, a lo sumo una vez cada SEGUNDOS_VERSION.
+# Ademas cada consulta tiene su TTL y el total esta acotado en MB (se saca lo menos usado).
+
+SEGUNDOS_VERSION = 5
+MB_MAXIMO = float(os.getenv("CACHE_ANALISIS_MB", "64"))
+
+# segundos que vive cada consulta aunque la version no cambie (las no listadas usan TTL_DEFECTO)
+TTL_CONSULTAS = {
+    "obtener_precios_historicos_productos": 15 * 60,
+    "obtener_anios_productos": 15 * 60,
+    "obtener_promedio_usd_por_anio": 60 * 60,
+    "obtener_variacion_maxima_usd": 60 * 60,
+}
+TTL_DEFECTO = 10 * 60
+
+
+def _tamano(df):
+    return int(df.memory_usage(index=True, deep=True).sum()) + sys.getsizeof(df)
+
+
+class CacheConsultas:
+    """LRU de DataFrames acotado por bytes, con TTL por entrada. Seguro entre hilos."""
+
+    def __init__(self, bytes_maximo):
+        self.bytes_maximo = bytes_maximo
+        self.bytes_usados = 0
+        self._entradas = OrderedDict()  # clave -> (df, tamano, vence)
+        self._lock = threading.Lock()
+        self._cargando = {}  # clave -> lock: una sola sesion consulta la base por clave
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _sacar(self, clave):
+        _, tamano, _ = self._entradas.pop(clave)
+        self.bytes_usados -= tamano
+
+    def _buscar(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[2] < time.monotonic():
+                self._sacar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def _guardar(self, clave, df):
+        tamano = _tamano(df)
+        with self._lock:
+            if clave in self._entradas:
+                self._sacar(clave)
+            if tamano > self.bytes_maximo:
+                return  # no entra ni vaciando la cache
+            while self.bytes_usados + tamano > self.bytes_maximo:
+                self._sacar(next(iter(self._entradas)))
+            self._entradas[clave] = (df, tamano, time.monotonic() + TTL_CONSULTAS.get(clave[0], TTL_DEFECTO))
+            self.bytes_usados += tamano
+
+    def descartar_version(self, version):
+        """Saca las entradas guardadas con otra version de los datos."""
+        with self._lock:
+            for clave in [c for c in self._entradas if c[2] != version]:
+                self._sacar(clave)
+
+    def obtener(self, clave, cargar):
+        df = self._buscar(clave)
+        if df is None:
+            with self._lock:
+                lock_clave = self._cargando.setdefault(clave, threading.Lock())
+            with lock_clave:
+                # si otra sesion la cargo mientras esperabamos, se usa esa
+                df = self._buscar(clave)
+                if df is None:
+                    with self._lock:
+                        self.fallos += 1
+                    df = cargar()
+                    self._guardar(clave, df)
+            with self._lock:
+                self._cargando.pop(clave, None)
+        # copia para que una pagina que modifica su DataFrame no cambie el de las otras sesiones
+        return df.copy()
+
+    def estado(self):
+        with self._lock:
+            return {"entradas": len(self._entradas), "mb": round(self.bytes_usados / 1024 ** 2, 2),
+                    "mb_maximo": round(self.bytes_maximo / 1024 ** 2, 2),
+                    "aciertos": self.aciertos, "fallos": self.fallos}
+
+
+@st.cache_resource(show_spinner=False)
+def _cache():
+    return CacheConsultas(int(MB_MAXIMO * 1024 ** 2))
+
+
+@st.cache_data(ttl=SEGUNDOS_VERSION, show_spinner=False)
+def _version_datos(_supabase):
+    res = _supabase.rpc("obtener_version_datos").execute()
+    return res.data
+
+
+def refrescar_version():
+    """Despues de una escritura desde la app: la proxima consulta ya pregunta la version nueva."""
+    _version_datos.clear()
+
+
+def consultar(supabase, rpc, params=None, tipar=pd.DataFrame):
+    """
+    DataFrame con el resultado de supabase.rpc(rpc, params), desde la cache si la version
+    de los datos no cambio y la entrada no vencio. Si la RPC falla se lanza RuntimeError.
+    tipar convierte la lista de dicts en el DataFrame que se guarda (ver tipos_datos.py).
+    """
+    version = _version_datos(supabase)
+    cache = _cache()
+    cache.descartar_version(version)
+    clave = (rpc, json.dumps(params or {}, sort_keys=True), version)
+
+    def cargar():
+        res = supabase.rpc(rpc, params or {}).execute()
+        if res.data is None:
+            raise RuntimeError(f"{rpc} no devolvio datos")
+        return tipar(res.data)
+
+    return cache.obtener(clave, cargar)
+
+
+def estado_cache():
+    return _cache().estado()
@@ -0,0 +1,39 @@
+import streamlit as st
+
+
+# Catalogo de productos compartido por las paginas.
+# La lista se guarda en la cache de Streamlit (compartida entre sesiones) con la version
+# del catalogo como clave. En cada interaccion solo se pregunta la version, que es un
+# numero que la base sube cuando cambia la tabla producto (insertar_producto, la carga);
+# la lista se vuelve a pedir solo cuando ese numero cambia.
+
+# cada cuanto se vuelve a preguntar la version (un producto nuevo tarda a lo sumo esto en aparecer)
+SEGUNDOS_VERSION = 10
+
+
+@st.cache_data(ttl=SEGUNDOS_VERSION, show_spinner=False)
+def _version_catalogo(_supabase):
+    res = _supabase.rpc("obtener_version_catalogo").execute()
+    return res.data
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _productos(_supabase, version):
+    res = _supabase.rpc("obtener_productos").execute()
+    if res.data is None:
+        raise RuntimeError("obtener_productos no devolvio datos")
+    return res.data
+
+
+def obtener_catalogo(supabase):
+    """Lista de productos [{"id", "nombre"}], la misma que devuelve obtener_productos."""
+    try:
+        return _productos(supabase, _version_catalogo(supabase))
+    except Exception:
+        st.error("Error al obtener productos")
+        return []
+
+
+def ids_por_nombre(productos):
+    return {p["nombre"]: p["id"] for p in productos}
+
@@ -0,0 +1,22 @@
+import streamlit as st
+
+
+# Fondo de imagen de las paginas (el mismo bloque de CSS que repetia cada pagina)
+
+FONDO_ATARDECER = "https://cdn.pixabay.com/photo/2021/08/15/08/31/sunset-6547166_1280.jpg"
+
+
+def fondo(url=FONDO_ATARDECER):
+    st.markdown(
+        f"""
+        <style>
+        .stApp {{
+            background-image: url("{url}");
+            background-size: cover;
+            background-position: center;
+            background-attachment: fixed;
+        }}
+        </style>
+        """,
+        unsafe_allow_html=True
+    )
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+# Reduccion de series largas antes de mandarlas a una grafica de lineas.
+# Por producto, la serie se parte en tramos de igual cantidad de puntos y de cada tramo se
+# conserva el minimo y el maximo (mas el primer y el ultimo punto de la serie): los picos
+# se siguen viendo, que es lo que se pierde con un promedio o tomando uno de cada N.
+# Si la serie ya entra en el presupuesto no se toca, asi que al acercar la vista a un rango
+# angosto se grafica con todos los puntos.
+
+# pixeles de ancho por punto graficado (con 800 px, hasta 400 puntos por producto)
+PIXELES_POR_PUNTO = 2
+
+
+def puntos_para_ancho(ancho):
+    return max(4, ancho // PIXELES_POR_PUNTO)
+
+
+def indices_min_max(y, puntos):
+    """Posiciones de y (sin NaN) que se conservan para dibujarla con a lo sumo puntos puntos."""
+    n = len(y)
+    if n <= puntos:
+        return np.arange(n)
+    tramos = max(1, (puntos - 2) // 2)
+    # bordes con linspace: los tramos difieren en a lo sumo un punto y ninguno queda vacio
+    # (con largo fijo hacia arriba los ultimos tramos eran relleno y sobraba presupuesto)
+    inicio = np.linspace(0, n, tramos + 1).astype(np.int64)[:-1]
+    tramo = np.repeat(np.arange(tramos), np.diff(np.append(inicio, n)))
+    i_min = _primera_posicion(y == np.minimum.reduceat(y, inicio)[tramo], tramo)
+    i_max = _primera_posicion(y == np.maximum.reduceat(y, inicio)[tramo], tramo)
+    return np.unique(np.concatenate(([0, n - 1], i_min, i_max)))
+
+
+def _primera_posicion(marcadas, tramo):
+    # primera posicion marcada de cada tramo (reduceat da el valor, no donde esta)
+    posiciones = np.flatnonzero(marcadas)
+    _, primeras = np.unique(tramo[posiciones], return_index=True)
+    return posiciones[primeras]
+
+
+def reducir_series(df, columna, puntos, grupo="producto_id"):
+    """
+    Filas de df (ordenado por grupo y fecha) que se grafican para columna: todas si cada
+    serie tiene a lo sumo puntos puntos, si no el minimo y el maximo de cada tramo.
+    """
+    df = df[df[columna].notna()]
+    y = df[columna].to_numpy(dtype=float)
+    posiciones = [pos[indices_min_max(y[pos], puntos)] for pos in df.groupby(grupo, sort=False).indices.values()]
+    if not posiciones:
+        return df
+    return df.iloc[np.sort(np.concatenate(posiciones))]
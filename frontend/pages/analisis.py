@@ -2,8 +2,13 @@ import streamlit as st
 import os
 import pandas as pd
 import altair as alt
+from datetime import date
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from catalogo import obtener_catalogo
+from cache_consultas import consultar, estado_cache
+from muestreo import puntos_para_ancho, reducir_series
+from tipos_datos import memoria_mb, tipar_precios
 from PIL import Image
 
 # ======== CARGA DE VARIABLES .ENV ========
@@ -12,6 +17,10 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# ancho fijo de las graficas del comparador (define cuantos puntos se les mandan, asi
+# que no se estiran al ancho del contenedor)
+ANCHO_GRAFICA = 800
+
 # ======== CSS PARA FONDO DE IMAGEN ========
 def set_background():
     st.markdown(
@@ -30,19 +39,62 @@ def set_background():
 
 # ======== FUNCIONES DE CONSULTA ========
 def get_productos():
-    res = supabase.rpc("obtener_productos").execute()
-    if res.data is None:
-        st.error("Error cargando productos")
-        return []
-    return res.data
+    return obtener_catalogo(supabase)
+
+# las consultas de datos pasan por la cache compartida (ver cache_consultas.py):
+# un cambio de widget ya no vuelve a consultar la base mientras nadie escriba
+# historico de todos los productos seleccionados en una sola llamada, solo del rango
+# de meses desde..hasta (None = sin limite); el filtro lo hace la base
+# (ids ordenados: la misma seleccion en otro orden usa la misma entrada de la cache)
+def get_precios_historicos(producto_ids, desde=None, hasta=None):
+    params = {"prod_ids": sorted(producto_ids), "p_desde": desde, "p_hasta": hasta}
+    try:
+        return consultar(supabase, "obtener_precios_historicos_productos", params, tipar=tipar_precios)
+    except Exception:
+        st.error("Error cargando datos históricos")
+        return pd.DataFrame()
+
+def get_anios(producto_ids):
+    try:
+        return consultar(supabase, "obtener_anios_productos", {"prod_ids": sorted(producto_ids)}, tipar=tipar_precios)
+    except Exception:
+        return pd.DataFrame()
 
-def get_precios_historicos(producto_id):
-    res = supabase.rpc("obtener_precios_historicos_completos", {"prod_id": producto_id}).execute()
+def get_consulta(rpc):
+    try:
+        return consultar(supabase, rpc, tipar=tipar_precios)
+    except Exception:
+        return pd.DataFrame()
+
+# planes guardados por capturar_planes() (ultima captura de cada consulta obtener_*)
+def get_capturas_plan():
+    res = supabase.rpc("obtener_capturas_plan").execute()
     if res.data is None:
-        st.error("Error cargando datos históricos")
         return pd.DataFrame()
     return pd.DataFrame(res.data)
 
+def render_capturas_plan():
+    # solo lectura: capturar_planes() corre EXPLAIN ANALYZE de todas las consultas
+    # monitoreadas, no se dispara desde el dashboard sino con pg_cron
+    with st.expander("🩺 Planes capturados y regresiones"):
+        capturas = get_capturas_plan()
+        if capturas.empty:
+            st.info("Todavía no hay capturas. Programa capturar_planes() con pg_cron.")
+            return
+
+        for _, fila in capturas[capturas["regresiones"].str.len() > 0].iterrows():
+            st.error(f"❌ {fila['consulta']}: " + "; ".join(fila["regresiones"]))
+
+        st.dataframe(
+            capturas[["consulta", "fecha", "ejecucion_ms", "ejecucion_ms_anterior", "filas_resultado", "regresiones"]],
+            use_container_width=True,
+        )
+        consulta = st.selectbox("Ver plan de", capturas["consulta"])
+        fila = capturas[capturas["consulta"] == consulta].iloc[0]
+        st.write("Lecturas por tabla:", fila["accesos"])
+        st.write("Filas por tabla al capturar:", fila["filas_tablas"])
+        st.json(fila["plan"], expanded=False)
+
 # ======== MAIN ========
 def main():
     set_background()
@@ -83,86 +135,97 @@ def main():
         st.info("Selecciona al menos un producto para visualizar datos.")
         return
 
-    # Mapeo para los nombres de los meses con primera letra mayúscula
-    meses_map = {
-        'Enero': 1, 'Febrero': 2, 'Marzo': 3, 'Abril': 4, 'Mayo': 5, 'Junio': 6,
-        'Julio': 7, 'Agosto': 8, 'Septiembre': 9, 'Octubre': 10, 'Noviembre': 11, 'Diciembre': 12
-    }
+    ids = [opciones[nombre] for nombre in seleccionados]
 
-    df_total = pd.DataFrame()
+    # Filtro por año con opción "Todos": los años salen de la tabla de resumen y solo se
+    # baja el año elegido
+    anios = get_anios(ids)
+    anios_opciones = ["Todos"] + [str(a) for a in anios.get("anio", [])]
 
-    for nombre in seleccionados:
-        producto_id = opciones[nombre]
-        df = get_precios_historicos(producto_id)
-
-        if df.empty:
-            continue
-
-        # Normaliza meses y crea fecha
-        df["mes"] = df["mes"].str.capitalize()  # 'enero' -> 'Enero'
-        df["mes_num"] = df["mes"].map(meses_map)
-        df["fecha"] = pd.to_datetime(dict(year=df["anio"], month=df["mes_num"], day=1), errors='coerce')
-        df["producto"] = nombre
-        df_total = pd.concat([df_total, df], ignore_index=True)
+    anio_seleccionado = st.selectbox("📅 Filtrar por año", anios_opciones)
 
-    if df_total.empty or df_total["fecha"].isna().all():
+    if anio_seleccionado == "Todos" and not anios.empty:
+        # zoom: un rango mas angosto se pide a la base y, si entra en el presupuesto de
+        # puntos de la grafica, se dibuja sin reducir
+        primero = date(int(anios["anio"].min()), 1, 1)
+        ultimo = date(int(anios["anio"].max()), 12, 1)
+        desde, hasta = st.slider("🔍 Acercar a un rango", min_value=primero, max_value=ultimo,
+                                 value=(primero, ultimo), format="MM/YYYY")
+        if (desde, hasta) == (primero, ultimo):
+            df_total = get_precios_historicos(ids)
+        else:
+            df_total = get_precios_historicos(ids, desde.isoformat(), hasta.isoformat())
+    elif anio_seleccionado == "Todos":
+        df_total = get_precios_historicos(ids)
+    else:
+        df_total = get_precios_historicos(ids, f"{anio_seleccionado}-01-01", f"{anio_seleccionado}-12-01")
+    if df_total.empty:
         st.warning("No se pudieron construir las fechas para graficar.")
         return
-    
-    # Crear filtro por año
-    # Crear filtro por año con opción "Todos"
-    anios_disponibles = sorted(df_total["anio"].dropna().unique())
-    anios_opciones = ["Todos"] + [str(a) for a in anios_disponibles]
+    st.caption(f"Histórico: {len(df_total)} filas, {memoria_mb(df_total)} MB por sesión "
+               f"(sin tipar: {df_total.attrs.get('mb_sin_tipar', '?')} MB)")
 
-    anio_seleccionado = st.selectbox("📅 Filtrar por año", anios_opciones)
+    # la fecha ya viene de la base como datetime64 (periodo, primer dia del mes, ver tipos_datos.py)
+    df_total = df_total.rename(columns={"periodo": "fecha"})
+    nombres = {id_: nombre for nombre, id_ in opciones.items()}
+    df_total["producto"] = pd.Categorical(df_total["producto_id"].map(nombres))
 
-    if anio_seleccionado != "Todos":
-        anio_num = int(anio_seleccionado)
-        df_total = df_total[df_total["anio"] == anio_num]
+    if df_total["fecha"].isna().all():
+        st.warning("No se pudieron construir las fechas para graficar.")
+        return
 
 
 
     # ====================== GRÁFICAS =========================
+    # a cada grafica solo van las columnas que usa y, si las series son mas largas que
+    # lo que se distingue en su ancho, el minimo y el maximo de cada tramo (ver muestreo.py)
+    puntos = puntos_para_ancho(ANCHO_GRAFICA)
+    df_total = df_total.dropna(subset=["fecha"])
+    df_usd = reducir_series(df_total, "ponderado_usd", puntos)[["fecha", "producto", "ponderado_usd"]]
+    df_kg = reducir_series(df_total, "ponderado_usd_kg", puntos)[["fecha", "producto", "ponderado_usd_kg"]]
+    if len(df_usd) < df_total["ponderado_usd"].notna().sum():
+        st.caption(f"Se grafican {len(df_usd)} de {df_total['ponderado_usd'].notna().sum()} puntos "
+                   "(mínimo y máximo por tramo); acerca el rango para ver todos.")
+
     st.subheader("📊 Precio Ponderado Total (USD)")
-    chart_usd = alt.Chart(df_total.dropna(subset=["fecha"])).mark_line(
+    chart_usd = alt.Chart(df_usd).mark_line(
         point=True,
         opacity=0.5
     ).encode(
         x="fecha:T",
         y=alt.Y("ponderado_usd:Q", title="Precio USD"),
         color="producto:N",
-        tooltip=["producto", "fecha:T", "ponderado_usd"]
+        tooltip=["producto", "fecha:T", alt.Tooltip("ponderado_usd:Q", format=".2f")]
     ).properties(
-        width=800,
+        width=ANCHO_GRAFICA,
         height=400,
         background='rgba(0, 0, 0, 0.6)'  # <- fondo totalmente transparente
     )
 
-    st.altair_chart(chart_usd, use_container_width=True)
+    st.altair_chart(chart_usd, use_container_width=False)
 
 
     st.subheader("📊 Precio Ponderado por KG (USD/kg)")
-    chart_kg = alt.Chart(df_total.dropna(subset=["fecha"])).mark_line(point=True).encode(
+    chart_kg = alt.Chart(df_kg).mark_line(point=True).encode(
         x="fecha:T",
         y=alt.Y("ponderado_usd_kg:Q", title="Precio USD/kg"),
         color="producto:N",
-        tooltip=["producto", "fecha:T", "ponderado_usd_kg"]
-    ).properties(width=800, height=400,background='rgba(0, 0, 0, 0.6)')
-    st.altair_chart(chart_kg, use_container_width=True)
+        tooltip=["producto", "fecha:T", alt.Tooltip("ponderado_usd_kg:Q", format=".2f")]
+    ).properties(width=ANCHO_GRAFICA, height=400,background='rgba(0, 0, 0, 0.6)')
+    st.altair_chart(chart_kg, use_container_width=False)
 
 
 
     #Consultas avanzadas
 
     st.subheader("📊 Promedio de Precios por Producto y Año")
-    promedio_res = supabase.rpc("obtener_promedio_usd_por_anio").execute()
-    if promedio_res.data:
-        df_promedio = pd.DataFrame(promedio_res.data)
+    df_promedio = get_consulta("obtener_promedio_usd_por_anio")
+    if not df_promedio.empty:
         chart1 = alt.Chart(df_promedio).mark_line(point=True).encode(
             x="anio:O",
             y="promedio_usd:Q",
             color="nombre:N",
-            tooltip=["nombre", "anio", "promedio_usd"]
+            tooltip=["nombre", "anio", alt.Tooltip("promedio_usd:Q", format=".2f")]
         ).properties(
             width=750,
             height=400,
@@ -173,13 +236,12 @@ def main():
         st.info("No hay datos disponibles para promedio.")
 
     st.subheader("📉 Variación Máxima de Precio por Producto")
-    variacion_res = supabase.rpc("obtener_variacion_maxima_usd").execute()
-    if variacion_res.data:
-        df_var = pd.DataFrame(variacion_res.data)
+    df_var = get_consulta("obtener_variacion_maxima_usd")
+    if not df_var.empty:
         chart2 = alt.Chart(df_var).mark_bar().encode(
             x=alt.X("variacion:Q", title="Variación USD"),
             y=alt.Y("nombre:N", sort='-x'),
-            tooltip=["nombre", "variacion"]
+            tooltip=["nombre", alt.Tooltip("variacion:Q", format=".2f")]
         ).properties(
             width=750,
             height=400,
@@ -231,6 +293,12 @@ def main():
             else:
                 st.warning("No se recibió ningún plan.")
 
+    render_capturas_plan()
+
+    cache = estado_cache()
+    st.caption(f"Cache de consultas: {cache['entradas']} entradas, {cache['mb']} de {cache['mb_maximo']} MB, "
+               f"{cache['aciertos']} aciertos / {cache['fallos']} consultas a la base")
+
 
 
 
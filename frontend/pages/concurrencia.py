@@ -3,6 +3,7 @@ import asyncio
 from supabase import create_client
 import os
 from dotenv import load_dotenv
+from catalogo import obtener_catalogo, ids_por_nombre
 from datetime import datetime
 import random
 
@@ -14,24 +15,29 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-def insertar_o_actualizar_precio(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado):
+def insertar_o_actualizar_precio(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado, p_producto_id=None):
+    # una sola llamada: insertar_precios_productor_lote tambien registra al usuario simulado
+    # con el id del catalogo la funcion no busca el producto por nombre
     params = {
-        "p_anio": p_anio,
-        "p_mes": p_mes,
-        "p_nombre_producto": p_nombre_producto,
-        "p_ponderado_usd": p_ponderado_usd,
-        "p_ponderado_usd_kg": p_ponderado_usd_kg,
+        "p_precios": [{
+            "anio": p_anio,
+            "mes": p_mes,
+            "producto_id": p_producto_id,
+            "nombre_producto": p_nombre_producto,
+            "ponderado_usd": p_ponderado_usd,
+            "ponderado_usd_kg": p_ponderado_usd_kg
+        }],
         "p_usuario_simulado": p_usuario_simulado
     }
-    supabase.rpc('insertar_usuario_simulado',{"p_nombre":p_usuario_simulado , "p_correo": (p_usuario_simulado + "@gmail.com") }).execute()
-    res = supabase.rpc("insertar_precio_productor", params).execute()
+    res = supabase.rpc("insertar_precios_productor_lote", params).execute()
     return res
 
-async def concurrent_update(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado, iteracion, logs):
+async def concurrent_update(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado, iteracion, logs, p_producto_id=None):
     await asyncio.sleep(random.uniform(0, 0.5))
-    res = insertar_o_actualizar_precio(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado)
-    if res.data is None:
-        logs.append(f"❌ [{datetime.now().strftime('%H:%M:%S')}] Usuario '{p_usuario_simulado}' Iter {iteracion}: ERROR - {res.error.message}")
+    res = insertar_o_actualizar_precio(p_anio, p_mes, p_nombre_producto, p_ponderado_usd, p_ponderado_usd_kg, p_usuario_simulado, p_producto_id)
+    if not res.data or res.data[0]["resultado"] == "error":
+        mensaje = res.data[0]["mensaje"] if res.data else "sin respuesta"
+        logs.append(f"❌ [{datetime.now().strftime('%H:%M:%S')}] Usuario '{p_usuario_simulado}' Iter {iteracion}: ERROR - {mensaje}")
     else:
         logs.append(f"✅ [{datetime.now().strftime('%H:%M:%S')}] Usuario '{p_usuario_simulado}' Iter {iteracion}: OK")
 
@@ -55,9 +61,9 @@ def main():
     )
 
 
-    productos_res = supabase.rpc("obtener_productos").execute()
-    productos = productos_res.data or []
-    opciones_productos = [p['nombre'] for p in productos]
+    productos = obtener_catalogo(supabase)
+    producto_ids = ids_por_nombre(productos)
+    opciones_productos = list(producto_ids)
 
     usar_datos_fijos = st.radio("Selecciona modo de datos para actualización:", 
                                ["Datos predefinidos (Año 2013, Enero, Aguacate fuerte, precio 0)", 
@@ -103,7 +109,7 @@ def main():
                     tasks.append(concurrent_update(
                         p_anio, p_mes, p_nombre_producto,
                         round(usd_variacion, 2), round(usd_kg_variacion, 2),
-                        usuario, iteracion, logs
+                        usuario, iteracion, logs, producto_ids.get(p_nombre_producto)
                     ))
             await asyncio.gather(*tasks)
 
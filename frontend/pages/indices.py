@@ -0,0 +1,68 @@
+import streamlit as st
+import os
+from supabase import create_client
+from dotenv import load_dotenv
+import pandas as pd
+from estilo import fondo
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+SEGUNDOS_ANALISIS = 10 * 60  # cuanto se reusa el resultado del asesor
+
+fondo()
+
+
+st.title("🗂️ Asesor de Índices")
+st.markdown(
+    "Índices redundantes, sin uso y faltantes según las estadísticas de la base desde el último reset "
+    "(las lecturas y escrituras que hicieron los RPC y las simulaciones). "
+    "Los faltantes salen de los planes guardados por `capturar_planes()`."
+)
+
+filas_minimas = st.number_input("🔢 Filas descartadas por un Seq Scan para sugerir un índice",
+                                min_value=1, value=1000, step=100)
+
+# el asesor corre en la base: lee el catalogo, pg_stat_user_indexes y pg_stat_statements.
+# Las estadisticas cambian despacio, asi que el resultado se reusa entre reruns y sesiones
+@st.cache_data(ttl=SEGUNDOS_ANALISIS, show_spinner="Analizando índices...")
+def analizar(filas_minimas):
+    response = supabase.rpc("analizar_indices", {"p_filas_minimas": filas_minimas}).execute()
+    return pd.DataFrame(response.data or [])
+
+
+if st.button("🔄 Volver a analizar"):
+    analizar.clear()
+
+df = analizar(filas_minimas)
+if df.empty:
+    st.success("✅ No hay hallazgos.")
+    st.stop()
+
+ICONOS = {"redundante": "♻️", "sin_uso": "💤", "faltante": "🔍"}
+TITULOS = {
+    "redundante": "Índices redundantes",
+    "sin_uso": "Índices sin uso",
+    "faltante": "Índices faltantes",
+}
+
+c1, c2, c3 = st.columns(3)
+c1.metric("♻️ Redundantes", int((df["hallazgo"] == "redundante").sum()))
+c2.metric("💤 Sin uso", int((df["hallazgo"] == "sin_uso").sum()))
+c3.metric("🔍 Faltantes", int((df["hallazgo"] == "faltante").sum()))
+
+st.caption(
+    "escrituras_indice: entradas que escribe el índice (filas insertadas + actualizaciones no HOT de la tabla); "
+    "es lo que se ahorra al borrarlo o lo que cuesta crearlo. "
+    "beneficio_lectura: lecturas que usaron el índice, o filas que no habría que leer si se crea."
+)
+
+for hallazgo, grupo in df.groupby("hallazgo", sort=False):
+    st.markdown(f"### {ICONOS.get(hallazgo, '')} {TITULOS.get(hallazgo, hallazgo)}")
+    st.dataframe(
+        grupo[["tabla", "indice", "columnas", "detalle", "tamano_bytes", "escrituras_indice", "beneficio_lectura"]],
+        use_container_width=True,
+    )
+    st.code("\n".join(grupo["sugerencia"]), language="sql")
@@ -2,27 +2,15 @@ import streamlit as st
 import os
 from supabase import create_client
 from dotenv import load_dotenv
-import pandas as pd
-import json
+from tipos_datos import memoria_mb, tipar_logs
+from estilo import fondo
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-st.markdown(
-    """
-    <style>
-    .stApp {
-        background-image: url("https://cdn.pixabay.com/photo/2021/08/15/08/31/sunset-6547166_1280.jpg");
-        background-size: cover;
-        background-position: center;
-        background-attachment: fixed;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+fondo()
 
 
 
@@ -38,12 +26,9 @@ if not response.data:
     st.info("No se encontraron logs.")
   
 
-df = pd.DataFrame(response.data)
-
-# Procesamiento de campos
-df["fecha"] = pd.to_datetime(df["fecha"]).dt.strftime("%Y-%m-%d %H:%M:%S")
-df["datos_antes"] = df["datos_antes"].apply(lambda x: json.dumps(x, indent=2) if x else "")
-df["datos_despues"] = df["datos_despues"].apply(lambda x: json.dumps(x, indent=2) if x else "")
+# fecha como datetime64, usuario/tabla/operacion como categorias y los JSON como texto
+df = tipar_logs(response.data)
+st.caption(f"{len(df)} registros, {memoria_mb(df)} MB en memoria (sin tipar: {df.attrs.get('mb_sin_tipar', '?')} MB)")
 
 # Filtros
 operaciones = ["Todos"] + sorted(df["operacion"].unique())
@@ -76,6 +61,6 @@ def colorear_filas_por_operacion(row):
 
 
 
-styled_df = df_filtrado[["fecha", "usuario_simulado", "tabla_afectada", "operacion", "datos_antes", "datos_despues"]].style.apply(colorear_filas_por_operacion, axis=1)
+styled_df = df_filtrado[["fecha", "usuario_simulado", "tabla_afectada", "operacion", "datos_antes", "datos_despues"]].style.apply(colorear_filas_por_operacion, axis=1).format({"fecha": "{:%Y-%m-%d %H:%M:%S}"})
 
 st.dataframe(styled_df, use_container_width=True)
@@ -1,7 +1,10 @@
 import streamlit as st
+import pandas as pd
 import os
 from supabase import create_client
 from dotenv import load_dotenv
+from catalogo import obtener_catalogo, ids_por_nombre
+from cache_consultas import refrescar_version
 
 load_dotenv()
 
@@ -11,27 +14,30 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
 
-# === Obtener productos desde Supabase ===
-def get_productos():
-    res = supabase.rpc("obtener_productos").execute()
-    if res.data is None:
-        st.error("Error al obtener productos")
-        return []
-    return res.data
+MESES = [
+    'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+    'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'
+]
 
-# === Llamar a la función insertar_precio_productor ===
-def insertar_precio(anio, mes, nombre_producto, precio_usd, precio_kg, usuario):
+# === Llamar a la función insertar_precios_productor_lote ===
+# Una sola llamada (y una sola transacción) para todos los precios; también registra al usuario.
+def insertar_precios_lote(precios, usuario):
     params = {
-        "p_anio": anio,
-        "p_mes": mes,
-        "p_nombre_producto": nombre_producto,
-        "p_ponderado_usd": precio_usd,
-        "p_ponderado_usd_kg": precio_kg,
+        "p_precios": precios,
         "p_usuario_simulado": usuario
     }
-    supabase.rpc('insertar_usuario_simulado',{"p_nombre":usuario , "p_correo": (usuario + "@gmail.com") }).execute()
-    res = supabase.rpc("insertar_precio_productor", params).execute()
-    return res
+    res = supabase.rpc("insertar_precios_productor_lote", params).execute()
+    return res.data or []
+
+def insertar_precio(anio, mes, producto_id, precio_usd, precio_kg, usuario):
+    precio = {
+        "anio": anio,
+        "mes": mes,
+        "producto_id": producto_id,
+        "ponderado_usd": precio_usd,
+        "ponderado_usd_kg": precio_kg
+    }
+    return insertar_precios_lote([precio], usuario)
 
 # === UI STREAMLIT ===
 def render_registro():
@@ -52,18 +58,16 @@ def render_registro():
 )
 
 
-    productos = get_productos()
+    productos = obtener_catalogo(supabase)
     if not productos:
         return
 
-    producto_nombres = [p["nombre"] for p in productos]
+    producto_ids = ids_por_nombre(productos)
+    producto_nombres = list(producto_ids)
     producto_seleccionado = st.selectbox("📦 Producto", producto_nombres)
 
     anio = st.selectbox("📅 Año", list(range(2013, 2026)))
-    mes = st.selectbox("📆 Mes", [
-        'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
-        'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'
-    ])
+    mes = st.selectbox("📆 Mes", MESES)
 
     precio_usd = st.number_input("💰 Precio ponderado USD", min_value=0.0, step=0.01, format="%.2f")
     precio_usd_kg = st.number_input("⚖️ Precio ponderado USD/Kg", min_value=0.0, step=0.01, format="%.2f")
@@ -73,12 +77,63 @@ def render_registro():
         if not usuario.strip():
             st.warning("⚠️ Debes ingresar un nombre de usuario.")
             return
-        resultado = insertar_precio(anio, mes, producto_seleccionado, precio_usd, precio_usd_kg, usuario)
-        if resultado is None:
-            st.error(f"❌ Error al insertar: {resultado.error.message}")
+        resultado = insertar_precio(anio, mes, producto_ids[producto_seleccionado], precio_usd, precio_usd_kg, usuario)
+        if not resultado or resultado[0]["resultado"] == "error":
+            mensaje = resultado[0]["mensaje"] if resultado else "sin respuesta"
+            st.error(f"❌ Error al insertar: {mensaje}")
         else:
+            refrescar_version()
             st.success("✅ Precio registrado o actualizado correctamente.")
 
+    render_carga_masiva(producto_ids, usuario)
+
+# === Correcciones en lote (una sola llamada) ===
+def render_carga_masiva(producto_ids, usuario):
+    st.subheader("📋 Carga masiva de correcciones")
+    vacio = pd.DataFrame({
+        "anio": pd.Series(dtype="Int64"),
+        "mes": pd.Series(dtype="object"),
+        "nombre_producto": pd.Series(dtype="object"),
+        "ponderado_usd": pd.Series(dtype="float"),
+        "ponderado_usd_kg": pd.Series(dtype="float"),
+    })
+    editado = st.data_editor(
+        vacio,
+        num_rows="dynamic",
+        use_container_width=True,
+        column_config={
+            "anio": st.column_config.NumberColumn("Año", min_value=2013, max_value=2100, step=1),
+            "mes": st.column_config.SelectboxColumn("Mes", options=MESES),
+            "nombre_producto": st.column_config.SelectboxColumn("Producto", options=list(producto_ids)),
+            "ponderado_usd": st.column_config.NumberColumn("USD", min_value=0.0, format="%.2f"),
+            "ponderado_usd_kg": st.column_config.NumberColumn("USD/Kg", min_value=0.0, format="%.2f"),
+        },
+        key="carga_masiva",
+    )
+
+    if st.button("💾 Guardar lote"):
+        if not usuario.strip():
+            st.warning("⚠️ Debes ingresar un nombre de usuario.")
+            return
+        filas = editado.dropna(how="all")
+        if filas.empty:
+            st.warning("⚠️ No hay filas para guardar.")
+            return
+        # NaN no es JSON valido: las celdas vacias se mandan como null
+        # se manda el id del catalogo; el nombre queda solo para los mensajes de error
+        filas = filas.assign(producto_id=filas["nombre_producto"].map(producto_ids).astype("Int64"))
+        precios = filas.astype(object).where(filas.notna(), None).to_dict(orient="records")
+        resultado = pd.DataFrame(insertar_precios_lote(precios, usuario))
+        if resultado.empty:
+            st.error("❌ Error al insertar el lote")
+            return
+        refrescar_version()
+        conteo = resultado["resultado"].value_counts()
+        st.success(f"✅ {conteo.get('insertado', 0)} insertados, {conteo.get('actualizado', 0)} actualizados")
+        if conteo.get("error", 0):
+            st.error(f"❌ {conteo['error']} filas con error")
+        st.dataframe(resultado, use_container_width=True)
+
 # === Ejecutar ===
 if __name__ == "__main__":
     render_registro()
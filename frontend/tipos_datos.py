@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# Conversion de los resultados de los RPC (listas de dicts JSON) a DataFrames con tipos
+# compactos: cada sesion de Streamlit guarda sus propias copias, asi que la memoria por
+# sesion es lo que limita cuantos usuarios entran en un servidor. Textos repetidos como
+# categorias, años y meses en enteros chicos, la fecha ya como datetime64 y los precios
+# en float32 (sobra para dos decimales). Cada frame guarda en attrs["mb_sin_tipar"] lo que
+# ocupaba como lo arma pandas, para mostrar la reduccion junto a memoria_mb(df).
+
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+         'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+COLUMNAS_PRECIO = ["ponderado_usd", "ponderado_usd_kg", "promedio_usd", "variacion"]
+COLUMNAS_TEXTO_PRECIOS = ["nombre", "producto", "unidad"]
+COLUMNAS_TEXTO_LOGS = ["usuario_simulado", "tabla_afectada", "operacion"]
+
+
+def _categorias(df, columnas):
+    # solo conviene si el texto se repite (en variacion hay un nombre por fila)
+    for columna in columnas:
+        if columna in df and df[columna].nunique() <= len(df) // 2:
+            df[columna] = df[columna].astype("category")
+
+
+def tipar_precios(datos):
+    """DataFrame tipado de un RPC de precios (historicos, promedios, variacion, años)."""
+    df = pd.DataFrame(datos)
+    if df.empty:
+        return df
+    mb_sin_tipar = memoria_mb(df)
+    if "producto_id" in df:
+        df["producto_id"] = df["producto_id"].astype(np.int32)
+    if "anio" in df:
+        df["anio"] = df["anio"].astype(np.int16)
+    if "periodo" in df:
+        df["periodo"] = pd.to_datetime(df["periodo"], errors="coerce")
+        # el mes sale de periodo; el texto del mes no se guarda.
+        # Int8 admite nulos: un periodo vacio o invalido (NaT) queda como <NA>
+        df["mes"] = df["periodo"].dt.month.astype("Int8")
+    elif "mes" in df:
+        # un nombre que no esta en MESES queda como <NA> en vez de fallar
+        numeros = {m.lower(): i + 1 for i, m in enumerate(MESES)} | {"setiembre": 9}
+        df["mes"] = df["mes"].str.strip().str.lower().map(numeros).astype("Int8")
+    for columna in COLUMNAS_PRECIO:
+        if columna in df:
+            df[columna] = pd.to_numeric(df[columna], errors="coerce").astype(np.float32)
+    _categorias(df, COLUMNAS_TEXTO_PRECIOS)
+    df.attrs["mb_sin_tipar"] = mb_sin_tipar
+    return df
+
+
+def tipar_logs(datos):
+    """DataFrame tipado de obtener_logs_auditoria; datos_antes/despues quedan como texto JSON."""
+    df = pd.DataFrame(datos)
+    if df.empty:
+        return df
+    mb_sin_tipar = memoria_mb(df)
+    df["fecha"] = pd.to_datetime(df["fecha"])
+    for columna in ["datos_antes", "datos_despues"]:
+        df[columna] = df[columna].map(lambda x: json.dumps(x, indent=2) if x else "")
+    _categorias(df, COLUMNAS_TEXTO_LOGS)
+    df.attrs["mb_sin_tipar"] = mb_sin_tipar
+    return df
+
+
+def memoria_mb(df):
+    """MB que ocupa df contando el contenido de los textos (deep)."""
+    return round(df.memory_usage(index=True, deep=True).sum() / 1024 ** 2, 3)